@@ -1,9 +1,15 @@
 # app/api/v1/routes_chatbot.py
+import json
+import logging
+import time
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import SessionLocal, get_db
 from app.api.v1.deps import get_current_user
 from app.models.user import Users
 from app.models.chatbot import Chatbot, ChatbotDetail, ChatbotStatus
@@ -12,14 +18,20 @@ from app.schemas.chatbot import (
     ChatbotSessionWithMessages
 )
 from app.services.chatbot_service import (
+    CHATBOT_FALLBACK_ANSWER,
     get_or_create_chatbot_session,
     send_message_to_gemini,
+    stream_message_from_gemini,
     save_chat_message,
-    get_chat_history,
     end_chatbot_session
 )
+from app.services.chat_context_service import get_chat_context, summary_updater
+from app.services.executor_service import ExecutorBusyError, StageTimeoutError, run_io
+from app.services.llm_gateway import LLMUnavailableError
 from app.services.permissions import require_perm
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/chatbot", tags=["chatbot"])
 
 # ===================== SESSIONS =====================
@@ -175,12 +187,15 @@ def send_message(
         db=db
     )
     
-    # Lấy lịch sử chat để context
-    chat_history = get_chat_history(chatbot.chatbot_id, db)
+    # Ngữ cảnh: tóm tắt cuốn chiếu + vài lượt gần nhất (trong ngân sách token)
+    summary, chat_history = get_chat_context(chatbot, db, payload.question)
     
     # Gọi Gemini để lấy câu trả lời
     try:
-        answer = send_message_to_gemini(payload.question, chat_history)
+        answer = send_message_to_gemini(payload.question, chat_history, summary)
+    except LLMUnavailableError:
+        # không lưu câu trả lời dự phòng vào lịch sử chat
+        raise HTTPException(status_code=503, detail=CHATBOT_FALLBACK_ANSWER)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -191,6 +206,8 @@ def send_message(
         answer=answer,
         db=db
     )
+    # gộp các lượt cũ vào tóm tắt ở nền (không chặn response)
+    summary_updater.schedule(chatbot.chatbot_id)
     
     return ChatbotMessageOut(
         detail_id=detail.detail_id,
@@ -200,6 +217,110 @@ def send_message(
         created_at=detail.created_at
     )
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def _prepare_turn(user_id: int, chatbot_id: int | None, question: str):
+    # session riêng của thread trong io pool: session của request bị đóng khi stage timeout
+    db = SessionLocal()
+    try:
+        chatbot = get_or_create_chatbot_session(user_id=user_id, chatbot_id=chatbot_id, db=db)
+        return chatbot.chatbot_id, *get_chat_context(chatbot, db, question)
+    finally:
+        db.close()
+
+def _save_streamed_answer(chatbot_id: int, question: str, answer: str) -> ChatbotDetail:
+    # session riêng: session của request có thể đã đóng khi stream kết thúc
+    db = SessionLocal()
+    try:
+        return save_chat_message(chatbot_id=chatbot_id, question=question, answer=answer, db=db)
+    finally:
+        db.close()
+
+@router.post("/messages/stream", dependencies=[Depends(require_perm("self:read"))])
+async def send_message_stream(
+    payload: ChatbotMessageCreate,
+    user: Users = Depends(get_current_user)
+):
+    """
+    Như POST /messages nhưng trả câu trả lời dạng SSE theo từng đoạn text:
+    - event "session": {chatbot_id}
+    - event "token"  : {text}
+    - event "done"   : tin nhắn đã lưu + source (local|llm) / retrieval_ms / ttft_ms / total_ms
+    - event "error"  : {detail} (không lưu gì vào lịch sử)
+    Câu trả lời chỉ được lưu vào ChatbotDetail khi stream hoàn tất.
+    """
+    try:
+        chatbot_id, summary, chat_history = await run_io(
+            _prepare_turn, user.user_id, payload.chatbot_id, payload.question,
+            timeout=settings.STAGE_TIMEOUT_DB_S, stage="db",
+        )
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=f"Server đang bận, vui lòng thử lại: {e}")
+    except StageTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+    async def events():
+        yield _sse("session", {"chatbot_id": chatbot_id})
+
+        metrics: dict = {}
+        parts = []
+        t0 = time.perf_counter()
+        try:
+            async for chunk in stream_message_from_gemini(payload.question, chat_history, metrics, summary):
+                parts.append(chunk)
+                yield _sse("token", {"text": chunk})
+        except LLMUnavailableError as e:
+            logger.warning(f"[Chatbot] Stream lỗi sau {len(parts)} đoạn: {e}")
+            yield _sse("error", {"detail": CHATBOT_FALLBACK_ANSWER})
+            return
+        except ValueError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+
+        answer = "".join(parts).strip()
+        if not answer:
+            yield _sse("error", {"detail": "Gemini trả về câu trả lời rỗng"})
+            return
+
+        try:
+            detail = await run_io(
+                _save_streamed_answer, chatbot_id, payload.question, answer,
+                timeout=settings.STAGE_TIMEOUT_DB_S, stage="db",
+            )
+        except (ExecutorBusyError, StageTimeoutError) as e:
+            logger.error(f"[Chatbot] Không lưu được câu trả lời: {e}")
+            yield _sse("error", {"detail": "Không lưu được câu trả lời, vui lòng thử lại"})
+            return
+
+        summary_updater.schedule(chatbot_id)
+        total_ms = round((time.perf_counter() - t0) * 1000, 1)
+        logger.info(
+            f"[Chatbot] chatbot_id={chatbot_id} source={metrics.get('source')} "
+            f"retrieval={metrics.get('retrieval_ms')}ms ttft={metrics.get('ttft_ms')}ms "
+            f"llm={metrics.get('total_ms')}ms total={total_ms}ms"
+        )
+        yield _sse("done", {
+            **ChatbotMessageOut(
+                detail_id=detail.detail_id,
+                chatbot_id=detail.chatbot_id,
+                question=detail.question,
+                answer=detail.answer,
+                created_at=detail.created_at,
+            ).model_dump(),
+            "source": metrics.get("source"),
+            "retrieval_ms": metrics.get("retrieval_ms"),
+            "ttft_ms": metrics.get("ttft_ms"),
+            "llm_ms": metrics.get("total_ms"),
+            "total_ms": total_ms,
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/sessions/{chatbot_id}/messages", response_model=list[ChatbotMessageOut],
             dependencies=[Depends(require_perm("self:read"))])
 def list_messages(
@@ -8,8 +8,8 @@ import csv
 from app.core.database import get_db
 from app.api.v1.deps import get_current_user
 from app.services.permissions import require_perm
-from app.schemas.dashboard import DashboardSummary
-from app.services.dashboard_service import build_dashboard_summary
+from app.schemas.dashboard import DashboardSummary, QueueDashboard
+from app.services.dashboard_service import build_dashboard_summary, build_queue_dashboard
 
 router = APIRouter(
     prefix="/admin/dashboard",
@@ -31,6 +31,30 @@ def get_admin_dashboard(
     return build_dashboard_summary(db=db, range_str=range)
 
 
+@router.get("/queue", response_model=QueueDashboard,
+            dependencies=[Depends(require_perm("admin:read"))])
+def get_queue_dashboard(
+    current_user=Depends(get_current_user),
+):
+    """
+    Hàng đợi job: số job theo trạng thái, độ trễ (lag_s), throughput, dead-letter.
+    """
+    return build_queue_dashboard()
+
+
+@router.get("/scan-schedule", dependencies=[Depends(require_perm("admin:read"))])
+def get_scan_schedule(
+    current_user=Depends(get_current_user),
+):
+    """
+    Lịch quét camera thích ứng: điểm rủi ro, các yếu tố, lần quét trước / kế tiếp
+    của từng camera (chỉ có dữ liệu ở process chạy scheduler với AUTO_SCAN_MODE=adaptive).
+    """
+    from app.services.adaptive_scan_service import adaptive_scheduler
+
+    return adaptive_scheduler.schedule()
+
+
 @router.get("/export", dependencies=[Depends(require_perm("admin:read"))])
 def export_admin_dashboard(
     range: str = Query("7d", pattern="^(7d|30d|90d)$"),
@@ -1,27 +1,92 @@
 # app/api/v1/routes_detect.py
+import json
+import logging
+import time
 from typing import Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Header
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-
-from app.core.database import get_db
-from app.services.inference_service import detector
-from app.services.llm_service import summarize_detections_with_llm
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services.inference_service import get_detector, inference_enabled, peek_detector
+from app.services.executor_service import (
+    ExecutorBusyError,
+    StageTimeoutError,
+    run_inference,
+    run_io,
+)
+from app.services.detection_cache_service import detection_cache, image_digest
+from app.services.model_registry import registry
+from app.services.llm_service import summarize_detections_with_status
 from app.services.detect_service import save_detection_result
+from app.services.enrichment_service import enrichment_service
 from app.api.v1.deps import get_optional_user
 from app.services.detect_limit_service import check_guest_detect_limit
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(tags=["Detection"])
 
 
+def _with_session(fn, *args, **kwargs):
+    """Chạy trong thread của io pool với Session riêng của thread đó (Session không dùng chung giữa thread)."""
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def _run_db(fn, *args, **kwargs):
+    """
+    Chạy fn(db, ...) trong io pool, map lỗi executor → HTTP.
+    Không truyền Session của request: khi stage timeout route trả 504 và đóng
+    session đó trong lúc thread vẫn đang chạy.
+    """
+    try:
+        return await run_io(
+            _with_session, fn, *args, timeout=settings.STAGE_TIMEOUT_DB_S, stage="db", **kwargs
+        )
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=f"Server đang bận, vui lòng thử lại: {e}")
+    except StageTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+def _lookup_cache(raw: bytes, fingerprint: str, conf: float, iou: float):
+    """Hash ảnh + tra cache (RAM rồi tới đĩa). Chạy trong io pool vì ảnh có thể vài MB."""
+    digest = image_digest(raw)
+    return digest, detection_cache.get(digest, fingerprint, conf, iou)
+
+
 @router.post("/detect")
 async def detect_image(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
     current_user=Depends(get_optional_user),
     client_key: Optional[str] = Header(default=None, alias="X-Client-Key"),
+    model_version: Optional[str] = Query(default=None, description="Pin 1 version model đang được load"),
+    enrich: Optional[str] = Query(
+        default=None,
+        pattern="^(sync|async)$",
+        description="sync: chờ LLM (mặc định cho client cũ); async: trả YOLO ngay + job_id tóm tắt LLM",
+    ),
 ):
+    if not inference_enabled():
+        raise HTTPException(status_code=503, detail="Worker này không chạy inference (INFERENCE_ROLE=api)")
+
+    if model_version:
+        # chỉ pin vào model đã load sẵn: request công khai không được kích hoạt load model
+        detector = peek_detector(model_version)
+        if detector is None:
+            raise HTTPException(status_code=404, detail=f"Model version '{model_version}' chưa được load")
+    else:
+        # lần đầu (lazy load) sẽ load + warm-up model → chạy ngoài event loop
+        detector = peek_detector()
+    if detector is None:
+        try:
+            detector = await run_io(get_detector, stage="model_load")
+        except ExecutorBusyError as e:
+            raise HTTPException(status_code=503, detail=f"Server đang bận, vui lòng thử lại: {e}")
     if detector is None:
         raise HTTPException(status_code=500, detail="Model not loaded on server")
 
@@ -35,18 +100,88 @@ async def detect_image(
                 status_code=400,
                 detail="Thiếu header X-Client-Key cho khách không đăng nhập.",
             )
-        check_guest_detect_limit(db, client_key)
+        await _run_db(check_guest_detect_limit, client_key)
 
-    try:
-        yolo_result = detector.predict_bytes(raw_bytes=raw, conf=0.5, iou=0.5)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Cannot process image: {e}")
+    conf, iou = 0.5, 0.5
+
+    # ✅ Ảnh đã từng gửi (cùng model/conf/iou) → dùng lại kết quả YOLO + LLM
+    digest, cached = None, None
+    if detection_cache is not None:
+        try:
+            digest, cached = await run_io(
+                _lookup_cache, raw, detector.fingerprint, conf, iou,
+                timeout=settings.STAGE_TIMEOUT_DB_S, stage="cache",
+            )
+        except (ExecutorBusyError, StageTimeoutError) as e:
+            logger.warning(f"[Detect] Bỏ qua cache: {e}")
+
+    if cached is not None:
+        yolo_result = cached["yolo"]
+    else:
+        try:
+            # ✅ Inference chạy ngoài event loop (batch engine / process pool)
+            yolo_result = await run_inference(raw, conf=conf, iou=iou, detector=detector)
+        except ExecutorBusyError as e:
+            raise HTTPException(status_code=503, detail=f"Server đang bận, vui lòng thử lại: {e}")
+        except StageTimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Cannot process image: {e}")
+
+        # so sánh với model ứng viên (nếu bật shadow) ở thread riêng, không chờ
+        if not model_version:
+            registry.shadow.maybe_submit(raw, conf, iou, yolo_result)
 
     detections_list = yolo_result.get("detections", [])
     num_detections = yolo_result.get("num_detections", 0)
     explanation = yolo_result.get("explanation")
 
-    disease_summary, care_instructions = summarize_detections_with_llm(detections_list)
+    cached_llm = (cached or {}).get("llm")
+    async_enrich = (enrich or settings.ENRICH_DEFAULT_MODE) == "async"
+    if cached_llm:
+        disease_summary = cached_llm.get("disease_summary")
+        care_instructions = cached_llm.get("care_instructions")
+    elif async_enrich:
+        # pha 1: chưa có tóm tắt, job nền sẽ ghi vào DB + cache sau
+        disease_summary, care_instructions = None, None
+        if detection_cache is not None and digest is not None and cached is None:
+            try:
+                await run_io(
+                    detection_cache.put, digest, detector.fingerprint, conf, iou, yolo_result, None,
+                    timeout=settings.STAGE_TIMEOUT_DB_S, stage="cache",
+                )
+            except (ExecutorBusyError, StageTimeoutError) as e:
+                logger.warning(f"[Detect] Không ghi được cache: {e}")
+    else:
+        # LLM chỉ là phần bổ sung: quá tải/timeout thì vẫn trả kết quả YOLO
+        try:
+            disease_summary, care_instructions, from_llm = await run_io(
+                summarize_detections_with_status,
+                detections_list,
+                detector.model_version,
+                timeout=settings.STAGE_TIMEOUT_LLM_S,
+                stage="llm",
+            )
+        except (ExecutorBusyError, StageTimeoutError) as e:
+            logger.warning(f"[Detect] Bỏ qua LLM: {e}")
+            disease_summary, care_instructions, from_llm = None, None, False
+
+        if detection_cache is not None and digest is not None:
+            # Không cache tóm tắt rỗng / text dự phòng (LLM lỗi) → lần sau còn thử lại
+            llm_to_cache = None
+            if from_llm:
+                llm_to_cache = {
+                    "disease_summary": disease_summary,
+                    "care_instructions": care_instructions,
+                }
+            try:
+                await run_io(
+                    detection_cache.put, digest, detector.fingerprint, conf, iou,
+                    yolo_result, llm_to_cache,
+                    timeout=settings.STAGE_TIMEOUT_DB_S, stage="cache",
+                )
+            except (ExecutorBusyError, StageTimeoutError) as e:
+                logger.warning(f"[Detect] Không ghi được cache: {e}")
 
     # ✅ NEW: để detect_service lưu description + guideline vào DB
     yolo_result["llm"] = {
@@ -56,10 +191,29 @@ async def detect_image(
     if "explanation" not in yolo_result:
         yolo_result["explanation"] = explanation
 
+    def _enrichment(img_id: Optional[int]) -> Optional[dict]:
+        """Tạo job LLM nền (chỉ khi async và chưa có tóm tắt trong cache)."""
+        if not async_enrich or cached_llm:
+            return None
+        job = enrichment_service.submit(
+            detections_list,
+            detector.model_version,
+            user_id=current_user.user_id if current_user is not None else None,
+            img_id=img_id,
+            cache_args=(digest, detector.fingerprint, conf, iou, yolo_result) if digest else None,
+        )
+        return {
+            **job.to_dict(),
+            "poll_url": f"{settings.API_V1}/detect/jobs/{job.job_id}",
+            "events_url": f"{settings.API_V1}/detect/jobs/{job.job_id}/events",
+        }
+
     if current_user is None:
         return JSONResponse({
             "file_name": file.filename,
             "saved_to_db": False,
+            "cache_hit": cached is not None,
+            "model_version": detector.model_version,
             "img": None,
             "num_detections": num_detections,
             "detections": detections_list,
@@ -68,21 +222,24 @@ async def detect_image(
                 "disease_summary": disease_summary,
                 "care_instructions": care_instructions,
             },
+            "enrichment": _enrichment(None),
         })
 
-    saved = save_detection_result(
-        db=db,
+    saved = await _run_db(
+        save_detection_result,
         raw=raw,
         filename=file.filename,
         yolo_result=yolo_result,
         user_id=current_user.user_id,
         device_id=None,
-        model_version="v1.0",
+        model_version=detector.model_version,
     )
 
     return JSONResponse({
         "file_name": file.filename,
         "saved_to_db": True,
+        "cache_hit": cached is not None,
+        "model_version": detector.model_version,
         "img": saved,
         "num_detections": num_detections,
         "detections": detections_list,
@@ -91,4 +248,53 @@ async def detect_image(
             "disease_summary": disease_summary,
             "care_instructions": care_instructions,
         },
+        "enrichment": _enrichment(saved["img_id"]),
     })
+
+
+# ============================================
+# Pha 2: kết quả LLM của /detect?enrich=async
+# ============================================
+def _get_job(job_id: str, current_user):
+    job = enrichment_service.get(job_id)
+    # job của user khác → coi như không tồn tại
+    if job is None or (job.user_id is not None and (current_user is None or current_user.user_id != job.user_id)):
+        raise HTTPException(status_code=404, detail="Không tìm thấy job hoặc job đã hết hạn")
+    return job
+
+
+@router.get("/detect/jobs/{job_id}")
+async def get_enrichment_job(
+    job_id: str,
+    wait: float = Query(default=0.0, ge=0.0, le=30.0, description="Long-poll: chờ tối đa bấy nhiêu giây"),
+    current_user=Depends(get_optional_user),
+):
+    """Polling: trạng thái job + tóm tắt LLM khi đã xong."""
+    job = _get_job(job_id, current_user)
+    if wait and not job.finished:
+        await enrichment_service.wait(job, wait)
+    return job.to_dict()
+
+
+@router.get("/detect/jobs/{job_id}/events")
+async def stream_enrichment_job(
+    job_id: str,
+    current_user=Depends(get_optional_user),
+):
+    """SSE: gửi 1 event "enrichment" khi job xong (ping mỗi 15s để giữ kết nối)."""
+    job = _get_job(job_id, current_user)
+
+    async def events():
+        deadline = time.monotonic() + settings.ENRICH_SSE_TIMEOUT_S
+        while not job.finished and time.monotonic() < deadline:
+            await enrichment_service.wait(job, min(15.0, max(deadline - time.monotonic(), 0.0)))
+            if not job.finished:
+                yield ": ping\n\n"
+        event = "enrichment" if job.finished else "timeout"
+        yield f"event: {event}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,11 +1,13 @@
 # app/api/v1/routes_detection_history.py
 from typing import Optional
 from app.services.export_dataset_service import export_detection_to_dataset, ExportError
+from app.services.job_queue_service import job_queue
 from app.models.image_detection import Img, Detection, Disease
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.api.v1.deps import get_current_user
 from app.models.role import RoleType
@@ -176,6 +178,17 @@ def export_detection_train(
                 detail="Bạn không có quyền export detection của người khác",
             )
 
+    # Có worker riêng → chỉ tạo job (cắt ảnh chạy nền, bấm lại khi job còn chờ/đang chạy
+    # vẫn 1 job; job cũ đã xong / dead thì export lại)
+    if settings.JOB_QUEUE_ENABLED:
+        job_id, _ = job_queue.enqueue(
+            "dataset.export",
+            {"detection_id": detection_id, "split": "train"},
+            idempotency_key=f"export:{detection_id}:train",
+            requeue_finished=True,
+        )
+        return {"success": True, "queued": True, "job_id": job_id, "saved_files": []}
+
     try:
         saved_files = export_detection_to_dataset(
             db=db,
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from app.core.database import ping_db
+from app.core.startup import startup_report
 
 router = APIRouter()
 
@@ -10,3 +12,56 @@ def healthz():
 @router.get("/health")
 def health():
     return {"db": "connected" if ping_db() else "disconnected"}
+
+@router.get("/health/inference")
+def health_inference():
+    """Trạng thái model + metrics micro-batching / executor / cache (queue depth, batch size, hit rate...)."""
+    from app.services.inference_service import inference_status, peek_detector
+    from app.services.model_registry import registry
+    from app.services import batch_inference_service
+    from app.services.executor_service import executor_stats
+    from app.services.detection_cache_service import detection_cache
+    from app.services.llm_cache_service import llm_summary_cache
+    from app.services.llm_gateway import llm_gateway
+    from app.services.enrichment_service import enrichment_service
+    from app.services.knowledge_index_service import knowledge_index
+    from app.services.chat_context_service import summary_updater
+    from app.services.frame_dedup_service import frame_store
+    from app.services.scan_orchestrator import scan_orchestrator
+    from app.services.camera_session_service import camera_sessions
+    from app.services.ffmpeg_supervisor import ffmpeg_supervisor
+
+    # không gọi get_detector()/get_batch_engine(): health không được kích hoạt load model
+    detector = peek_detector()
+    engine = batch_inference_service.batch_engine
+    return {
+        "model_loaded": detector is not None,
+        "model_version": detector.fingerprint if detector is not None else None,
+        "lifecycle": inference_status(),
+        "registry": registry.stats(),
+        "batching": engine.stats() if engine is not None else None,
+        "executors": executor_stats(),
+        "detect_cache": detection_cache.stats() if detection_cache is not None else None,
+        "llm_gateway": llm_gateway.stats(),
+        "llm_cache": llm_summary_cache.stats() if llm_summary_cache is not None else None,
+        "enrichment": enrichment_service.stats(),
+        "chatbot_knowledge": knowledge_index.stats(),
+        "chatbot_summary": summary_updater.stats(),
+        "frame_dedup": frame_store.stats(),
+        "auto_scan": scan_orchestrator.stats(),
+        "camera_sessions": camera_sessions.stats(),
+        "ffmpeg": ffmpeg_supervisor.stats(),
+    }
+
+@router.get("/health/ready")
+def health_ready():
+    """Readiness: 503 cho tới khi model load + warm-up xong (worker INFERENCE_ROLE=api luôn ready)."""
+    from app.services.inference_service import inference_status
+
+    status = inference_status()
+    body = {
+        "ready": status["ready"],
+        "inference": status,
+        "startup": startup_report(),
+    }
+    return JSONResponse(body, status_code=200 if status["ready"] else 503)
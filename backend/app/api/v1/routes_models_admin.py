@@ -0,0 +1,76 @@
+# app/api/v1/routes_models_admin.py
+"""
+Quản lý model trong registry: xem version, load/gỡ, đổi model mặc định (hot-swap), shadow.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+
+from app.api.v1.deps import require_admin
+from app.services.model_registry import discover_versions, registry
+
+router = APIRouter(
+    prefix="/admin/models",
+    tags=["Model Admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+
+class ShadowConfigIn(BaseModel):
+    version: Optional[str] = None           # None → tắt shadow
+    sample_rate: float = Field(default=0.05, ge=0.0, le=1.0)
+
+
+def _load_or_http(version: str):
+    try:
+        return registry.load(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Không load được model {version}: {e}")
+
+
+# Các endpoint dùng def (không async): FastAPI chạy trong threadpool,
+# load model vài giây không chặn event loop.
+@router.get("")
+def list_models():
+    return {
+        "versions": list(discover_versions().values()),
+        "registry": registry.stats(),
+    }
+
+
+@router.post("/{version}/load")
+def load_model(version: str):
+    return _load_or_http(version).info()
+
+
+@router.post("/{version}/activate")
+def activate_model(version: str):
+    """Hot-swap model mặc định (load + warm-up trước khi đổi, request đang chạy không bị ảnh hưởng)."""
+    _load_or_http(version)
+    return registry.set_default(version).info()
+
+
+@router.delete("/{version}")
+def unload_model(version: str):
+    try:
+        removed = registry.unload(version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Model version '{version}' chưa được load")
+    return {"unloaded": version}
+
+
+@router.put("/shadow")
+def configure_shadow(payload: ShadowConfigIn):
+    if payload.version:
+        _load_or_http(payload.version)
+        if payload.version == registry.default_version:
+            raise HTTPException(status_code=400, detail="Model shadow phải khác model mặc định")
+    registry.shadow.configure(payload.version, payload.sample_rate)
+    return registry.shadow.stats()
@@ -4,12 +4,14 @@ Streaming routes: convert MJPEG → HLS, serve HLS playlists
 """
 import os
 import asyncio
-import subprocess
+import functools
 from pathlib import Path
 from urllib.parse import unquote
 
 from fastapi import APIRouter, Query, HTTPException, Response, Request
+from app.core.config import settings
 from app.services import stream_service
+from app.services.ffmpeg_supervisor import SupervisorFullError, ffmpeg_supervisor
 from fastapi.responses import StreamingResponse
 
 router = APIRouter(prefix="/stream", tags=["stream"])
@@ -50,8 +52,11 @@ async def hls_stream(
     playlist_file = session_dir / "index.m3u8"
     output_pattern = str((session_dir / "segment_%03d.ts").absolute())
     
-    # Check if conversion is already running
-    if not playlist_file.exists():
+    # Check if conversion is already running (ffmpeg_supervisor giữ tiến trình theo session_id)
+    if not ffmpeg_supervisor.is_running(session_id):
+        stream_service.release_camera_reader(None, mjpeg_url)
+        # playlist của lần chạy trước (ffmpeg đã chết) → xoá để chờ playlist mới
+        playlist_file.unlink(missing_ok=True)
         # Start ffmpeg conversion asynchronously
         asyncio.create_task(
             _convert_mjpeg_to_hls(mjpeg_url, output_pattern, str(playlist_file))
@@ -99,6 +104,7 @@ async def hls_stream(
 async def serve_playlist(session_id: str):
     """Serve HLS playlist file"""
     playlist_file = HLS_OUTPUT_DIR / session_id / "index.m3u8"
+    ffmpeg_supervisor.touch(session_id)
     
     if not playlist_file.exists():
         raise HTTPException(status_code=404, detail="Playlist not found")
@@ -116,6 +122,7 @@ async def serve_playlist(session_id: str):
 async def serve_segment(session_id: str, filename: str):
     """Serve HLS segment file"""
     segment_file = HLS_OUTPUT_DIR / session_id / filename
+    ffmpeg_supervisor.touch(session_id)
     
     if not segment_file.exists() or not segment_file.is_file():
         raise HTTPException(status_code=404, detail="Segment not found")
@@ -167,20 +174,27 @@ async def _convert_mjpeg_to_hls(mjpeg_url: str, output_pattern: str, playlist_fi
         # -hls_list_size 5: keep last 5 segments
         # -hls_flags delete_segments: delete old segments
         # -hls_segment_filename: CRITICAL - defines segment naming pattern
+        # + output latest.jpg (-update 1): frame cho auto-detection, không mở thêm kết nối camera
         
         # ✅ Convert all paths to absolute
         playlist_abs = str(Path(playlist_file).absolute())
         log_file_path = Path(playlist_file).parent / "ffmpeg.log"
         
+        # thu nhỏ về tối đa STREAM_MJPEG_MAX_WIDTH (không phóng to camera nhỏ)
+        video_filter = "fps=15"
+        if settings.STREAM_MJPEG_MAX_WIDTH:
+            video_filter = f"scale=w='min({settings.STREAM_MJPEG_MAX_WIDTH},iw)':h=-2,{video_filter}"
+        
         cmd = [
             ffmpeg_path,
             "-hide_banner",
             "-loglevel", "warning",
             "-i", mjpeg_url,
-            "-vf", "scale=1280:-2,fps=15",
+            "-vf", video_filter,
             "-c:v", "libx264",
             "-preset", "veryfast",
             "-tune", "zerolatency",
+            "-threads", str(settings.FFMPEG_THREADS),
             "-f", "hls",
             "-hls_time", "2",
             "-hls_list_size", "5",
@@ -189,29 +203,36 @@ async def _convert_mjpeg_to_hls(mjpeg_url: str, output_pattern: str, playlist_fi
             "-y",
             playlist_abs,
         ]
+        # output thứ 2: latest.jpg cho auto-detection của camera cùng URL
+        cmd += stream_service.snapshot_output_args(
+            str((Path(playlist_file).parent / stream_service.SNAPSHOT_NAME).absolute())
+        )
         
         print(f"[HLS] Starting ffmpeg process...")
         print(f"[HLS] Segment pattern: {output_pattern}")
         print(f"[HLS] Playlist: {playlist_abs}")
         
-        # ✅ FIX: Dùng subprocess.Popen thay vì asyncio.create_subprocess_exec
-        # vì Windows không hỗ trợ async subprocess với event loop mặc định
-        log_file = open(log_file_path, "ab")
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=log_file,
-            stderr=log_file,
-            # Không dùng cwd - dùng absolute paths thay vì relative
+        # ✅ ffmpeg_supervisor giữ tiến trình: tự restart khi chết, dừng khi không ai xem,
+        # giới hạn số transcode / tài nguyên. start() có thể chờ dừng tiến trình cũ
+        # (tới 5s) → chạy trong thread pool, không chặn event loop.
+        loop = asyncio.get_running_loop()
+        stream = await loop.run_in_executor(
+            None,
+            functools.partial(
+                ffmpeg_supervisor.start,
+                Path(playlist_file).parent.name,
+                cmd,
+                Path(playlist_file).parent,
+                source_url=mjpeg_url,
+            ),
         )
         
-        print(f"[HLS] ✅ ffmpeg process started, PID={process.pid}")
+        print(f"[HLS] ✅ ffmpeg process started, PID={stream.proc.pid}")
         print(f"[HLS] Log file: {log_file_path}")
         print(f"[HLS] Playlist will be at: {playlist_file}")
-        
-        # Process sẽ chạy trong background, không cần wait
-        # Frontend sẽ poll để kiểm tra khi nào playlist ready
     
+    except SupervisorFullError as e:
+        print(f"[HLS] ❌ {e}")
     except FileNotFoundError as e:
         print(f"[HLS] ❌ ffmpeg not found: {e}")
         print(f"[HLS] Please install ffmpeg and add it to PATH")
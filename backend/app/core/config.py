@@ -66,6 +66,154 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str = ""
     GEMINI_MODEL: str = "gemini-2.5-flash"
 
+    # ===== LLM gateway (client Gemini dùng chung) =====
+    LLM_BACKEND: str = "gemini"             # "fake": backend giả, không gọi mạng (test / dev offline)
+    LLM_TIMEOUT_S: float = 20.0             # deadline mỗi lần gọi (gồm chờ rate limit + retry)
+    LLM_STREAM_TIMEOUT_S: float = 90.0      # stream: LLM_TIMEOUT_S cho token đầu, cả câu trả lời tối đa bấy nhiêu
+    LLM_MAX_RETRIES: int = 2                # retry lỗi tạm thời (timeout mạng, 429, 5xx)
+    LLM_RETRY_BASE_S: float = 0.5           # backoff = random(0, base * 2^lần thử)
+    LLM_RATE_PER_S: float = 5.0             # token bucket: số request/giây gửi lên Gemini
+    LLM_RATE_BURST: int = 10
+    LLM_MAX_CONCURRENCY: int = 8            # số request đồng thời tối đa tới Gemini
+    LLM_BREAKER_FAILURES: int = 5           # lỗi liên tiếp để mở circuit breaker
+    LLM_BREAKER_RESET_S: float = 30.0       # breaker mở bao lâu trước khi thử lại
+
+    # ===== Chatbot: ngữ cảnh gửi LLM mỗi lượt =====
+    CHATBOT_CONTEXT_TURNS: int = 6          # số lượt hỏi/đáp gần nhất gửi nguyên văn
+    CHATBOT_CONTEXT_TOKEN_BUDGET: int = 3000  # tổng token (ước lượng) của tóm tắt + lịch sử + câu hỏi
+    CHATBOT_SUMMARY_MAX_TOKENS: int = 600   # độ dài tối đa của tóm tắt cuốn chiếu
+    CHATBOT_SUMMARY_BATCH_TURNS: int = 4    # đủ bấy nhiêu lượt cũ chưa tóm tắt mới gọi LLM gộp
+
+    # ===== Chatbot: tra cứu kiến thức local (BM25 trên diseases / detections) =====
+    KNOWLEDGE_ENABLED: bool = True
+    KNOWLEDGE_TOP_K: int = 3                # số đoạn chèn vào prompt
+    KNOWLEDGE_MIN_SCORE: float = 2.0        # điểm BM25 tối thiểu để coi là liên quan
+    KNOWLEDGE_DIRECT_MIN_COVERAGE: float = 0.85  # tỉ lệ (theo idf) từ khoá câu hỏi khớp để trả lời thẳng
+    KNOWLEDGE_DIRECT_MIN_MARGIN: float = 1.5     # điểm bệnh đứng đầu phải gấp bấy nhiêu lần bệnh thứ 2
+    KNOWLEDGE_PASSAGE_MAX_CHARS: int = 600  # cắt mỗi đoạn khi chèn vào prompt
+    KNOWLEDGE_REFRESH_S: float = 60.0       # cập nhật tăng dần (document mới / vừa sửa)
+    KNOWLEDGE_FULL_REBUILD_S: float = 3600.0  # dựng lại toàn bộ (loại document đã xoá / reject)
+    KNOWLEDGE_RECHECK_WINDOW_S: float = 900.0  # đọc lại detection trong khoảng này (tóm tắt ghi sau)
+    KNOWLEDGE_MAX_DETECTION_ROWS: int = 5000
+
+    # ===== Inference (micro-batching /detect) =====
+    INFERENCE_BATCHING_ENABLED: bool = True
+    INFERENCE_MAX_BATCH_SIZE: int = 8       # số ảnh tối đa gộp vào 1 lần model.predict
+    INFERENCE_MAX_WAIT_MS: float = 10.0     # thời gian tối đa chờ gom batch (ms)
+
+    # ===== Inference: vòng đời model theo vai trò worker =====
+    INFERENCE_ROLE: str = "all"             # "all": worker có chạy /detect; "api": không load model (/detect → 503)
+    INFERENCE_LAZY_LOAD: bool = False       # True: chỉ load model ở request /detect đầu tiên
+    INFERENCE_WARMUP_RUNS: int = 1          # số lượt chạy ảnh giả sau khi load (0 = bỏ warm-up)
+    STARTUP_BUDGET_S: float = 60.0          # vượt ngân sách khởi động → log cảnh báo
+
+    # ===== Model registry (ml/exports/<version>) =====
+    MODEL_VARIANT: str = ""                 # "" = weights FP32; "int8" = biến thể quantize (quantize_model.py)
+    MODEL_MAX_ACCURACY_DROP: float = 0.02   # biến thể có mAP50 giảm quá ngưỡng này → từ chối load
+    MODEL_REGISTRY_MAX_LOADED: int = 2      # số model tối đa giữ trong RAM (mặc định + ứng viên)
+    MODEL_SHADOW_VERSION: str = ""          # version chạy shadow khi khởi động ("" = tắt)
+    MODEL_SHADOW_SAMPLE_RATE: float = 0.0   # tỉ lệ request /detect được chạy thêm trên model shadow
+    MODEL_SHADOW_MAX_PENDING: int = 16      # hàng đợi shadow đầy → bỏ mẫu, không chặn request
+
+    # ===== Inference: cắt tile cho ảnh độ phân giải cao =====
+    INFERENCE_TILING_ENABLED: bool = False
+    INFERENCE_TILE_SIZE: int = 640          # cạnh mỗi tile (px, theo ảnh gốc)
+    INFERENCE_TILE_OVERLAP: float = 0.2     # tỉ lệ chồng lấn giữa 2 tile kề nhau
+    INFERENCE_TILE_MIN_SIDE: int = 1600     # cạnh dài >= ngưỡng này mới cắt tile
+    INFERENCE_TILE_MAX_SIDE: int = 2560     # ảnh lớn hơn được thu nhỏ về đây trước khi cắt (giới hạn số tile)
+    INFERENCE_TILE_MERGE_THRESHOLD: float = 0.5  # ngưỡng IoS khi gộp box giữa các tile
+
+    # ===== Executor (chạy việc blocking ngoài event loop) =====
+    EXECUTOR_IO_WORKERS: int = 16           # thread pool cho LLM / DB / ghi file
+    EXECUTOR_IO_MAX_PENDING: int = 64       # vượt quá → 503
+    INFERENCE_PROCESS_WORKERS: int = 0      # > 0: chạy YOLO trong process pool thay vì batch engine
+    INFERENCE_MAX_PENDING: int = 32         # số ảnh tối đa chờ inference, vượt quá → 503
+    STAGE_TIMEOUT_INFERENCE_S: float = 30.0
+    STAGE_TIMEOUT_LLM_S: float = 30.0
+    STAGE_TIMEOUT_DB_S: float = 15.0
+
+    # ===== Cache kết quả /detect (hash nội dung ảnh) =====
+    DETECT_CACHE_ENABLED: bool = True
+    DETECT_CACHE_MAX_ITEMS: int = 512
+    DETECT_CACHE_TTL_S: float = 86400.0
+    DETECT_CACHE_DIR: str = ""              # để trống → chỉ cache trong RAM
+
+    # ===== Cache tóm tắt LLM (theo tập bệnh + số vùng, không theo ảnh) =====
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ITEMS: int = 256
+    LLM_CACHE_TTL_S: float = 604800.0       # 7 ngày
+    LLM_CACHE_DIR: str = ""                 # để trống → chỉ cache trong RAM
+
+    # ===== /detect 2 pha: trả YOLO ngay, LLM chạy nền (?enrich=async) =====
+    ENRICH_DEFAULT_MODE: str = "sync"       # mode khi client không truyền ?enrich ("sync" cho client cũ)
+    ENRICH_MAX_CONCURRENCY: int = 8         # số job LLM chạy nền đồng thời
+    ENRICH_JOB_MAX_ITEMS: int = 2048
+    ENRICH_JOB_TTL_S: float = 900.0         # job hết hạn → poll trả 404 (kết quả vẫn nằm trong DB)
+    ENRICH_SSE_TIMEOUT_S: float = 60.0      # SSE chờ tối đa bấy nhiêu giây rồi đóng
+
+    # ===== Auto-scan camera: lịch quét + điều phối =====
+    AUTO_SCAN_ENABLED: bool = False         # bật scheduler quét camera tự động
+    AUTO_SCAN_HOURS: str = "8,18"           # giờ quét trong ngày (cú pháp CronTrigger hour)
+    AUTO_SCAN_NUM_IMAGES: int = 3           # số ảnh chụp mỗi camera mỗi lượt
+    AUTO_SCAN_MODE: str = "fixed"           # fixed: theo AUTO_SCAN_HOURS | adaptive: theo rủi ro từng camera
+    AUTO_SCAN_TICK_S: float = 60.0          # adaptive: chu kỳ kiểm tra camera đến hạn
+    AUTO_SCAN_MIN_INTERVAL_S: float = 1800.0   # adaptive: khoảng quét khi rủi ro cao nhất
+    AUTO_SCAN_MAX_INTERVAL_S: float = 43200.0  # adaptive: khoảng quét khi khoẻ + ổn định
+    AUTO_SCAN_RISK_TTL_S: float = 600.0     # adaptive: tính lại điểm rủi ro sau bấy nhiêu giây
+    AUTO_SCAN_CAPACITY_PER_HOUR: int = 600  # adaptive: số lượt quét camera/giờ toàn hệ thống chịu được
+    SCAN_MAX_CONCURRENCY: int = 16          # số camera quét song song
+    SCAN_DEVICE_TIMEOUT_S: float = 60.0     # ngân sách mỗi camera (chụp + YOLO + LLM)
+    SCAN_RUN_TIMEOUT_S: float = 1800.0      # tối đa cho cả lượt quét
+
+    # ===== Hàng đợi job bền vững (scan / enrich / export chạy ở python -m app.worker) =====
+    JOB_QUEUE_ENABLED: bool = False         # False → chạy ngay trong process API như trước
+    JOB_QUEUE_DATABASE_URL: str = ""        # trống → bảng jobs trong DB chính; vd sqlite:///./jobs.db khi chạy local
+    JOB_LEASE_S: float = 120.0              # worker giữ job bao lâu (tự gia hạn khi còn chạy)
+    JOB_MAX_ATTEMPTS: int = 5               # hết lượt thử → dead-letter
+    JOB_RETRY_BASE_S: float = 10.0          # backoff mũ giữa các lần thử
+    JOB_RETRY_MAX_S: float = 900.0
+    JOB_POLL_INTERVAL_S: float = 1.0        # worker rảnh thì chờ bấy nhiêu giây rồi hỏi lại
+    JOB_WORKER_CONCURRENCY: int = 4
+    JOB_RETENTION_S: float = 604800.0       # xoá job done cũ hơn (job dead giữ lại)
+
+    # ===== Camera: giữ kết nối + ring buffer frame mỗi camera (camera_session_service) =====
+    CAMERA_SESSIONS_ENABLED: bool = True
+    CAMERA_RING_SIZE: int = 8               # số frame mới nhất giữ trong RAM mỗi camera
+    CAMERA_SAMPLE_INTERVAL_S: float = 1.0   # khoảng cách giữa 2 frame trong ring
+    CAMERA_FRAME_MAX_AGE_S: float = 5.0     # frame cũ hơn (+ count × interval) thì không dùng
+    CAMERA_CONNECT_TIMEOUT_S: float = 10.0
+    CAMERA_IDLE_TIMEOUT_S: float = 300.0    # không ai lấy frame quá lâu → đóng kết nối
+    CAMERA_MAX_SESSIONS: int = 32           # số kết nối camera mở cùng lúc tối đa
+
+    # ===== Stream HLS kiêm nguồn frame cho detection (ffmpeg ghi thêm latest.jpg) =====
+    STREAM_SNAPSHOT_ENABLED: bool = True
+    STREAM_SNAPSHOT_FPS: float = 1.0        # số lần/giây ffmpeg ghi đè latest.jpg
+    STREAM_SNAPSHOT_MAX_AGE_S: float = 5.0  # latest.jpg cũ hơn → coi như stream đã dừng
+
+    # ===== Stream HLS: remux H.264 thay vì encode lại (stream_probe) =====
+    STREAM_PASSTHROUGH_ENABLED: bool = True  # nguồn RTSP H.264 tương thích → -c:v copy
+    STREAM_PROBE_TIMEOUT_S: float = 8.0     # ffprobe quá lâu → transcode như cũ
+    STREAM_PROBE_TTL_S: float = 3600.0      # cache kết quả ffprobe theo URL
+    STREAM_COPY_MAX_WIDTH: int = 1920       # nguồn lớn hơn → transcode + thu nhỏ về cỡ này
+    STREAM_COPY_MAX_HEIGHT: int = 1080
+    STREAM_MJPEG_MAX_WIDTH: int = 1280      # nguồn MJPEG (DroidCam...) thu nhỏ về tối đa bề rộng này
+
+    # ===== ffmpeg: giám sát tiến trình transcode HLS (ffmpeg_supervisor) =====
+    FFMPEG_MAX_PROCESSES: int = 8           # số stream ffmpeg chạy cùng lúc tối đa trên 1 node
+    FFMPEG_THREADS: int = 2                 # thread encoder mỗi stream
+    FFMPEG_NICE: int = 10                   # ưu tiên CPU thấp hơn API / inference (POSIX)
+    FFMPEG_MAX_MEMORY_MB: int = 1024        # RLIMIT_AS mỗi tiến trình (0 = không giới hạn, POSIX)
+    FFMPEG_IDLE_STOP_S: float = 120.0       # không ai tải playlist/segment quá lâu → dừng (0 = không dừng)
+    FFMPEG_RESTART_BASE_S: float = 1.0      # backoff mũ khi ffmpeg chết
+    FFMPEG_RESTART_MAX_S: float = 60.0
+    FFMPEG_MAX_RESTARTS: int = 10           # chết quá bấy nhiêu lần / 10 phút → ngừng tự restart
+    FFMPEG_MONITOR_INTERVAL_S: float = 2.0
+
+    # ===== Auto-scan camera: bỏ frame trùng (perceptual hash) =====
+    SCAN_DEDUP_ENABLED: bool = True
+    SCAN_DEDUP_MAX_DISTANCE: int = 6        # số bit dHash (/64) khác nhau tối đa để coi là "giống"
+    SCAN_DEDUP_MAX_AGE_S: float = 21600.0   # kết quả cũ quá hạn này thì vẫn quét lại
+
     # ===== Weather =====
     OPENWEATHER_API_KEY: str = ""
     OPENWEATHER_BASE_URL: str = "https://api.openweathermap.org/data/2.5"
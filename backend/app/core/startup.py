@@ -0,0 +1,62 @@
+# app/core/startup.py
+"""
+Đo thời gian khởi động theo từng phase (import router, load model, warm-up...)
+để so với ngân sách STARTUP_BUDGET_S và báo qua /health/ready.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# mốc sớm nhất đo được: lúc app.core.startup được import
+_BOOT_T0 = time.perf_counter()
+
+_phases: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def since_boot_ms() -> float:
+    return (time.perf_counter() - _BOOT_T0) * 1000
+
+
+def record_phase(name: str, elapsed_ms: float) -> None:
+    with _lock:
+        _phases[name] = round(elapsed_ms, 1)
+    logger.info(f"[Startup] {name}: {elapsed_ms:.0f} ms")
+
+
+@contextmanager
+def startup_phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, (time.perf_counter() - t0) * 1000)
+
+
+def check_budget(milestone: str) -> bool:
+    """Log cảnh báo nếu tới `milestone` đã vượt ngân sách khởi động. Trả về True nếu còn trong ngân sách."""
+    elapsed = since_boot_ms()
+    record_phase(milestone, elapsed)
+    budget_ms = settings.STARTUP_BUDGET_S * 1000
+    if budget_ms > 0 and elapsed > budget_ms:
+        logger.warning(
+            f"[Startup] {milestone} sau {elapsed / 1000:.1f}s, vượt ngân sách {settings.STARTUP_BUDGET_S:.0f}s"
+        )
+        return False
+    return True
+
+
+def startup_report() -> Dict[str, Any]:
+    with _lock:
+        phases = dict(_phases)
+    return {
+        "phases_ms": phases,
+        "uptime_ms": round(since_boot_ms(), 1),
+        "budget_s": settings.STARTUP_BUDGET_S,
+    }
@@ -1,6 +1,7 @@
 # app/main.py
 from pathlib import Path
 import logging
+import time
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, Response
@@ -14,6 +15,7 @@ from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 from sqlalchemy.orm import configure_mappers
 
 from app.core.config import settings
+from app.core.startup import check_budget, record_phase
 
 # Import models để SQLAlchemy map đầy đủ
 import app.models  # noqa: F401
@@ -27,6 +29,7 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(me
 configure_mappers()
 
 # ==== Routers ====
+_t_routers = time.perf_counter()
 from app.api.v1.routes_health import router as health_router
 from app.api.v1.routes_detect import router as detect_router
 from app.api.v1.routes_auth import router as auth_router
@@ -50,6 +53,8 @@ from app.api.v1.routes_chatbot import router as chatbot
 from app.api.v1.routes_chatbot import router as chatbot_router
 from app.api.v1.routes_stream import router as stream_router  # ✅ MJPEG → HLS conversion
 from app.api.v1.routes_streams import router as streams_router  # ✅ Stream management (devices)
+from app.api.v1.routes_models_admin import router as models_admin_router
+record_phase("import_routers", (time.perf_counter() - _t_routers) * 1000)
 
 
 API_PREFIX = getattr(settings, "API_V1", "/api/v1")
@@ -79,6 +84,15 @@ async def log_requests(request: Request, call_next):
     logger.info(f"📤 {request.method} {request.url.path} → {response.status_code}")
     return response
 
+# ==== HLS: ghi nhận lượt tải playlist/segment để ffmpeg_supervisor dừng stream không ai xem ====
+@app.middleware("http")
+async def track_hls_viewers(request: Request, call_next):
+    path = request.url.path
+    if path.startswith("/media/hls/"):
+        from app.services.ffmpeg_supervisor import ffmpeg_supervisor
+        ffmpeg_supervisor.touch(path.split("/")[3])
+    return await call_next(request)
+
 # ==== Middlewares ====
 # ⚠️ Dev: KHÔNG dùng "*" nếu allow_credentials=True (browser sẽ chặn CORS)
 # Hãy whitelist origin của Flutter Web dev server (port có thể thay đổi)
@@ -164,6 +178,7 @@ app.include_router(news_router, prefix=API_PREFIX)
 app.include_router(chatbot_router, prefix=API_PREFIX)
 app.include_router(stream_router, prefix=API_PREFIX)  # ✅ MJPEG → HLS conversion
 app.include_router(streams_router, prefix=API_PREFIX)  # ✅ Stream management
+app.include_router(models_admin_router, prefix=API_PREFIX)
 
 # ==== Root & tiện ích ====
 @app.get("/")
@@ -174,6 +189,15 @@ def root():
 @app.on_event("startup")
 async def startup_event():
     """Initialize scheduler on app startup."""
+    check_budget("app_startup")
+
+    # Load + warm-up model ở thread nền (tuỳ INFERENCE_ROLE / INFERENCE_LAZY_LOAD)
+    try:
+        from app.services.inference_service import start_background_load
+        start_background_load()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi khởi động inference: {e}", exc_info=True)
+
     try:
         from app.services.scheduler_service import start_scheduler
         start_scheduler()
@@ -191,6 +215,24 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"❌ Lỗi khi dừng scheduler: {e}", exc_info=True)
 
+    try:
+        from app.services.ffmpeg_supervisor import ffmpeg_supervisor
+        ffmpeg_supervisor.stop_all()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi dừng ffmpeg: {e}", exc_info=True)
+
+    try:
+        from app.services.camera_session_service import camera_sessions
+        camera_sessions.close_all()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi đóng kết nối camera: {e}", exc_info=True)
+
+    try:
+        from app.services.executor_service import shutdown_executors
+        shutdown_executors()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi dừng executor: {e}", exc_info=True)
+
 
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
@@ -12,6 +12,7 @@ from .support import SupportTicket, SupportMessage
 from .user_settings import UserSettings
 from .chatbot import Chatbot, ChatbotDetail
 from .device_logs import DeviceLogs
+from .job_queue import Job
 
 __all__ = [
     "Role", "RoleType",
@@ -26,4 +27,5 @@ __all__ = [
     "UserSettings",
     "Chatbot", "ChatbotDetail",
     "DeviceLogs",
+    "Job",
 ]
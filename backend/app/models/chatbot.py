@@ -27,6 +27,11 @@ class Chatbot(Base):
     end_at = Column(DateTime, nullable=True)
     status = Column(SAEnum(ChatbotStatus), default=ChatbotStatus.active, nullable=False)
 
+    # tóm tắt cuốn chiếu các lượt cũ (chat_context_service)
+    summary = Column(Text, nullable=True)
+    summary_upto_detail_id = Column(BigInteger, nullable=True)  # detail_id cuối đã gộp vào summary
+    summary_updated_at = Column(DateTime, nullable=True)
+
     # relationship 2 chiều với Users
     user = relationship("Users", back_populates="chatbot")
 
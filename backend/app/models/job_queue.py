@@ -0,0 +1,41 @@
+# app/models/job_queue.py
+from sqlalchemy import (
+    Column, BigInteger, String, Integer, Text, DateTime, JSON, Index, func,
+)
+from app.core.database import Base
+
+
+class Job(Base):
+    """
+    Job trong hàng đợi bền vững (job_queue_service).
+    status: queued → running → done | queued (retry) | dead (hết lượt thử / lỗi vĩnh viễn)
+    """
+    __tablename__ = "jobs"
+
+    job_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    queue = Column(String(50), nullable=False)           # scan | enrich | export
+    kind = Column(String(100), nullable=False)           # tên handler, vd "scan.device"
+    payload = Column(JSON, nullable=True)
+    # trùng key → không tạo job mới (vd "scan:<device_id>:<slot>")
+    idempotency_key = Column(String(255), unique=True, nullable=True)
+
+    status = Column(String(20), nullable=False, default="queued")
+    priority = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, server_default=func.now())
+
+    # lease: worker đang giữ job tới lease_expires_at; hết hạn mà chưa xong → worker khác nhận lại
+    lease_owner = Column(String(255), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_jobs_claim", "queue", "status", "run_after"),
+        Index("idx_jobs_finished", "status", "finished_at"),
+    )
@@ -60,3 +60,24 @@ class DashboardSummary(BaseModel):
     # Latest lists
     recent_detections: List[RecentDetectionItem]
     recent_tickets: List[RecentTicketItem]
+
+
+class QueueStat(BaseModel):
+    queue: str
+    queued: int
+    running: int
+    done: int
+    dead: int
+    ready: int                  # job đã tới giờ chạy nhưng chưa worker nào nhận
+    lag_s: float                # job sẵn sàng lâu nhất đã chờ bao nhiêu giây
+    done_last_5m: int
+    done_last_1h: int
+    throughput_per_min: float
+    avg_run_s: Optional[float] = None
+    retried_last_1h: int
+
+
+class QueueDashboard(BaseModel):
+    enabled: bool
+    queues: List[QueueStat]
+    generated_at: datetime
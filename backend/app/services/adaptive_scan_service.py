@@ -0,0 +1,251 @@
+# app/services/adaptive_scan_service.py
+"""
+Lịch quét camera thích ứng (AUTO_SCAN_MODE="adaptive").
+
+Mỗi camera có điểm rủi ro 0..1 tính từ:
+- xu hướng bệnh 7 ngày (analyze_disease_trend)
+- độ tin cậy của lần phát hiện bệnh gần nhất
+- độ ẩm / nhiệt độ 24h (độ ẩm cao + nhiệt độ ấm → nấm bệnh phát triển)
+
+Khoảng quét nội suy hình học giữa AUTO_SCAN_MAX_INTERVAL_S (rủi ro 0) và
+AUTO_SCAN_MIN_INTERVAL_S (rủi ro 1). Scheduler gọi tick() mỗi AUTO_SCAN_TICK_S:
+camera đến hạn được quét theo thứ tự rủi ro, tối đa theo công suất
+AUTO_SCAN_CAPACITY_PER_HOUR; camera không vừa công suất bị dời sang tick sau.
+"""
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.image_detection import Img, SourceType
+from app.services.scan_context_service import ScanContext, load_scan_context, load_scan_contexts
+from app.services.scan_orchestrator import active_camera_ids, scan_orchestrator
+
+logger = logging.getLogger(__name__)
+
+HUMIDITY_METRICS = ("humidity", "air_humidity", "rh")
+TEMPERATURE_METRICS = ("temperature", "temp", "air_temperature")
+HEALTHY_CLASSES = {"Không xác định", "pomelo_leaf_healthy", "pomelo_fruit_healthy"}
+
+
+@dataclass
+class DeviceSchedule:
+    device_id: int
+    risk: float = 0.0
+    factors: Optional[Dict[str, Any]] = None
+    risk_at: Optional[datetime] = None
+    last_scan_at: Optional[datetime] = None
+    next_scan_at: Optional[datetime] = None
+    deferred: int = 0   # số tick liên tiếp bị dời vì hết công suất
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "device_id": self.device_id,
+            "risk": round(self.risk, 3),
+            "interval_s": round(interval_for_risk(self.risk)),
+            "factors": self.factors,
+            "risk_at": self.risk_at,
+            "last_scan_at": self.last_scan_at,
+            "next_scan_at": self.next_scan_at,
+            "deferred": self.deferred,
+        }
+
+
+def _metric(sensor_data: Dict[str, Any], names) -> Optional[float]:
+    for name in names:
+        if name in sensor_data:
+            return sensor_data[name]["avg"]
+    return None
+
+
+def compute_risk(db, device_id: int, context: Optional[ScanContext] = None) -> tuple:
+    """Trả về (risk 0..1, factors) cho 1 camera."""
+    if context is None:
+        context = load_scan_context(db, device_id)
+    recent = context.recent_detections
+    trend = context.trend_info
+    sensors = context.sensor_data
+
+    factors: Dict[str, Any] = {"trend": trend.get("trend")}
+
+    # 1) xu hướng bệnh
+    trend_score = {"increasing": 0.35, "stable": 0.2, "no_data": 0.15}.get(trend.get("trend"), 0.0)
+
+    # 2) lần phát hiện bệnh gần nhất (lịch sử sắp xếp mới → cũ)
+    last_conf = 0.0
+    if recent and recent[0].get("disease_name") not in HEALTHY_CLASSES | {None}:
+        last_conf = float(recent[0].get("confidence") or 0.0)
+        if last_conf > 1:
+            last_conf /= 100.0   # confidence lưu dạng %
+    factors["last_disease_confidence"] = round(last_conf, 3)
+    detection_score = 0.35 * min(last_conf, 1.0)
+
+    # 3) môi trường: độ ẩm cao trong khoảng nhiệt độ nấm phát triển
+    humidity = _metric(sensors, HUMIDITY_METRICS)
+    temperature = _metric(sensors, TEMPERATURE_METRICS)
+    factors["humidity"] = round(humidity, 1) if humidity is not None else None
+    factors["temperature"] = round(temperature, 1) if temperature is not None else None
+    env_score = 0.0
+    if humidity is not None:
+        env_score = 0.3 * min(max((humidity - 60.0) / 35.0, 0.0), 1.0)
+        if temperature is not None and not (18.0 <= temperature <= 32.0):
+            env_score *= 0.5
+
+    risk = min(1.0, trend_score + detection_score + env_score)
+    factors.update({
+        "trend_score": round(trend_score, 3),
+        "detection_score": round(detection_score, 3),
+        "environment_score": round(env_score, 3),
+    })
+    return risk, factors
+
+
+def interval_for_risk(risk: float) -> float:
+    lo, hi = settings.AUTO_SCAN_MIN_INTERVAL_S, settings.AUTO_SCAN_MAX_INTERVAL_S
+    return hi * (lo / hi) ** min(max(risk, 0.0), 1.0)
+
+
+def _last_camera_scans(db, device_ids: List[int]) -> Dict[int, datetime]:
+    rows = (
+        db.query(Img.device_id, func.max(Img.created_at))
+        .filter(Img.device_id.in_(device_ids), Img.source_type == SourceType.camera.value)
+        .group_by(Img.device_id)
+        .all()
+    )
+    return {device_id: ts for device_id, ts in rows if ts is not None}
+
+
+class AdaptiveScanScheduler:
+    def __init__(self):
+        self.devices: Dict[int, DeviceSchedule] = {}
+        self._lock = threading.Lock()
+        self.ticks = 0
+        self.dispatched = 0
+        self.deferred = 0
+        self.last_tick: Optional[Dict[str, Any]] = None
+
+    def _refresh(self, now: datetime) -> None:
+        """Đồng bộ danh sách camera + tính lại rủi ro đã cũ."""
+        device_ids = active_camera_ids()
+        db = SessionLocal()
+        try:
+            with self._lock:
+                for gone in set(self.devices) - set(device_ids):
+                    del self.devices[gone]
+                new_ids = [d for d in device_ids if d not in self.devices]
+            # lần quét trước lấy từ DB (ảnh camera mới nhất) → restart không làm quét dồn
+            last_scans = _last_camera_scans(db, new_ids) if new_ids else {}
+
+            ttl = timedelta(seconds=settings.AUTO_SCAN_RISK_TTL_S)
+            stale = [
+                d for d in device_ids
+                if d not in self.devices or self.devices[d].risk_at is None or now - self.devices[d].risk_at > ttl
+            ]
+            # ngữ cảnh mọi camera cần tính lại: vài truy vấn cho cả lô
+            try:
+                contexts = load_scan_contexts(db, stale)
+            except Exception as e:
+                logger.warning(f"[AdaptiveScan] Không nạp được ngữ cảnh: {e}")
+                db.rollback()
+                contexts = {}
+
+            for device_id in device_ids:
+                sched = self.devices.get(device_id)
+                if sched is None:
+                    sched = DeviceSchedule(device_id=device_id, last_scan_at=last_scans.get(device_id))
+                if device_id in contexts:
+                    sched.risk, sched.factors = compute_risk(db, device_id, contexts[device_id])
+                    sched.risk_at = now
+                sched.next_scan_at = (
+                    sched.last_scan_at + timedelta(seconds=interval_for_risk(sched.risk))
+                    if sched.last_scan_at else now
+                )
+                with self._lock:
+                    self.devices[device_id] = sched
+        finally:
+            db.close()
+
+    def _capacity(self) -> int:
+        """Số camera được quét trong tick này theo công suất inference toàn hệ thống."""
+        per_tick = math.ceil(settings.AUTO_SCAN_CAPACITY_PER_HOUR * settings.AUTO_SCAN_TICK_S / 3600)
+        backlog = 0
+        if not settings.JOB_QUEUE_ENABLED and scan_orchestrator.running:
+            return 0  # lượt quét trước (trong process) chưa xong
+        if settings.JOB_QUEUE_ENABLED:
+            # job scan đã tạo mà worker chưa làm xong cũng chiếm công suất
+            from app.services.job_queue_service import job_queue
+            for s in job_queue.stats():
+                if s["queue"] == "scan":
+                    backlog = s["ready"] + s["running"]
+        return max(0, per_tick - backlog)
+
+    def tick(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        self._refresh(now)
+
+        with self._lock:
+            due = [s for s in self.devices.values() if s.next_scan_at is not None and s.next_scan_at <= now]
+        # rủi ro cao trước, cùng rủi ro thì camera trễ hạn lâu hơn trước
+        due.sort(key=lambda s: (-s.risk, s.next_scan_at))
+        capacity = self._capacity()
+        chosen, deferred = due[:capacity], due[capacity:]
+
+        for s in deferred:
+            s.deferred += 1
+        for s in chosen:
+            s.deferred = 0
+            s.last_scan_at = now
+            s.next_scan_at = now + timedelta(seconds=interval_for_risk(s.risk))
+            s.risk_at = None   # tick sau tính lại với kết quả quét mới
+
+        report: Dict[str, Any] = {
+            "at": now.isoformat(),
+            "devices": len(self.devices),
+            "due": len(due),
+            "capacity": capacity,
+            "dispatched": [s.device_id for s in chosen],
+            "deferred": [s.device_id for s in deferred],
+        }
+        self.ticks += 1
+        self.dispatched += len(chosen)
+        self.deferred += len(deferred)
+        self.last_tick = report
+
+        if chosen:
+            ids = [s.device_id for s in chosen]
+            logger.info(f"[AdaptiveScan] Quét {len(ids)}/{len(due)} camera đến hạn (công suất {capacity})")
+            if settings.JOB_QUEUE_ENABLED:
+                # slot theo cửa sổ AUTO_SCAN_MIN_INTERVAL_S: nhiều process cùng chạy tick
+                # cũng không quét 1 camera 2 lần trong 1 cửa sổ
+                window = int(now.timestamp() // settings.AUTO_SCAN_MIN_INTERVAL_S)
+                scan_orchestrator.enqueue_run(
+                    num_images=settings.AUTO_SCAN_NUM_IMAGES,
+                    slot=f"a{window}",
+                    device_ids=ids,
+                )
+            else:
+                scan_orchestrator.run(num_images=settings.AUTO_SCAN_NUM_IMAGES, trigger="adaptive", device_ids=ids)
+        return report
+
+    def schedule(self) -> Dict[str, Any]:
+        """Lịch quét hiện tại của mọi camera (rủi ro cao trước) + thống kê tick."""
+        with self._lock:
+            items = sorted(self.devices.values(), key=lambda s: -s.risk)
+            return {
+                "mode": settings.AUTO_SCAN_MODE,
+                "ticks": self.ticks,
+                "dispatched_total": self.dispatched,
+                "deferred_total": self.deferred,
+                "capacity_per_hour": settings.AUTO_SCAN_CAPACITY_PER_HOUR,
+                "last_tick": self.last_tick,
+                "devices": [s.to_dict() for s in items],
+            }
+
+
+adaptive_scheduler = AdaptiveScanScheduler()
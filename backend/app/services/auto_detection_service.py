@@ -2,107 +2,40 @@
 """
 Service tự động phát hiện bệnh từ camera với kết hợp nhiều nguồn dữ liệu
 """
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Callable, Dict, Any, List, Optional
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import Counter
 import logging
 
 logger = logging.getLogger(__name__)
 
+from app.core.config import settings
 from app.models.devices import Device
-from app.models.image_detection import Img, Detection, Disease, SourceType
-from app.models.sensor_readings import SensorReadings
 from app.models.notification import Notifications  # ✅ FIX: Là Notifications (số nhiều)
-from app.services.camera_service import capture_multiple_images
-from app.services.inference_service import YoloDetector, detector
+from app.services.camera_service import capture_multiple_images, frame_to_jpeg
+from app.services.inference_service import get_detector
 from app.services.detect_service import save_detection_result
-from app.services.llm_service import summarize_detections_with_llm
-from PIL import Image
-from io import BytesIO
-import os
-from pathlib import Path
+from app.services.llm_gateway import LLMUnavailableError, llm_gateway
+from app.services.llm_service import split_llm_sections, summarize_detections_with_llm
+from app.services.frame_dedup_service import dedupe_frames, find_reusable_result, frame_store
+from app.services.scan_context_service import (
+    ScanContext,
+    load_recent_detections,
+    load_scan_context,
+    load_sensor_summaries,
+)
+import time
 
 
 def get_recent_sensor_readings(db: Session, device_id: int, hours: int = 24) -> Dict[str, Any]:
-    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-
-    readings = db.query(SensorReadings).filter(
-        SensorReadings.device_id == device_id,
-        SensorReadings.recorded_at >= cutoff_time,
-        SensorReadings.status == "ok"
-    ).order_by(SensorReadings.recorded_at.desc()).all()
-
-    if not readings:
-        return {}
-
-    metrics = {}
-    for reading in readings:
-        metric_name = reading.metric
-        if metric_name not in metrics:
-            metrics[metric_name] = {'values': [], 'unit': reading.unit}
-        if reading.value_num is not None:
-            metrics[metric_name]['values'].append(float(reading.value_num))
-
-    result = {}
-    for metric_name, data in metrics.items():
-        if data['values']:
-            result[metric_name] = {
-                'avg': sum(data['values']) / len(data['values']),
-                'min': min(data['values']),
-                'max': max(data['values']),
-                'unit': data['unit'],
-                'count': len(data['values'])
-            }
-    return result
+    # avg/min/max tính bằng GROUP BY trong DB (scan_context_service)
+    return load_sensor_summaries(db, [device_id], hours=hours).get(device_id, {})
 
 
 def get_recent_detections(db: Session, device_id: int, days: int = 7) -> List[Dict[str, Any]]:
-    cutoff_time = datetime.utcnow() - timedelta(days=days)
-
-    detections = db.query(Detection).join(Img).filter(
-        Img.device_id == device_id,
-        Detection.created_at >= cutoff_time
-    ).order_by(Detection.created_at.desc()).limit(50).all()
-
-    result = []
-    for det in detections:
-        result.append({
-            'disease_name': det.disease.name if det.disease else None,
-            'confidence': float(det.confidence) if det.confidence else 0.0,
-            'created_at': det.created_at
-        })
-    return result
-
-
-def analyze_disease_trend(recent_detections: List[Dict[str, Any]]) -> Dict[str, Any]:
-    if not recent_detections:
-        return {'has_history': False, 'trend': 'no_data'}
-
-    disease_counts = Counter()
-    disease_confidences = {}
-
-    for det in recent_detections:
-        disease_name = det.get('disease_name')
-        if disease_name and disease_name not in ['Không xác định', 'pomelo_leaf_healthy', 'pomelo_fruit_healthy']:
-            disease_counts[disease_name] += 1
-            disease_confidences.setdefault(disease_name, []).append(det.get('confidence', 0.0))
-
-    disease_avg_conf = {k: sum(v)/len(v) for k, v in disease_confidences.items() if v}
-
-    if disease_counts:
-        most_common = disease_counts.most_common(1)[0]
-        trend = 'increasing' if most_common[1] >= 3 else 'stable'
-        return {
-            'has_history': True,
-            'trend': trend,
-            'most_common_disease': most_common[0],
-            'occurrence_count': most_common[1],
-            'avg_confidence': disease_avg_conf.get(most_common[0], 0.0),
-            'all_diseases': dict(disease_counts)
-        }
-    else:
-        return {'has_history': True, 'trend': 'healthy', 'most_common_disease': None}
+    # 1 truy vấn JOIN diseases, không lazy-load det.disease từng dòng
+    return load_recent_detections(db, [device_id], days=days).get(device_id, [])
 
 
 def build_enhanced_prompt(
@@ -160,17 +93,30 @@ def build_enhanced_prompt(
     return "\n".join(lines)
 
 
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
 def detect_from_camera_auto(
     db: Session,
     device: Device,
     num_images: int = 3,
-    auto_stop_stream: bool = True
+    auto_stop_stream: bool = True,
+    predict: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    deadline: Optional[float] = None,
+    context: Optional[ScanContext] = None,
 ) -> Dict[str, Any]:
     """Auto-detect từ camera.
     
     ✅ FIX: 
     - Tự động stop stream sau khi detection xong (nếu auto_stop_stream=True)
     - Tránh resource leak từ ffmpeg processes
+
+    predict: hàm chạy YOLO cho 1 frame (scan_orchestrator truyền batch engine để
+    gom frame của nhiều camera), mặc định detector.predict_bytes.
+    deadline: time.monotonic() hết ngân sách của camera này → ngừng chụp thêm
+    và bỏ bước gọi LLM còn lại.
+    context: cảm biến + lịch sử đã nạp sẵn theo lô (scan_context_service), None → tự nạp.
     """
     if not device.stream_url:
         return {'success': False, 'error': 'Device không có stream_url'}
@@ -185,6 +131,9 @@ def detect_from_camera_auto(
             count=num_images,
             interval=1.0,
             device_id=device.device_id,
+            # frame RTSP/HLS giữ dạng ndarray → detector đọc thẳng, chỉ encode JPEG ảnh được lưu
+            as_array=True,
+            deadline=deadline,
         )
 
         if not images:
@@ -192,21 +141,29 @@ def detect_from_camera_auto(
 
         logger.info(f"[AutoDetection] Đã lấy được {len(images)} ảnh")
 
-        THIS_DIR = Path(__file__).resolve().parent
-        REPO_ROOT = THIS_DIR.parents[2]
-        MODEL_PATH = os.getenv("MODEL_PATH", str(REPO_ROOT / "ml/exports/v1.0/best.pt"))
-
-        local_detector = None
-        try:
-            local_detector = detector
-        except NameError:
-            local_detector = None
-
+        # ✅ Bỏ frame gần như trùng nhau; cảnh không đổi so với lần quét trước
+        # → dùng lại kết quả cũ, không chạy YOLO + LLM
+        captured_count = len(images)
+        frame_hashes = []
+        if settings.SCAN_DEDUP_ENABLED:
+            images, frame_hashes = dedupe_frames(images)
+            reused = find_reusable_result(device.device_id, frame_hashes)
+            if reused is not None:
+                logger.info(f"[AutoDetection] Camera {device.device_id}: cảnh không đổi, dùng lại kết quả lần quét trước")
+                reused.update({
+                    'skipped': True,
+                    'skip_reason': 'scene_unchanged',
+                    'images_captured': captured_count,
+                    'saved_result': None,
+                    'notification_created': False,
+                    'stream_stopped': False,
+                })
+                return reused
+
+        local_detector = get_detector()
         if local_detector is None:
-            try:
-                local_detector = YoloDetector(MODEL_PATH)
-            except FileNotFoundError:
-                return {'success': False, 'error': f'Model not found: {MODEL_PATH}'}
+            return {'success': False, 'error': 'Model chưa được load trên worker này'}
+        predict = predict or local_detector.predict_bytes
 
         all_detections = []
         best_detection = None
@@ -214,7 +171,7 @@ def detect_from_camera_auto(
 
         for i, img_data in enumerate(images):
             try:
-                pred = local_detector.predict_bytes(img_data)
+                pred = predict(img_data)
 
                 if not pred or pred.get('num_detections', 0) == 0:
                     class_name = 'Không xác định'
@@ -241,35 +198,36 @@ def detect_from_camera_auto(
                 logger.error(f"[AutoDetection] Lỗi khi detect ảnh {i+1}: {e}")
                 continue
 
-        sensor_data = get_recent_sensor_readings(db, device.device_id, hours=24)
-        recent_detections = get_recent_detections(db, device.device_id, days=7)
-        trend_info = analyze_disease_trend(recent_detections)
+        if context is None:
+            context = load_scan_context(db, device.device_id)
+        sensor_data = context.sensor_data
+        trend_info = context.trend_info
 
         enhanced_prompt = build_enhanced_prompt(all_detections, sensor_data, device, trend_info)
 
         disease_summary = None
         care_instructions = None
 
-        if all_detections:
+        left = _time_left(deadline)
+        if all_detections and left is not None and left <= 0:
+            logger.warning(f"[AutoDetection] Camera {device.device_id}: hết ngân sách thời gian, bỏ qua LLM")
+        elif all_detections:
             try:
-                disease_summary, care_instructions = summarize_detections_with_llm(all_detections)
-
-                if sensor_data or trend_info.get('has_history'):
-                    from app.services.llm_service import client, GEMINI_MODEL
-                    import google.generativeai as genai
-
-                    if client:
-                        model = genai.GenerativeModel(model_name=GEMINI_MODEL)
-                        response = model.generate_content(enhanced_prompt)
-                        full_text = (response.text or "").strip()
-
-                        text_lower = full_text.lower()
-                        idx_ds = text_lower.find("[disease_summary]")
-                        idx_ci = text_lower.find("[care_instructions]")
+                disease_summary, care_instructions = summarize_detections_with_llm(
+                    all_detections, model_version=local_detector.model_version
+                )
 
-                        if idx_ds != -1 and idx_ci != -1:
-                            disease_summary = full_text[idx_ds + len("[DISEASE_SUMMARY]"): idx_ci].strip()
-                            care_instructions = full_text[idx_ci + len("[CARE_INSTRUCTIONS]"):].strip()
+                left = _time_left(deadline)
+                if left is not None and left < settings.LLM_TIMEOUT_S:
+                    logger.info(f"[AutoDetection] Camera {device.device_id}: còn {left:.1f}s, giữ tóm tắt cơ bản")
+                elif llm_gateway.enabled and (sensor_data or trend_info.get('has_history')):
+                    # prompt có thêm cảm biến + xu hướng → không cache, gọi qua gateway dùng chung
+                    try:
+                        enhanced = split_llm_sections(llm_gateway.generate(enhanced_prompt))
+                        if all(enhanced):
+                            disease_summary, care_instructions = enhanced
+                    except LLMUnavailableError as e:
+                        logger.warning(f"[AutoDetection] LLM quá tải, giữ tóm tắt cơ bản: {e}")
             except Exception as e:
                 logger.error(f"[AutoDetection] Lỗi khi gọi LLM: {e}")
 
@@ -290,12 +248,12 @@ def detect_from_camera_auto(
 
                 saved_result = save_detection_result(
                     db=db,
-                    raw=images[0],
+                    raw=frame_to_jpeg(images[0]),
                     filename=f"auto_scan_{device.device_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg",
                     yolo_result=yolo_result,
                     user_id=device.user_id,
                     device_id=device.device_id,
-                    model_version="v1.0"
+                    model_version=local_detector.model_version
                 )
 
                 healthy_classes = {'pomelo_leaf_healthy', 'pomelo_fruit_healthy'}
@@ -350,11 +308,12 @@ Hướng dẫn xử lý:
                 except Exception as e:
                     logger.warning(f"[AutoDetection] Lỗi khi stop stream device {device.device_id}: {e}")
 
-        return {
+        result = {
             'success': True,
             'device_id': device.device_id,
             'device_name': device.name,
-            'images_captured': len(images),
+            'images_captured': captured_count,
+            'images_analyzed': len(images),
             'detections_count': len(all_detections),
             'has_disease': has_disease,
             'disease_summary': disease_summary,
@@ -365,6 +324,11 @@ Hướng dẫn xử lý:
             'notification_created': notification_created,
             'stream_stopped': auto_stop_stream  # ✅ Report stream stopped status
         }
+
+        if frame_hashes and frame_hashes[0] is not None and all_detections:
+            frame_store.update(device.device_id, frame_hashes[0], result)
+
+        return result
     except Exception as e:
         logger.error(f"[AutoDetection] Lỗi chung trong detect_from_camera_auto: {e}", exc_info=True)
         # ✅ Even on error, try to stop stream
@@ -0,0 +1,241 @@
+# app/services/batch_inference_service.py
+"""
+Micro-batching cho YoloDetector.
+
+Các request /detect đồng thời được gom lại trong vài ms rồi chạy chung
+1 lần `model.predict` (batch), mỗi caller nhận lại đúng kết quả của mình.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingRequest:
+    raw: bytes
+    conf: float
+    iou: float
+    detector: Any = None   # model cụ thể (pin version / hot-swap), None → self.detector
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchInferenceEngine:
+    """Gom request thành batch và chạy trên 1 worker thread riêng (ngoài event loop)."""
+
+    def __init__(
+        self,
+        detector,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 0,
+    ):
+        self.detector = detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        # max_queue_size = 0 → không giới hạn
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue(maxsize=max(0, int(max_queue_size)))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+        # ----- metrics -----
+        self._metrics_lock = threading.Lock()
+        self._requests_total = 0
+        self._batches_total = 0
+        self._errors_total = 0
+        self._max_batch_seen = 0
+        self._batch_size_hist: Dict[int, int] = {}
+        self._wait_ms_total = 0.0
+        self._last_batch_ms: Optional[float] = None
+
+    # ============================================
+    # Lifecycle
+    # ============================================
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="yolo-batcher", daemon=True
+            )
+            self._thread.start()
+            logger.info(
+                f"[Batcher] Started (max_batch_size={self.max_batch_size}, "
+                f"max_wait_ms={self.max_wait * 1000:.1f})"
+            )
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    # ============================================
+    # API cho caller
+    # ============================================
+    def submit(self, raw: bytes, conf: float = 0.5, iou: float = 0.5, detector=None) -> Future:
+        """
+        Đưa 1 ảnh vào hàng đợi, trả về Future chứa dict kết quả như predict_bytes.
+        detector: model sẽ chạy ảnh này (mặc định self.detector). Request giữ
+        reference tới model lúc submit nên hot-swap không ảnh hưởng request đang chờ.
+        Raise queue.Full nếu hàng đợi đã đầy (caller tự xử lý backpressure).
+        """
+        self.start()
+        req = _PendingRequest(raw=raw, conf=conf, iou=iou, detector=detector or self.detector)
+        self._queue.put_nowait(req)
+        return req.future
+
+    def predict(self, raw: bytes, conf: float = 0.5, iou: float = 0.5,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Bản đồng bộ (dùng trong thread/scheduler)."""
+        return self.submit(raw, conf, iou).result(timeout=timeout)
+
+    async def predict_async(self, raw: bytes, conf: float = 0.5, iou: float = 0.5) -> Dict[str, Any]:
+        """Bản async cho route: không block event loop trong lúc chờ batch."""
+        return await asyncio.wrap_future(self.submit(raw, conf, iou))
+
+    # ============================================
+    # Worker loop
+    # ============================================
+    def _collect_batch(self) -> List[_PendingRequest]:
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            # model.predict nhận chung conf/iou cho cả batch → tách nhóm theo model + tham số
+            groups: Dict[tuple, List[_PendingRequest]] = {}
+            for req in batch:
+                groups.setdefault((id(req.detector), req.conf, req.iou), []).append(req)
+
+            for (_, conf, iou), reqs in groups.items():
+                self._run_group(reqs[0].detector, reqs, conf, iou)
+
+    def _run_group(self, detector, reqs: List[_PendingRequest], conf: float, iou: float) -> None:
+        # Decode từng ảnh riêng: 1 file hỏng chỉ làm fail request của chính nó
+        ok_reqs: List[_PendingRequest] = []
+        imgs = []
+        for req in reqs:
+            if not req.future.set_running_or_notify_cancel():
+                continue
+            try:
+                imgs.append(detector.load_image(req.raw))
+                ok_reqs.append(req)
+            except Exception as e:
+                self._count_error()
+                req.future.set_exception(e)
+
+        if not ok_reqs:
+            return
+
+        started = time.perf_counter()
+        try:
+            results = detector.predict_images(imgs, conf=conf, iou=iou)
+        except Exception as e:
+            logger.error(f"[Batcher] Batch predict failed ({len(ok_reqs)} ảnh): {e}")
+            for req in ok_reqs:
+                self._count_error()
+                req.future.set_exception(e)
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        for req, res in zip(ok_reqs, results):
+            req.future.set_result(res)
+
+        self._record_batch(ok_reqs, started, elapsed_ms)
+
+    # ============================================
+    # Metrics
+    # ============================================
+    def _count_error(self) -> None:
+        with self._metrics_lock:
+            self._errors_total += 1
+
+    def _record_batch(self, reqs: List[_PendingRequest], started: float, elapsed_ms: float) -> None:
+        size = len(reqs)
+        wait_ms = sum((started - r.enqueued_at) * 1000 for r in reqs)
+        with self._metrics_lock:
+            self._requests_total += size
+            self._batches_total += 1
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_size_hist[size] = self._batch_size_hist.get(size, 0) + 1
+            self._wait_ms_total += wait_ms
+            self._last_batch_ms = elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            batches = self._batches_total
+            requests = self._requests_total
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self._queue.maxsize,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "requests_total": requests,
+                "batches_total": batches,
+                "errors_total": self._errors_total,
+                "avg_batch_size": round(requests / batches, 3) if batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "batch_size_histogram": dict(sorted(self._batch_size_hist.items())),
+                "avg_queue_wait_ms": round(self._wait_ms_total / requests, 3) if requests else 0.0,
+                "last_batch_ms": round(self._last_batch_ms, 3) if self._last_batch_ms is not None else None,
+            }
+
+
+# instance dùng chung (None nếu model chưa load hoặc tắt batching)
+batch_engine: BatchInferenceEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_batch_engine() -> BatchInferenceEngine | None:
+    global batch_engine
+    if batch_engine is not None:
+        return batch_engine
+    if not settings.INFERENCE_BATCHING_ENABLED:
+        return None
+
+    from app.services.inference_service import get_detector
+    detector = get_detector()
+    if detector is None:
+        return None
+
+    with _engine_lock:
+        if batch_engine is None:
+            batch_engine = BatchInferenceEngine(
+                detector,
+                max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+                max_queue_size=settings.INFERENCE_MAX_PENDING,
+            )
+    return batch_engine
@@ -6,11 +6,13 @@ Hỗ trợ: HTTP snapshot, RTSP (cần ffmpeg/opencv), MJPEG stream, lấy frame
 import logging
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional, Union
 
 import requests
 from PIL import Image
 
+from app.utils.mjpeg import latest_frame
+
 logger = logging.getLogger(__name__)
 
 # OpenCV chỉ import khi cần (cho RTSP/HLS)
@@ -22,7 +24,23 @@ except ImportError:
     CV2_AVAILABLE = False
     logger.warning("OpenCV không có sẵn, RTSP/HLS sẽ không hoạt động")
 
-def capture_image_from_stream(stream_url: str, timeout: int = 10) -> Optional[bytes]:
+# Frame camera: bytes JPEG (HTTP snapshot/MJPEG) hoặc ndarray BGR (RTSP/HLS khi as_array=True)
+Frame = Union[bytes, Any]
+
+
+def frame_to_jpeg(frame: Frame, quality: int = 85) -> Optional[bytes]:
+    """Encode frame ndarray BGR → JPEG (bytes giữ nguyên). Chỉ gọi cho frame cần lưu."""
+    if isinstance(frame, (bytes, bytearray)):
+        return bytes(frame)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes() if ok else None
+
+
+def capture_image_from_stream(
+    stream_url: str,
+    timeout: int = 10,
+    as_array: bool = False,
+) -> Optional[Frame]:
     """
     Lấy ảnh từ camera stream_url.
 
@@ -31,8 +49,11 @@ def capture_image_from_stream(stream_url: str, timeout: int = 10) -> Optional[by
     - MJPEG stream: http://ip:port/video.mjpg
     - RTSP: rtsp://ip:port/stream (cần opencv)
 
+    as_array: RTSP trả luôn frame ndarray BGR (bỏ bước encode JPEG), detector
+    đọc được trực tiếp. HTTP vẫn trả bytes vì camera đã gửi sẵn JPEG.
+
     Returns:
-        bytes: Dữ liệu ảnh (JPEG) hoặc None nếu lỗi
+        bytes: Dữ liệu ảnh (JPEG), ndarray BGR (as_array) hoặc None nếu lỗi
     """
     if not stream_url or not stream_url.strip():
         return None
@@ -63,7 +84,7 @@ def capture_image_from_stream(stream_url: str, timeout: int = 10) -> Optional[by
 
         # ===== RTSP STREAM =====
         if stream_url.startswith("rtsp://"):
-            return _capture_from_rtsp(stream_url, timeout)
+            return _capture_from_rtsp(stream_url, timeout, as_array=as_array)
 
         logger.warning(f"[Camera] Unsupported stream URL format: {stream_url}")
         return None
@@ -76,39 +97,18 @@ def capture_image_from_stream(stream_url: str, timeout: int = 10) -> Optional[by
         return None
 
 def _extract_frame_from_mjpeg(resp: requests.Response, max_bytes: int = 2_000_000) -> Optional[bytes]:
-    """Lấy frame đầu tiên từ MJPEG stream bằng cách đọc theo chunk.
+    """Lấy frame mới nhất trong đợt dữ liệu đầu tiên của MJPEG stream.
 
-    max_bytes: giới hạn đọc để tránh treo/ăn RAM.
+    Tách frame theo boundary/Content-Length (app.utils.mjpeg), không quét lại
+    buffer từ đầu mỗi chunk. max_bytes: giới hạn đọc để tránh treo/ăn RAM.
     """
     try:
-        buffer = bytearray()
-        start = -1
-
-        for chunk in resp.iter_content(chunk_size=4096):
-            if not chunk:
-                continue
-            buffer.extend(chunk)
-
-            if start == -1:
-                start = buffer.find(b"\xff\xd8")  # JPEG start
-                if start == -1:
-                    if len(buffer) > max_bytes:
-                        return None
-                    continue
-
-            end = buffer.find(b"\xff\xd9", start)  # JPEG end
-            if end != -1:
-                return bytes(buffer[start:end + 2])
-
-            if len(buffer) > max_bytes:
-                return None
-
-        return None
+        return latest_frame(resp, max_bytes=max_bytes)
     except Exception as e:
         logger.error(f"[Camera] Error extracting MJPEG frame: {e}")
         return None
 
-def _capture_from_rtsp(rtsp_url: str, timeout: int = 10) -> Optional[bytes]:
+def _capture_from_rtsp(rtsp_url: str, timeout: int = 10, as_array: bool = False) -> Optional[Frame]:
     """
     Lấy ảnh từ RTSP stream bằng OpenCV.
     Hỗ trợ DroidCam và các RTSP cameras khác.
@@ -151,22 +151,33 @@ def _capture_from_rtsp(rtsp_url: str, timeout: int = 10) -> Optional[bytes]:
             logger.warning(f"[Camera] Không đọc được frame từ RTSP: {rtsp_url}")
             return None
 
-        # Chuyển BGR sang RGB và encode thành JPEG
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
-        output = BytesIO()
-        img.save(output, format="JPEG", quality=85)
         logger.info(f"[Camera] Successfully captured from RTSP: {rtsp_url}")
-        return output.getvalue()
+        if as_array:
+            return frame
+        return frame_to_jpeg(frame)
 
     except Exception as e:
         logger.error(f"[Camera] Error capturing RTSP: {e}")
         return None
 
-def _capture_image_from_hls(device_id: int) -> Optional[bytes]:
+def _capture_image_from_hls(
+    device_id: int,
+    as_array: bool = False,
+    stream_url: Optional[str] = None,
+) -> Optional[Frame]:
     """Lấy một frame từ HLS đã được stream_service tạo sẵn.
     Ưu tiên dùng khi RTSP bị độc quyền bởi ffmpeg.
+
+    Trước hết đọc latest.jpg mà chính ffmpeg đó ghi song song (JPEG sẵn, mới
+    nhất, không decode lại segment .ts); không có mới lấy frame đầu segment.
+    as_array bị bỏ qua cho latest.jpg: detector đọc thẳng bytes JPEG.
     """
+    from app.services import stream_service
+
+    snapshot = stream_service.read_snapshot(device_id, stream_url)
+    if snapshot is not None:
+        return snapshot
+
     if not CV2_AVAILABLE:
         return None
 
@@ -193,22 +204,40 @@ def _capture_image_from_hls(device_id: int) -> Optional[bytes]:
         if not ret or frame is None:
             return None
 
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
-        output = BytesIO()
-        img.save(output, format="JPEG", quality=85)
-        return output.getvalue()
+        if as_array:
+            return frame
+        return frame_to_jpeg(frame)
 
     except Exception as e:
         logger.error(f"[Camera] Error capturing HLS frame for device {device_id}: {e}")
         return None
 
+def _capture_from_session(stream_url: str, device_id: int, count: int, as_array: bool) -> list[Frame]:
+    """
+    Frame mới nhất từ reader giữ kết nối của camera (không handshake lại mỗi ảnh).
+    Camera đang phát HLS (ffmpeg giữ kết nối) thì để _capture_image_from_hls lo.
+    """
+    from app.services import stream_service
+    from app.services.camera_session_service import camera_sessions
+
+    if stream_service.is_running(device_id) or stream_service.has_live_snapshot(device_id, stream_url):
+        return []
+    frames = camera_sessions.get_frames(device_id, stream_url, count) or []
+    if not as_array:
+        frames = [f for f in (frame_to_jpeg(f) for f in frames) if f]
+    if frames:
+        logger.info(f"[Camera] Lấy {len(frames)}/{count} frame từ reader của camera {device_id}")
+    return frames
+
+
 def capture_multiple_images(
     stream_url: str,
     count: int = 3,
     interval: float = 1.0,
     device_id: Optional[int] = None,
-) -> list[bytes]:
+    as_array: bool = False,
+    deadline: Optional[float] = None,
+) -> list[Frame]:
     """
     Lấy nhiều ảnh từ camera (để tăng độ chính xác).
 
@@ -216,27 +245,39 @@ def capture_multiple_images(
         stream_url: URL của camera stream
         count: Số lượng ảnh cần lấy (mặc định 3)
         interval: Khoảng thời gian giữa các lần lấy (giây)
-        device_id: nếu có, thử lấy từ HLS trước
+        device_id: nếu có, lấy từ reader giữ kết nối (camera_session_service)
+            hoặc HLS trước
+        as_array: frame RTSP/HLS giữ dạng ndarray BGR (xem capture_image_from_stream)
+        deadline: time.monotonic() phải dừng; đã có ít nhất 1 ảnh thì không chụp thêm
 
     Returns:
-        List các ảnh (bytes), có thể ít hơn count nếu lỗi
+        List các ảnh (bytes hoặc ndarray), có thể ít hơn count nếu lỗi
     """
     import time
 
-    images: list[bytes] = []
+    images: list[Frame] = []
+    if device_id is not None:
+        images = _capture_from_session(stream_url, device_id, count, as_array)
+        if len(images) >= count:
+            return images
+
+    # chụp bù từng ảnh (không có reader, snapshot tĩnh, hoặc ring chưa đủ frame)
+    count -= len(images)
     for i in range(count):
         img_data = None
 
         if device_id is not None:
-            img_data = _capture_image_from_hls(device_id)
+            img_data = _capture_image_from_hls(device_id, as_array=as_array, stream_url=stream_url)
 
         if img_data is None:
-            img_data = capture_image_from_stream(stream_url)
+            img_data = capture_image_from_stream(stream_url, as_array=as_array)
 
-        if img_data:
+        if img_data is not None and len(img_data) > 0:
             images.append(img_data)
 
         if i < count - 1:
+            if deadline is not None and images and time.monotonic() + interval >= deadline:
+                break
             time.sleep(interval)
 
     return images
\ No newline at end of file
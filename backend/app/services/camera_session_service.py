@@ -0,0 +1,346 @@
+# app/services/camera_session_service.py
+"""
+Giữ kết nối camera lâu dài thay vì mở lại cho mỗi lần chụp.
+
+- Mỗi camera đang được dùng có 1 thread đọc liên tục (RTSP qua cv2.VideoCapture,
+  MJPEG qua 1 request HTTP stream) và 1 ring buffer CAMERA_RING_SIZE frame,
+  lấy mẫu mỗi CAMERA_SAMPLE_INTERVAL_S giây.
+- get_frames() trả ngay N frame mới nhất trong ring (chỉ chờ khi ring chưa đủ,
+  vd lần đầu mở kết nối) → bỏ handshake RTSP / chờ keyframe cho mỗi ảnh.
+- Reader không ai dùng quá CAMERA_IDLE_TIMEOUT_S bị đóng; tối đa
+  CAMERA_MAX_SESSIONS kết nối mở cùng lúc (đầy → đóng reader lâu chưa dùng nhất,
+  tất cả đang bận → trả None, camera_service tự chụp theo cách cũ).
+- HTTP snapshot (không phải stream) không cần reader: trả None.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+
+from app.core.config import settings
+from app.utils.mjpeg import iter_frames
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# URL đã biết là snapshot tĩnh (không giữ luồng được) → không mở reader lại
+_NOT_STREAMS: set = set()
+
+
+class CameraReader(threading.Thread):
+    """Thread đọc 1 camera, giữ CAMERA_RING_SIZE frame (ts, frame) mới nhất."""
+
+    def __init__(self, device_id: int, stream_url: str):
+        super().__init__(name=f"cam-{device_id}", daemon=True)
+        self.device_id = device_id
+        self.stream_url = stream_url
+        self.ring: Deque[Tuple[float, Any]] = deque(maxlen=max(1, settings.CAMERA_RING_SIZE))
+        self._cond = threading.Condition()
+        self._stop_evt = threading.Event()
+
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.users = 0              # số lời gọi get_frames đang chờ reader này
+        self.connected = False
+        self.frames_read = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+
+    # ============================================
+    # Vòng đọc
+    # ============================================
+    def stop(self) -> None:
+        self._stop_evt.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_evt.is_set()
+
+    def _push(self, frame: Any) -> None:
+        with self._cond:
+            self.ring.append((time.monotonic(), frame))
+            self._cond.notify_all()
+
+    def _due(self, last_sample: float) -> bool:
+        return time.monotonic() - last_sample >= settings.CAMERA_SAMPLE_INTERVAL_S
+
+    def _read_rtsp(self) -> None:
+        cap = cv2.VideoCapture(self.stream_url, cv2.CAP_FFMPEG)
+        try:
+            timeout_ms = int(settings.CAMERA_CONNECT_TIMEOUT_S * 1000)
+            try:
+                cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms)
+                cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms)
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            except Exception:
+                pass
+            if not cap.isOpened():
+                raise ConnectionError("không mở được RTSP")
+
+            last_sample = 0.0
+            while not self.stopped:
+                # grab() mọi frame để không bị tụt lại sau luồng, chỉ decode frame được lấy mẫu
+                if not cap.grab():
+                    raise ConnectionError("mất kết nối RTSP")
+                self.connected = True
+                if not self._due(last_sample):
+                    continue
+                ok, frame = cap.retrieve()
+                if ok and frame is not None:
+                    last_sample = time.monotonic()
+                    self.frames_read += 1
+                    self._push(frame)
+        finally:
+            cap.release()
+
+    def _read_mjpeg(self) -> None:
+        resp = requests.get(self.stream_url, timeout=settings.CAMERA_CONNECT_TIMEOUT_S, stream=True)
+        try:
+            resp.raise_for_status()
+            content_type = (resp.headers.get("content-type") or "").lower()
+            if "multipart" not in content_type and "mjpeg" not in content_type:
+                # snapshot tĩnh: không có luồng để giữ
+                raise ValueError(f"không phải MJPEG stream ({content_type or 'unknown'})")
+
+            last_sample = 0.0
+            for frame in iter_frames(resp):
+                if self.stopped:
+                    return
+                self.connected = True
+                if self._due(last_sample):
+                    last_sample = time.monotonic()
+                    self.frames_read += 1
+                    self._push(frame)
+            raise ConnectionError("MJPEG stream kết thúc")
+        finally:
+            resp.close()
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self.stopped:
+            try:
+                if self.stream_url.startswith("rtsp://"):
+                    self._read_rtsp()
+                else:
+                    self._read_mjpeg()
+            except ValueError as e:
+                # không đọc liên tục được → dừng hẳn, camera_service dùng cách cũ
+                self.last_error = str(e)
+                _NOT_STREAMS.add(self.stream_url)
+                logger.info(f"[CameraSession] Camera {self.device_id}: {e}, dừng reader")
+                self.stop()
+                break
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"[CameraSession] Camera {self.device_id}: {self.last_error}")
+            if self.connected:
+                backoff = 1.0   # đã đọc được rồi mới rớt → thử lại nhanh
+            self.connected = False
+            if self.stopped:
+                break
+            self.reconnects += 1
+            self._stop_evt.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    # ============================================
+    # Đọc ring
+    # ============================================
+    def latest(self, count: int, max_age: float, wait_s: float) -> List[Any]:
+        """≤ count frame mới nhất (cũ → mới) không quá max_age giây; chờ tối đa wait_s cho đủ."""
+        deadline = time.monotonic() + wait_s
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                fresh = [f for ts, f in self.ring if now - ts <= max_age]
+                if len(fresh) >= count or self.stopped or now >= deadline:
+                    return fresh[-count:]
+                self._cond.wait(deadline - now)
+
+    def info(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        newest = self.ring[-1][0] if self.ring else None
+        return {
+            "device_id": self.device_id,
+            "connected": self.connected,
+            "buffered": len(self.ring),
+            "frames_read": self.frames_read,
+            "reconnects": self.reconnects,
+            "newest_frame_age_s": round(now - newest, 2) if newest is not None else None,
+            "idle_s": round(now - self.last_used, 1),
+            "last_error": self.last_error,
+        }
+
+
+class CameraSessionManager:
+    def __init__(self):
+        self._readers: Dict[int, CameraReader] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+        self.hits = 0               # đủ frame từ ring
+        self.partial = 0            # thiếu frame (camera_service chụp bù)
+        self.opened = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.rejected_full = 0
+
+    # ============================================
+    # Vòng đời reader
+    # ============================================
+    def _acquire(self, device_id: int, stream_url: str) -> Optional[CameraReader]:
+        with self._lock:
+            reader = self._readers.get(device_id)
+            if reader is not None and (reader.stopped or reader.stream_url != stream_url):
+                # URL đổi hoặc reader đã tự dừng → mở lại
+                reader.stop()
+                del self._readers[device_id]
+                reader = None
+
+            if reader is None:
+                if len(self._readers) >= settings.CAMERA_MAX_SESSIONS and not self._evict_lru():
+                    self.rejected_full += 1
+                    return None
+                reader = CameraReader(device_id, stream_url)
+                self._readers[device_id] = reader
+                self.opened += 1
+                reader.start()
+                self._ensure_reaper()
+                logger.info(f"[CameraSession] Mở reader cho camera {device_id} ({len(self._readers)} đang mở)")
+
+            reader.users += 1
+            reader.last_used = time.monotonic()
+            return reader
+
+    def _release(self, reader: CameraReader) -> None:
+        with self._lock:
+            reader.users -= 1
+            reader.last_used = time.monotonic()
+
+    def _evict_lru(self) -> bool:
+        """Đóng reader lâu chưa dùng nhất mà không ai đang chờ (phải giữ _lock)."""
+        idle = [r for r in self._readers.values() if r.users == 0]
+        if not idle:
+            return False
+        victim = min(idle, key=lambda r: r.last_used)
+        victim.stop()
+        del self._readers[victim.device_id]
+        self.evicted_lru += 1
+        logger.info(f"[CameraSession] Đầy {settings.CAMERA_MAX_SESSIONS} kết nối, đóng camera {victim.device_id}")
+        return True
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, name="cam-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(max(1.0, min(30.0, settings.CAMERA_IDLE_TIMEOUT_S / 4)))
+            now = time.monotonic()
+            with self._lock:
+                for device_id, reader in list(self._readers.items()):
+                    if reader.stopped and reader.users == 0:
+                        del self._readers[device_id]
+                    elif reader.users == 0 and now - reader.last_used > settings.CAMERA_IDLE_TIMEOUT_S:
+                        reader.stop()
+                        del self._readers[device_id]
+                        self.evicted_idle += 1
+                        logger.info(f"[CameraSession] Camera {device_id} rảnh quá lâu, đóng reader")
+                if not self._readers:
+                    self._reaper = None
+                    return
+
+    def close(self, device_id: int) -> None:
+        with self._lock:
+            reader = self._readers.pop(device_id, None)
+        if reader is not None:
+            reader.stop()
+
+    def close_url(self, stream_url: str) -> None:
+        """Đóng mọi reader đang đọc URL này (ffmpeg sắp mở kết nối riêng tới camera)."""
+        stream_url = (stream_url or "").strip()
+        with self._lock:
+            readers = [r for r in self._readers.values() if r.stream_url == stream_url]
+            for reader in readers:
+                del self._readers[reader.device_id]
+        for reader in readers:
+            reader.stop()
+
+    def close_all(self) -> None:
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.stop()
+
+    # ============================================
+    # API
+    # ============================================
+    def get_frames(
+        self,
+        device_id: int,
+        stream_url: str,
+        count: int,
+        wait_s: Optional[float] = None,
+    ) -> Optional[List[Any]]:
+        """
+        N frame mới nhất của camera (RTSP → ndarray BGR, MJPEG → bytes JPEG), cũ → mới.
+        None nếu không dùng reader được (tắt, snapshot, hết chỗ, không kết nối được).
+        """
+        if not settings.CAMERA_SESSIONS_ENABLED or not stream_url:
+            return None
+        stream_url = stream_url.strip()
+        if stream_url.startswith("rtsp://"):
+            if not CV2_AVAILABLE:
+                return None
+        elif not stream_url.startswith(("http://", "https://")) or stream_url in _NOT_STREAMS:
+            return None
+
+        reader = self._acquire(device_id, stream_url)
+        if reader is None:
+            return None
+        try:
+            interval = settings.CAMERA_SAMPLE_INTERVAL_S
+            if wait_s is None:
+                # kết nối mới: chờ handshake + đủ count mẫu; reader đang chạy thì ring thường đã đủ
+                wait_s = settings.CAMERA_CONNECT_TIMEOUT_S + interval * count
+            max_age = settings.CAMERA_FRAME_MAX_AGE_S + interval * count
+            frames = reader.latest(count, max_age=max_age, wait_s=wait_s)
+        finally:
+            self._release(reader)
+
+        with self._lock:
+            if len(frames) >= count:
+                self.hits += 1
+            else:
+                self.partial += 1
+        return frames or None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            readers = [r.info() for r in self._readers.values()]
+            return {
+                "enabled": settings.CAMERA_SESSIONS_ENABLED,
+                "open": len(readers),
+                "max_sessions": settings.CAMERA_MAX_SESSIONS,
+                "hits": self.hits,
+                "partial": self.partial,
+                "opened_total": self.opened,
+                "evicted_idle": self.evicted_idle,
+                "evicted_lru": self.evicted_lru,
+                "rejected_full": self.rejected_full,
+                "readers": readers,
+            }
+
+
+camera_sessions = CameraSessionManager()
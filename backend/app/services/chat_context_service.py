@@ -0,0 +1,201 @@
+# app/services/chat_context_service.py
+"""
+Giới hạn ngữ cảnh gửi Gemini cho mỗi lượt chatbot.
+
+Prompt = tóm tắt cuốn chiếu (lưu ở chatbot.summary) + K lượt hỏi/đáp gần nhất
+nguyên văn, tổng không vượt CHATBOT_CONTEXT_TOKEN_BUDGET. Các lượt cũ hơn K
+được gộp dần vào tóm tắt ở thread nền sau mỗi lượt → chi phí mỗi lượt không
+tăng theo độ dài session.
+
+chatbot.summary_upto_detail_id: detail_id cuối cùng đã nằm trong tóm tắt.
+"""
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.chatbot import Chatbot, ChatbotDetail
+from app.services.llm_gateway import LLMUnavailableError, llm_gateway
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Ước lượng số token (tiếng Việt ~3 ký tự/token), đủ dùng để giữ ngân sách."""
+    return math.ceil(len(text or "") / 3)
+
+
+def _turn_tokens(turn: Dict[str, Any]) -> int:
+    return estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"]) + 8
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max(0, max_tokens * 3)
+    if len(text) <= max_chars:
+        return text
+    # bỏ phần đầu (cũ nhất) của tóm tắt, giữ phần mới
+    return "…" + text[len(text) - max_chars:]
+
+
+# =====================================================
+# Ngữ cảnh cho 1 lượt hỏi
+# =====================================================
+def get_chat_context(
+    chatbot: Chatbot,
+    db: Session,
+    question: str = "",
+) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """
+    Trả về (summary, recent_turns) cho prompt:
+    - recent_turns: các lượt chưa nằm trong tóm tắt, cũ → mới (K lượt gần nhất
+      + tối đa CHATBOT_SUMMARY_BATCH_TURNS lượt đang chờ gộp, để không hụt ngữ cảnh)
+    - bỏ bớt lượt cũ nhất / cắt tóm tắt nếu vượt ngân sách token
+    """
+    query = db.query(ChatbotDetail).filter(ChatbotDetail.chatbot_id == chatbot.chatbot_id)
+    if chatbot.summary_upto_detail_id:
+        query = query.filter(ChatbotDetail.detail_id > chatbot.summary_upto_detail_id)
+    limit = settings.CHATBOT_CONTEXT_TURNS + settings.CHATBOT_SUMMARY_BATCH_TURNS
+    rows = query.order_by(ChatbotDetail.detail_id.desc()).limit(limit).all()
+    turns = [{"question": d.question, "answer": d.answer} for d in reversed(rows)]
+
+    summary = chatbot.summary or None
+    if summary:
+        summary = _truncate_to_tokens(summary, settings.CHATBOT_SUMMARY_MAX_TOKENS)
+
+    budget = settings.CHATBOT_CONTEXT_TOKEN_BUDGET - estimate_tokens(question) - estimate_tokens(summary)
+    while turns and sum(_turn_tokens(t) for t in turns) > budget:
+        turns.pop(0)
+    return summary, turns
+
+
+# =====================================================
+# Cập nhật tóm tắt ở nền
+# =====================================================
+SUMMARY_PROMPT = """Bạn đang tóm tắt cuộc trò chuyện giữa người dùng và trợ lý nông nghiệp.
+
+Tóm tắt hiện có:
+{summary}
+
+Các lượt hội thoại mới cần gộp vào:
+{turns}
+
+Viết lại MỘT bản tóm tắt duy nhất (tiếng Việt, tối đa khoảng {max_words} từ) giữ lại:
+cây trồng / vườn của người dùng, triệu chứng và bệnh đã nêu, các khuyến nghị đã đưa ra,
+câu hỏi còn dang dở. Chỉ trả về nội dung tóm tắt."""
+
+
+class SummaryUpdater:
+    """Gộp các lượt cũ hơn K vào chatbot.summary, mỗi session tối đa 1 job cùng lúc."""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+        self._inflight: set = set()
+        self._lock = threading.Lock()
+
+        self.scheduled = 0
+        self.updated = 0
+        self.failed = 0
+
+    def schedule(self, chatbot_id: int) -> bool:
+        """Gọi sau khi lưu 1 lượt mới; không chặn request."""
+        if not llm_gateway.enabled:
+            return False
+        with self._lock:
+            if chatbot_id in self._inflight:
+                return False
+            self._inflight.add(chatbot_id)
+            self.scheduled += 1
+        self._executor.submit(self._run, chatbot_id)
+        return True
+
+    def _run(self, chatbot_id: int) -> None:
+        try:
+            if self.update(chatbot_id):
+                with self._lock:
+                    self.updated += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.warning(f"[ChatContext] Không cập nhật được tóm tắt chatbot {chatbot_id}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(chatbot_id)
+
+    def update(self, chatbot_id: int) -> bool:
+        """
+        Gộp các lượt chưa tóm tắt (trừ K lượt mới nhất) khi đã đủ
+        CHATBOT_SUMMARY_BATCH_TURNS lượt. Trả về True nếu đã ghi tóm tắt mới.
+        """
+        db = SessionLocal()
+        try:
+            chatbot = db.query(Chatbot).filter(Chatbot.chatbot_id == chatbot_id).first()
+            if chatbot is None:
+                return False
+            upto = chatbot.summary_upto_detail_id or 0
+
+            pending = (
+                db.query(ChatbotDetail)
+                .filter(ChatbotDetail.chatbot_id == chatbot_id, ChatbotDetail.detail_id > upto)
+                .order_by(ChatbotDetail.detail_id.asc())
+                .all()
+            )
+            to_fold = pending[:max(0, len(pending) - settings.CHATBOT_CONTEXT_TURNS)]
+            if len(to_fold) < settings.CHATBOT_SUMMARY_BATCH_TURNS:
+                return False
+
+            turns_text = "\n".join(
+                f"Người dùng: {d.question}\nTrợ lý: {d.answer}" for d in to_fold
+            )
+            prompt = SUMMARY_PROMPT.format(
+                summary=chatbot.summary or "(chưa có)",
+                turns=turns_text,
+                max_words=int(settings.CHATBOT_SUMMARY_MAX_TOKENS * 0.6),
+            )
+            try:
+                new_summary = llm_gateway.generate(prompt).strip()
+            except LLMUnavailableError as e:
+                logger.info(f"[ChatContext] Bỏ qua tóm tắt chatbot {chatbot_id}: {e}")
+                return False
+            if not new_summary:
+                return False
+
+            # chỉ ghi nếu chưa có job khác cập nhật trong lúc chờ LLM
+            updated = (
+                db.query(Chatbot)
+                .filter(
+                    Chatbot.chatbot_id == chatbot_id,
+                    (Chatbot.summary_upto_detail_id == chatbot.summary_upto_detail_id)
+                    if chatbot.summary_upto_detail_id is not None
+                    else Chatbot.summary_upto_detail_id.is_(None),
+                )
+                .update(
+                    {
+                        Chatbot.summary: _truncate_to_tokens(new_summary, settings.CHATBOT_SUMMARY_MAX_TOKENS),
+                        Chatbot.summary_upto_detail_id: to_fold[-1].detail_id,
+                        Chatbot.summary_updated_at: datetime.utcnow(),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "updated": self.updated,
+                "failed": self.failed,
+                "inflight": len(self._inflight),
+            }
+
+
+summary_updater = SummaryUpdater()
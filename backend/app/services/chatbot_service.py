@@ -1,20 +1,22 @@
 # app/services/chatbot_service.py
-from typing import Optional
+from typing import AsyncIterator, Optional
 from sqlalchemy.orm import Session
-import google.generativeai as genai
 from app.core.config import settings
 from app.models.chatbot import Chatbot, ChatbotDetail, ChatbotStatus
+from app.services.executor_service import ExecutorBusyError, StageTimeoutError, run_io
+from app.services.knowledge_index_service import Retrieval, knowledge_index
+from app.services.llm_gateway import LLMUnavailableError, llm_gateway
 
-# Cấu hình Gemini API
-if settings.GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        print("[Chatbot] Gemini configured OK.")
-    except Exception as e:
-        print("[Chatbot] ERROR configuring Gemini:", e)
-else:
+# Gemini gọi qua llm_gateway (client dùng chung, timeout, rate limit, circuit breaker)
+if not llm_gateway.enabled:
     print("[Chatbot] ❌ GEMINI_API_KEY missing! Chatbot disabled.")
 
+# Trả cho người dùng khi LLM quá tải / breaker đang mở
+CHATBOT_FALLBACK_ANSWER = (
+    "Trợ lý AI đang tạm thời quá tải hoặc mất kết nối, vui lòng thử lại sau ít phút.\n"
+    "Trong lúc chờ, bạn có thể dùng chức năng chẩn đoán bằng ảnh hoặc xem mục bệnh cây trồng."
+)
+
 def get_or_create_chatbot_session(user_id: int, chatbot_id: Optional[int], db: Session) -> Chatbot:
     """
     Lấy session chatbot hiện tại hoặc tạo mới.
@@ -40,61 +42,143 @@ def get_or_create_chatbot_session(user_id: int, chatbot_id: Optional[int], db: S
     db.refresh(chatbot)
     return chatbot
 
-def send_message_to_gemini(question: str, chat_history: Optional[list] = None) -> str:
+# System prompt cho trợ lý nông nghiệp
+SYSTEM_INSTRUCTION = (
+    "Bạn là trợ lý nông nghiệp thân thiện. "
+    "Hãy trả lời ngắn gọn, dễ hiểu và ưu tiên tiếng Việt nếu người dùng dùng tiếng Việt. "
+    "Tập trung vào các vấn đề về cây trồng, bệnh tật, chăm sóc cây, và nông nghiệp."
+)
+
+def retrieve_knowledge(question: str) -> Optional[Retrieval]:
+    """Tra cứu kiến thức local (diseases / detections); None nếu tắt hoặc lỗi."""
+    if not settings.KNOWLEDGE_ENABLED:
+        return None
+    try:
+        return knowledge_index.retrieve(question)
+    except Exception as e:
+        print(f"[Chatbot] Knowledge retrieval error: {e}")
+        return None
+
+def build_chat_prompt(
+    question: str,
+    chat_history: Optional[list] = None,
+    summary: Optional[str] = None,
+    passages: Optional[list] = None,
+) -> str:
+    """Ghép system instruction + tài liệu tham khảo + tóm tắt + lịch sử chat + câu hỏi hiện tại thành 1 prompt."""
+    # Xây dựng prompt với lịch sử chat
+    prompt_parts = []
+    
+    # Thêm system instruction vào đầu
+    prompt_parts.append(SYSTEM_INSTRUCTION)
+    
+    # Đoạn kiến thức liên quan lấy từ DB (knowledge_index_service)
+    if passages:
+        prompt_parts.append("Tài liệu tham khảo (ưu tiên dùng nếu liên quan tới câu hỏi):")
+        for p in passages:
+            text = p["text"][:settings.KNOWLEDGE_PASSAGE_MAX_CHARS]
+            prompt_parts.append(f"- {p['title']}: {text}" if p.get("title") else f"- {text}")
+    
+    # Tóm tắt các lượt cũ (chat_context_service) thay cho toàn bộ lịch sử
+    if summary:
+        prompt_parts.append(f"Tóm tắt cuộc trò chuyện trước đó: {summary}")
+    
+    # Thêm lịch sử chat nếu có
+    if chat_history:
+        for msg in chat_history:
+            prompt_parts.append(f"Người dùng: {msg['question']}")
+            prompt_parts.append(f"Trợ lý: {msg['answer']}")
+    
+    # Thêm câu hỏi hiện tại
+    prompt_parts.append(f"Người dùng: {question}")
+    prompt_parts.append("Trợ lý:")
+    
+    # Gộp thành một prompt
+    return "\n".join(prompt_parts)
+
+def send_message_to_gemini(
+    question: str,
+    chat_history: Optional[list] = None,
+    summary: Optional[str] = None,
+) -> str:
     """
     Gửi câu hỏi đến Gemini và nhận câu trả lời.
     
     Args:
         question: Câu hỏi của người dùng
         chat_history: Lịch sử chat (list of dict với 'question' và 'answer')
+        summary: Tóm tắt các lượt cũ hơn chat_history (nếu có)
     
     Returns:
-        Câu trả lời từ Gemini
+        Câu trả lời từ Gemini, hoặc trả thẳng từ dữ liệu bệnh nếu câu hỏi khớp rõ 1 bệnh
+
+    Raises:
+        LLMUnavailableError: Gemini quá tải / lỗi (route trả CHATBOT_FALLBACK_ANSWER)
     """
-    if not settings.GEMINI_API_KEY:
+    retrieval = retrieve_knowledge(question)
+    if retrieval is not None and retrieval.direct_answer:
+        return retrieval.direct_answer
+
+    if not llm_gateway.enabled:
         raise ValueError("Gemini chưa được cấu hình. Kiểm tra GEMINI_API_KEY.")
     
-    # System prompt cho trợ lý nông nghiệp
-    system_instruction = (
-        "Bạn là trợ lý nông nghiệp thân thiện. "
-        "Hãy trả lời ngắn gọn, dễ hiểu và ưu tiên tiếng Việt nếu người dùng dùng tiếng Việt. "
-        "Tập trung vào các vấn đề về cây trồng, bệnh tật, chăm sóc cây, và nông nghiệp."
-    )
-    
     try:
-        # Xây dựng prompt với lịch sử chat
-        prompt_parts = []
-        
-        # Thêm system instruction vào đầu
-        prompt_parts.append(system_instruction)
-        
-        # Thêm lịch sử chat nếu có
-        if chat_history:
-            for msg in chat_history:
-                prompt_parts.append(f"Người dùng: {msg['question']}")
-                prompt_parts.append(f"Trợ lý: {msg['answer']}")
+        passages = retrieval.passages if retrieval is not None else None
+        full_prompt = build_chat_prompt(question, chat_history, summary, passages)
         
-        # Thêm câu hỏi hiện tại
-        prompt_parts.append(f"Người dùng: {question}")
-        prompt_parts.append("Trợ lý:")
-        
-        # Gộp thành một prompt
-        full_prompt = "\n".join(prompt_parts)
-        
-        # Tạo model và gọi API (dùng cách đơn giản như llm_service.py)
-        model = genai.GenerativeModel(model_name=settings.GEMINI_MODEL)
-        response = model.generate_content(full_prompt)
-        
-        answer = (response.text or "").strip()
+        # Gọi qua gateway dùng chung (deadline LLM_TIMEOUT_S, retry, circuit breaker)
+        answer = llm_gateway.generate(full_prompt).strip()
         if not answer:
             raise ValueError("Gemini trả về câu trả lời rỗng")
         
         return answer
     
+    except LLMUnavailableError as e:
+        print(f"[Chatbot] Gemini unavailable: {e}")
+        raise
     except Exception as e:
         print(f"[Chatbot] Error calling Gemini: {e}")
         raise ValueError(f"Lỗi khi gọi Gemini AI: {str(e)}")
 
+async def stream_message_from_gemini(
+    question: str,
+    chat_history: Optional[list] = None,
+    metrics: Optional[dict] = None,
+    summary: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Như send_message_to_gemini nhưng trả từng đoạn text ngay khi model sinh ra.
+    metrics được điền ttft_ms (tới đoạn text đầu) / total_ms khi stream xong,
+    retrieval_ms, và source = "local" nếu trả thẳng từ dữ liệu bệnh (1 đoạn duy nhất).
+
+    Raises:
+        ValueError: Gemini chưa cấu hình
+        LLMUnavailableError: Gemini quá tải / lỗi (kể cả giữa chừng)
+    """
+    if metrics is None:
+        metrics = {}
+    try:
+        retrieval = await run_io(retrieve_knowledge, question, timeout=settings.STAGE_TIMEOUT_DB_S, stage="knowledge")
+    except (ExecutorBusyError, StageTimeoutError) as e:
+        # tra cứu chỉ là phần bổ trợ → vẫn hỏi Gemini
+        print(f"[Chatbot] Knowledge retrieval skipped: {e}")
+        retrieval = None
+    if retrieval is not None:
+        metrics["retrieval_ms"] = retrieval.latency_ms
+        if retrieval.direct_answer:
+            metrics["source"] = "local"
+            yield retrieval.direct_answer
+            return
+
+    if not llm_gateway.enabled:
+        raise ValueError("Gemini chưa được cấu hình. Kiểm tra GEMINI_API_KEY.")
+
+    metrics["source"] = "llm"
+    passages = retrieval.passages if retrieval is not None else None
+    prompt = build_chat_prompt(question, chat_history, summary, passages)
+    async for chunk in llm_gateway.astream(prompt, metrics=metrics):
+        yield chunk
+
 def save_chat_message(
     chatbot_id: int,
     question: str,
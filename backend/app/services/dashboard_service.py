@@ -16,6 +16,8 @@ from app.schemas.dashboard import (
     TicketStatusStat,
     RecentDetectionItem,
     RecentTicketItem,
+    QueueDashboard,
+    QueueStat,
 )
 
 
@@ -203,3 +205,18 @@ def build_dashboard_summary_between(db: Session, start: datetime, end: datetime)
         recent_detections=recent_detections,
         recent_tickets=recent_tickets,
     )
+
+
+def build_queue_dashboard() -> QueueDashboard:
+    """
+    Độ trễ + throughput hàng đợi job (scan / enrich / export).
+    Bảng jobs có thể nằm ở DB riêng (JOB_QUEUE_DATABASE_URL) nên không dùng session của request.
+    """
+    from app.core.config import settings
+    from app.services.job_queue_service import job_queue
+
+    return QueueDashboard(
+        enabled=settings.JOB_QUEUE_ENABLED,
+        queues=[QueueStat(**s) for s in job_queue.stats()],
+        generated_at=datetime.utcnow(),
+    )
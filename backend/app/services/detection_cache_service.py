@@ -0,0 +1,138 @@
+# app/services/detection_cache_service.py
+"""
+Cache kết quả /detect theo hash nội dung ảnh.
+
+Key = sha256(raw bytes) + version model + conf + iou.
+Cache của model không còn được load bị xoá khi registry đổi model (retain).
+Value = output predict_bytes + tóm tắt LLM (để retry không gọi lại YOLO/Gemini).
+Tầng RAM (LRU + TTL) và tầng đĩa tuỳ chọn (DETECT_CACHE_DIR).
+"""
+import copy
+import hashlib
+import logging
+import re
+import threading
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.core.config import settings
+from app.utils.ttl_cache import DiskCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _safe_namespace(model_version: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model_version) or "unknown"
+
+
+class DetectionResultCache:
+    def __init__(self, maxsize: int, ttl: float, disk_dir: str = ""):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(disk_dir, ttl=ttl) if disk_dir else None
+
+        # các version model đang load (registry có thể giữ nhiều model cùng lúc)
+        self._model_versions: Set[str] = set()
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.invalidations = 0
+
+    # ============================================
+    # Invalidate khi đổi / gỡ model
+    # ============================================
+    def retain(self, model_versions: Iterable[str]) -> None:
+        """Chỉ giữ cache của các version còn được load, xoá phần còn lại (RAM + đĩa)."""
+        keep = {_safe_namespace(v) for v in model_versions}
+        with self._lock:
+            if keep == self._model_versions:
+                return
+            if self._model_versions - keep:
+                logger.info(
+                    f"[DetectCache] Model {sorted(self._model_versions - keep)} không còn dùng, xoá cache"
+                )
+                self.invalidations += 1
+            self._model_versions = keep
+
+        self.memory.pop_where(lambda k: k[0] not in keep)
+        if self.disk is not None:
+            self.disk.purge(keep_namespace=keep)
+
+    @staticmethod
+    def make_key(digest: str, conf: float, iou: float) -> str:
+        return f"{digest}_{conf:.3f}_{iou:.3f}"
+
+    # ============================================
+    # Get / Put
+    # ============================================
+    def get(self, digest: str, model_version: str, conf: float, iou: float) -> Optional[Dict[str, Any]]:
+        """Trả về {"yolo": ..., "llm": {...} | None} hoặc None nếu miss."""
+        namespace = _safe_namespace(model_version)
+        key = self.make_key(digest, conf, iou)
+
+        value = self.memory.get((namespace, key))
+        if value is None and self.disk is not None:
+            value = self.disk.get(namespace, key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.memory.set((namespace, key), value)
+
+        # copy: caller sẽ sửa dict kết quả (gắn "llm", ...)
+        return copy.deepcopy(value) if value is not None else None
+
+    def put(
+        self,
+        digest: str,
+        model_version: str,
+        conf: float,
+        iou: float,
+        yolo_result: Dict[str, Any],
+        llm: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        namespace = _safe_namespace(model_version)
+        key = self.make_key(digest, conf, iou)
+
+        yolo_only = {k: v for k, v in yolo_result.items() if k != "llm"}
+        value = copy.deepcopy({"yolo": yolo_only, "llm": llm})
+
+        self.memory.set((namespace, key), value)
+        if self.disk is not None:
+            try:
+                self.disk.set(namespace, key, value)
+            except OSError as e:
+                logger.warning(f"[DetectCache] Không ghi được cache đĩa: {e}")
+
+    def clear(self) -> None:
+        self.memory.clear()
+        with self._lock:
+            self._model_versions = set()
+
+    def stats(self) -> Dict[str, Any]:
+        mem = self.memory.stats()
+        with self._lock:
+            # memory.misses bao gồm cả lượt sau đó hit ở tầng đĩa
+            hits = mem["hits"] + self.disk_hits
+            misses = mem["misses"] - self.disk_hits
+            total = hits + misses
+            return {
+                "model_versions": sorted(self._model_versions),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory": mem,
+                "disk_enabled": self.disk is not None,
+                "disk_hits": self.disk_hits,
+                "invalidations": self.invalidations,
+            }
+
+
+# instance dùng chung (None nếu tắt cache)
+detection_cache: DetectionResultCache | None = None
+if settings.DETECT_CACHE_ENABLED:
+    detection_cache = DetectionResultCache(
+        maxsize=settings.DETECT_CACHE_MAX_ITEMS,
+        ttl=settings.DETECT_CACHE_TTL_S,
+        disk_dir=settings.DETECT_CACHE_DIR,
+    )
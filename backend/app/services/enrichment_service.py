@@ -0,0 +1,214 @@
+# app/services/enrichment_service.py
+"""
+Bổ sung tóm tắt LLM cho kết quả /detect ở chế độ 2 pha (?enrich=async).
+
+Pha 1 (/detect): trả detections YOLO ngay + job_id.
+Pha 2 (job nền): gọi LLM (qua cache + gateway) → ghi Detection.description /
+treatment_guideline theo img_id → báo cho client (SSE) hoặc client tự poll.
+
+Job giữ trong RAM của process xử lý /detect (TTL ENRICH_JOB_TTL_S); kết quả
+bền vững nằm ở bảng detections. LLM không trả lời được (dùng nội dung dự phòng)
+và JOB_QUEUE_ENABLED → tạo job "enrich.detection" trong hàng đợi bền vững để
+worker ghi lại tóm tắt thật khi LLM hoạt động trở lại.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.image_detection import Detection
+from app.services.detection_cache_service import detection_cache
+from app.services.executor_service import ExecutorBusyError, StageTimeoutError, run_io
+from app.services.llm_service import summarize_detections_with_status
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EnrichmentJob:
+    job_id: str
+    detections: List[Dict[str, Any]]
+    model_version: str
+    user_id: Optional[int] = None
+    img_id: Optional[int] = None
+    # để ghi tóm tắt vào cache /detect sau khi LLM trả lời
+    cache_args: Optional[tuple] = None
+
+    status: str = "pending"         # pending | running | done | failed
+    disease_summary: Optional[str] = None
+    care_instructions: Optional[str] = None
+    from_llm: bool = False
+    error: Optional[str] = None
+    retry_job_id: Optional[int] = None  # job "enrich.detection" trong job_queue (nếu có)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "img_id": self.img_id,
+            "llm": {
+                "disease_summary": self.disease_summary,
+                "care_instructions": self.care_instructions,
+            } if self.finished else None,
+            "from_llm": self.from_llm,
+            "error": self.error,
+            "retry_job_id": self.retry_job_id,
+            "elapsed_ms": round(((self.finished_at or time.time()) - self.created_at) * 1000, 1),
+        }
+
+
+def _write_detection_texts(img_id: int, description: Optional[str], guideline: Optional[str]) -> int:
+    """Ghi tóm tắt vào mọi detection của ảnh (giống save_detection_result ở chế độ đồng bộ)."""
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(Detection)
+            .filter(Detection.img_id == img_id)
+            .update(
+                {Detection.description: description, Detection.treatment_guideline: guideline},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return updated
+    finally:
+        db.close()
+
+
+def _enqueue_retry(job: EnrichmentJob) -> int:
+    from app.services.job_queue_service import job_queue
+
+    job_id, _ = job_queue.enqueue(
+        "enrich.detection",
+        {"img_id": job.img_id, "detections": job.detections, "model_version": job.model_version},
+        idempotency_key=f"enrich:{job.img_id}",
+        delay_s=settings.JOB_RETRY_BASE_S,
+    )
+    return job_id
+
+
+class EnrichmentService:
+    def __init__(self, max_jobs: int, ttl: float, max_concurrency: int):
+        self.jobs = TTLCache(maxsize=max_jobs, ttl=ttl)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._latency_ms_total = 0.0
+
+    def submit(
+        self,
+        detections: List[Dict[str, Any]],
+        model_version: str,
+        user_id: Optional[int] = None,
+        img_id: Optional[int] = None,
+        cache_args: Optional[tuple] = None,
+    ) -> EnrichmentJob:
+        """Gọi trong event loop của app: tạo job + chạy nền, trả về ngay."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        job = EnrichmentJob(
+            job_id=uuid.uuid4().hex,
+            detections=detections,
+            model_version=model_version,
+            user_id=user_id,
+            img_id=img_id,
+            cache_args=cache_args,
+        )
+        self.jobs.set(job.job_id, job)
+        self.submitted += 1
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)  # giữ reference để task không bị GC giữa chừng
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[EnrichmentJob]:
+        return self.jobs.get(job_id)
+
+    async def _run(self, job: EnrichmentJob) -> None:
+        async with self._semaphore:
+            job.status = "running"
+            try:
+                job.disease_summary, job.care_instructions, job.from_llm = await run_io(
+                    summarize_detections_with_status,
+                    job.detections,
+                    job.model_version,
+                    timeout=settings.STAGE_TIMEOUT_LLM_S,
+                    stage="llm",
+                )
+
+                if job.img_id is not None and (job.disease_summary or job.care_instructions):
+                    await run_io(
+                        _write_detection_texts, job.img_id, job.disease_summary, job.care_instructions,
+                        timeout=settings.STAGE_TIMEOUT_DB_S, stage="db",
+                    )
+
+                if not job.from_llm and job.img_id is not None and settings.JOB_QUEUE_ENABLED:
+                    job.retry_job_id = await run_io(
+                        _enqueue_retry, job, timeout=settings.STAGE_TIMEOUT_DB_S, stage="db",
+                    )
+
+                if job.from_llm and job.cache_args is not None and detection_cache is not None:
+                    digest, fingerprint, conf, iou, yolo_result = job.cache_args
+                    await run_io(
+                        detection_cache.put, digest, fingerprint, conf, iou, yolo_result,
+                        {"disease_summary": job.disease_summary, "care_instructions": job.care_instructions},
+                        timeout=settings.STAGE_TIMEOUT_DB_S, stage="cache",
+                    )
+                job.status = "done"
+                self.completed += 1
+            except (ExecutorBusyError, StageTimeoutError) as e:
+                job.status, job.error = "failed", str(e)
+                self.failed += 1
+            except Exception as e:
+                logger.exception(f"[Enrichment] Job {job.job_id} lỗi: {e}")
+                job.status, job.error = "failed", str(e)
+                self.failed += 1
+            finally:
+                job.cache_args = None
+                job.finished_at = time.time()
+                self._latency_ms_total += (job.finished_at - job.created_at) * 1000
+                job.done.set()
+
+    async def wait(self, job: EnrichmentJob, timeout: float) -> bool:
+        """Chờ job xong tối đa timeout giây, trả về True nếu đã xong."""
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job.finished
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "running": len(self._tasks),
+            "jobs_tracked": len(self.jobs),
+            "avg_latency_ms": round(self._latency_ms_total / finished, 1) if finished else 0.0,
+        }
+
+
+enrichment_service = EnrichmentService(
+    max_jobs=settings.ENRICH_JOB_MAX_ITEMS,
+    ttl=settings.ENRICH_JOB_TTL_S,
+    max_concurrency=settings.ENRICH_MAX_CONCURRENCY,
+)
@@ -0,0 +1,236 @@
+# app/services/executor_service.py
+"""
+Lớp executor quản lý việc chạy code đồng bộ (CPU/IO) ngoài event loop.
+
+- io pool     : ThreadPool có giới hạn cho LLM, SQLAlchemy, ghi file...
+- inference   : ProcessPool (nếu INFERENCE_PROCESS_WORKERS > 0) hoặc batch engine
+                chạy trong thread riêng của process hiện tại.
+
+Mỗi stage có timeout riêng; khi hàng đợi đầy → ExecutorBusyError (route trả 503).
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusyError(Exception):
+    """Hàng đợi của executor đã đầy (backpressure)."""
+
+
+class StageTimeoutError(Exception):
+    """Stage chạy quá thời gian cho phép."""
+
+    def __init__(self, stage: str, timeout: float):
+        self.stage = stage
+        self.timeout = timeout
+        super().__init__(f"Stage '{stage}' vượt quá {timeout}s")
+
+
+class ManagedExecutor:
+    """Bọc 1 concurrent.futures.Executor + giới hạn số job đang chờ/chạy."""
+
+    def __init__(self, name: str, executor: Executor, max_pending: int):
+        self.name = name
+        self._executor = executor
+        self.max_pending = max(1, int(max_pending))
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._submitted_total = 0
+        self._rejected_total = 0
+        self._timeouts_total = 0
+
+    def _release(self, _fut) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        timeout: Optional[float] = None,
+        stage: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected_total += 1
+                raise ExecutorBusyError(f"Executor '{self.name}' đang quá tải")
+            self._pending += 1
+            self._submitted_total += 1
+
+        try:
+            fut = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        # slot chỉ được trả lại khi job thực sự xong (kể cả khi caller đã timeout)
+        fut.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+        except asyncio.TimeoutError:
+            fut.cancel()
+            with self._lock:
+                self._timeouts_total += 1
+            raise StageTimeoutError(stage or self.name, timeout)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "submitted_total": self._submitted_total,
+                "rejected_total": self._rejected_total,
+                "timeouts_total": self._timeouts_total,
+            }
+
+
+# =====================================================
+# Worker process cho inference (ProcessPool)
+# =====================================================
+_worker_detector = None
+
+
+def _init_inference_worker() -> None:
+    """Chạy 1 lần trong mỗi worker process: load model riêng cho process đó."""
+    global _worker_detector
+    from app.services import inference_service
+
+    # load + warm-up ngay khi process khởi tạo, không đợi tới request đầu
+    _worker_detector = inference_service.get_detector()
+    if _worker_detector is None:
+        raise RuntimeError(f"Không load được model: {inference_service.MODEL_PATH}")
+
+
+def _predict_in_worker(raw: bytes, conf: float, iou: float, version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    version: khoá registry của model cần chạy (registry riêng của worker tự load
+    nếu chưa có). Không phải detector.model_version: tag biến thể "+int8" không load được.
+    """
+    det = _worker_detector
+    if version:
+        from app.services.model_registry import registry
+
+        det = registry.get(version) or registry.load(version).detector
+    return det.predict_bytes(raw, conf=conf, iou=iou)
+
+
+# =====================================================
+# Instance dùng chung
+# =====================================================
+_io_executor: Optional[ManagedExecutor] = None
+_inference_executor: Optional[ManagedExecutor] = None
+_init_lock = threading.Lock()
+
+
+def get_io_executor() -> ManagedExecutor:
+    global _io_executor
+    with _init_lock:
+        if _io_executor is None:
+            _io_executor = ManagedExecutor(
+                "io",
+                ThreadPoolExecutor(
+                    max_workers=settings.EXECUTOR_IO_WORKERS,
+                    thread_name_prefix="io-worker",
+                ),
+                max_pending=settings.EXECUTOR_IO_MAX_PENDING,
+            )
+        return _io_executor
+
+
+def get_inference_executor() -> Optional[ManagedExecutor]:
+    """ProcessPool cho inference, None nếu INFERENCE_PROCESS_WORKERS = 0."""
+    global _inference_executor
+    if settings.INFERENCE_PROCESS_WORKERS <= 0:
+        return None
+    with _init_lock:
+        if _inference_executor is None:
+            # spawn: tránh fork process đang giữ thread của torch/onnxruntime
+            _inference_executor = ManagedExecutor(
+                "inference",
+                ProcessPoolExecutor(
+                    max_workers=settings.INFERENCE_PROCESS_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_inference_worker,
+                ),
+                max_pending=settings.INFERENCE_MAX_PENDING,
+            )
+        return _inference_executor
+
+
+async def run_io(
+    fn: Callable[..., Any],
+    *args: Any,
+    timeout: Optional[float] = None,
+    stage: str = "io",
+    **kwargs: Any,
+) -> Any:
+    """Chạy hàm blocking (LLM, DB, disk) trong io pool."""
+    return await get_io_executor().run(fn, *args, timeout=timeout, stage=stage, **kwargs)
+
+
+async def run_inference(raw: bytes, conf: float = 0.5, iou: float = 0.5, detector=None) -> Dict[str, Any]:
+    """
+    Chạy YOLO ngoài event loop:
+    - ProcessPool nếu bật INFERENCE_PROCESS_WORKERS
+    - ngược lại dùng batch engine (thread) hoặc io pool
+    detector: model đã chọn cho request (None → model mặc định).
+    """
+    timeout = settings.STAGE_TIMEOUT_INFERENCE_S
+
+    pool = get_inference_executor()
+    if pool is not None:
+        from app.services.model_registry import registry
+
+        version = registry.version_of(detector) if detector is not None else None
+        return await pool.run(_predict_in_worker, raw, conf, iou, version, timeout=timeout, stage="inference")
+
+    from app.services.batch_inference_service import get_batch_engine
+    from app.services.inference_service import get_detector
+
+    engine = get_batch_engine()
+    if engine is not None:
+        try:
+            fut = engine.submit(raw, conf, iou, detector=detector)
+        except queue.Full:
+            raise ExecutorBusyError("Hàng đợi inference đang đầy")
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+        except asyncio.TimeoutError:
+            fut.cancel()
+            raise StageTimeoutError("inference", timeout)
+
+    detector = detector or get_detector()
+    if detector is None:
+        raise RuntimeError("Model not loaded on server")
+    return await run_io(detector.predict_bytes, raw, conf, iou, timeout=timeout, stage="inference")
+
+
+def executor_stats() -> Dict[str, Any]:
+    pool = _inference_executor
+    return {
+        "io": get_io_executor().stats(),
+        "inference_process_pool": pool.stats() if pool is not None else None,
+    }
+
+
+def shutdown_executors() -> None:
+    global _io_executor, _inference_executor
+    with _init_lock:
+        for ex in (_io_executor, _inference_executor):
+            if ex is not None:
+                ex.shutdown()
+        _io_executor = None
+        _inference_executor = None
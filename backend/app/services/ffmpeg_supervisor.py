@@ -0,0 +1,349 @@
+# app/services/ffmpeg_supervisor.py
+"""
+Quản lý mọi tiến trình ffmpeg (HLS thiết bị, HLS tạm, /stream/hls MJPEG).
+
+- Khoá theo tên thư mục HLS (media/hls/<key>): "12", "temp-ab12...", md5 URL
+- ffmpeg chết ngoài ý muốn → tự chạy lại với backoff mũ; chết quá
+  FFMPEG_MAX_RESTARTS lần trong 10 phút → "failed", chờ start lại thủ công
+- Giới hạn tài nguyên mỗi tiến trình (POSIX): chạy qua `nice -n FFMPEG_NICE`
+  + `prlimit --as=FFMPEG_MAX_MEMORY_MB` (không dùng preexec_fn: không an toàn khi
+  server có nhiều thread); tối đa FFMPEG_MAX_PROCESSES transcode mỗi node
+- Không ai tải playlist / segment quá FFMPEG_IDLE_STOP_S → dừng stream
+- Đọc `-progress pipe:1` của ffmpeg → fps / bitrate / speed từng stream
+"""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RESTART_WINDOW_S = 600.0
+STABLE_RUN_S = 60.0     # chạy được bấy lâu thì coi như ổn định, reset backoff
+
+
+class SupervisorFullError(RuntimeError):
+    """Đã đủ FFMPEG_MAX_PROCESSES transcode trên node này."""
+
+
+@dataclass
+class ManagedStream:
+    key: str
+    cmd: List[str]
+    cwd: Path
+    source_url: str = ""
+    proc: Optional[subprocess.Popen] = None
+    log_file: Any = None
+    state: str = "starting"         # running | backoff | failed | stopped
+    started_at: float = 0.0
+    last_access: float = 0.0
+    next_restart_at: float = 0.0
+    backoff: float = 0.0
+    restarts: int = 0
+    restart_times: List[float] = field(default_factory=list)
+    last_exit_code: Optional[int] = None
+    progress: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+
+@lru_cache(maxsize=None)
+def _which(tool: str) -> Optional[str]:
+    path = shutil.which(tool)
+    if path is None:
+        logger.warning(f"[FFmpeg] Không có lệnh {tool}, bỏ qua giới hạn tương ứng")
+    return path
+
+
+def _limit_prefix() -> List[str]:
+    """Tiền tố lệnh giới hạn tài nguyên: nice (ưu tiên CPU) + prlimit (RLIMIT_AS), chỉ POSIX."""
+    if os.name != "posix":
+        return []
+    prefix: List[str] = []
+    if settings.FFMPEG_NICE and _which("nice"):
+        prefix += [_which("nice"), "-n", str(settings.FFMPEG_NICE)]
+    if settings.FFMPEG_MAX_MEMORY_MB > 0 and _which("prlimit"):
+        prefix += [_which("prlimit"), f"--as={settings.FFMPEG_MAX_MEMORY_MB * 1024 * 1024}", "--"]
+    return prefix
+
+
+def _parse_bitrate(value: str) -> Optional[float]:
+    """"1234.5kbits/s" → 1234.5 (kbit/s); "N/A" → None."""
+    value = value.strip()
+    if value.endswith("kbits/s"):
+        try:
+            return float(value[:-7])
+        except ValueError:
+            return None
+    return None
+
+
+class FfmpegSupervisor:
+    def __init__(self):
+        self._streams: Dict[str, ManagedStream] = {}
+        self._lock = threading.RLock()
+        self._monitor: Optional[threading.Thread] = None
+
+        self.started_total = 0
+        self.restarted_total = 0
+        self.idle_stopped_total = 0
+        self.rejected_full = 0
+
+    # ============================================
+    # Tiến trình
+    # ============================================
+    def _spawn(self, s: ManagedStream) -> None:
+        """Chạy ffmpeg cho stream (phải giữ _lock)."""
+        s.cwd.mkdir(parents=True, exist_ok=True)
+        if s.log_file is None or s.log_file.closed:
+            s.log_file = open(s.cwd / "ffmpeg.log", "ab")
+        # -progress là option toàn cục → đặt ngay sau tên chương trình
+        cmd = _limit_prefix() + [s.cmd[0], "-progress", "pipe:1", "-nostats"] + s.cmd[1:]
+        s.proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=s.log_file,
+            cwd=str(s.cwd),
+        )
+        s.state = "running"
+        s.started_at = time.monotonic()
+        s.progress = {}
+        threading.Thread(
+            target=self._read_progress, args=(s, s.proc), name=f"ffmpeg-{s.key}", daemon=True
+        ).start()
+        logger.info(f"[FFmpeg] Stream {s.key}: PID={s.proc.pid}")
+
+    def _read_progress(self, s: ManagedStream, proc: subprocess.Popen) -> None:
+        """ffmpeg -progress: các dòng key=value, mỗi khối kết thúc bằng progress=continue|end."""
+        block: Dict[str, str] = {}
+        try:
+            for raw in proc.stdout:
+                line = raw.decode(errors="ignore").strip()
+                if "=" not in line:
+                    continue
+                k, v = line.split("=", 1)
+                block[k] = v
+                if k != "progress":
+                    continue
+                try:
+                    fps = float(block.get("fps", "0") or 0)
+                except ValueError:
+                    fps = None
+                s.progress = {
+                    "frame": int(block["frame"]) if block.get("frame", "").isdigit() else None,
+                    "fps": fps,
+                    "bitrate_kbps": _parse_bitrate(block.get("bitrate", "")),
+                    "speed": block.get("speed", "").rstrip("x").strip() or None,
+                    "out_time": block.get("out_time"),
+                    "updated_at": time.time(),
+                }
+                block = {}
+        except Exception as e:
+            logger.debug(f"[FFmpeg] Stream {s.key}: ngừng đọc progress: {e}")
+        finally:
+            try:
+                proc.stdout.close()
+            except Exception:
+                pass
+
+    def _terminate(self, s: ManagedStream) -> None:
+        """Dừng tiến trình (chờ tối đa 5s) → không gọi khi đang giữ _lock."""
+        proc = s.proc
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.terminate()
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            except Exception as e:
+                logger.warning(f"[FFmpeg] Lỗi khi dừng stream {s.key}: {e}")
+        if s.log_file is not None and not s.log_file.closed:
+            try:
+                s.log_file.close()
+            except Exception:
+                pass
+
+    def _running_count(self) -> int:
+        return sum(1 for s in self._streams.values() if s.state in ("running", "backoff"))
+
+    # ============================================
+    # API
+    # ============================================
+    def start(self, key: str, cmd: List[str], cwd: Path, source_url: str = "") -> ManagedStream:
+        """
+        Chạy (hoặc giữ nguyên nếu đang chạy cùng nguồn) ffmpeg cho key.
+        Raise SupervisorFullError khi đủ FFMPEG_MAX_PROCESSES, FileNotFoundError khi không có ffmpeg.
+        Có thể chờ tới 5s dừng tiến trình cũ → code async gọi qua run_in_executor.
+        """
+        while True:
+            with self._lock:
+                s = self._streams.get(key)
+                if s is not None and s.source_url == source_url and s.state in ("running", "backoff") and (
+                    s.alive or s.state == "backoff"
+                ):
+                    s.last_access = time.monotonic()
+                    return s
+                if s is None:
+                    return self._spawn_new(key, cmd, cwd, source_url)
+                del self._streams[key]
+            # nguồn khác / đã chết: dừng tiến trình cũ ngoài lock (chờ tới 5s), rồi
+            # kiểm tra lại (start song song cùng key có thể đã chạy xong trong lúc chờ)
+            s.state = "stopped"
+            self._terminate(s)
+
+    def _spawn_new(self, key: str, cmd: List[str], cwd: Path, source_url: str) -> ManagedStream:
+        """(phải giữ _lock) Popen không chờ nên giữ lock được."""
+        if self._running_count() >= settings.FFMPEG_MAX_PROCESSES:
+            self.rejected_full += 1
+            raise SupervisorFullError(
+                f"Đã đủ {settings.FFMPEG_MAX_PROCESSES} stream ffmpeg trên node này"
+            )
+
+        s = ManagedStream(key=key, cmd=list(cmd), cwd=Path(cwd), source_url=source_url)
+        s.last_access = time.monotonic()
+        try:
+            self._spawn(s)
+        except Exception:
+            self._terminate(s)   # proc chưa chạy → chỉ đóng file log
+            raise
+        self._streams[key] = s
+        self.started_total += 1
+        self._ensure_monitor()
+        return s
+
+    def stop(self, key: str) -> bool:
+        with self._lock:
+            s = self._streams.pop(key, None)
+        if s is None:
+            return False
+        s.state = "stopped"
+        self._terminate(s)
+        logger.info(f"[FFmpeg] Đã dừng stream {key}")
+        return True
+
+    def stop_all(self) -> None:
+        with self._lock:
+            keys = list(self._streams)
+        for key in keys:
+            self.stop(key)
+
+    def touch(self, key: str) -> None:
+        """Có người vừa tải playlist / segment của stream."""
+        s = self._streams.get(key)
+        if s is not None:
+            s.last_access = time.monotonic()
+
+    def get(self, key: str) -> Optional[ManagedStream]:
+        with self._lock:
+            return self._streams.get(key)
+
+    def is_running(self, key: str) -> bool:
+        s = self.get(key)
+        return s is not None and s.alive
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._streams)
+
+    # ============================================
+    # Giám sát: restart / dừng stream không ai xem
+    # ============================================
+    def _ensure_monitor(self) -> None:
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._monitor_loop, name="ffmpeg-supervisor", daemon=True)
+            self._monitor.start()
+
+    def _monitor_loop(self) -> None:
+        while True:
+            time.sleep(settings.FFMPEG_MONITOR_INTERVAL_S)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"[FFmpeg] Lỗi giám sát: {e}", exc_info=True)
+
+    def check(self) -> None:
+        now = time.monotonic()
+        idle: List[str] = []
+        with self._lock:
+            for key, s in self._streams.items():
+                if settings.FFMPEG_IDLE_STOP_S > 0 and now - s.last_access > settings.FFMPEG_IDLE_STOP_S:
+                    idle.append(key)
+                    continue
+
+                if s.state == "running" and not s.alive:
+                    s.last_exit_code = s.proc.returncode if s.proc is not None else None
+                    s.restart_times = [t for t in s.restart_times if now - t < RESTART_WINDOW_S]
+                    if len(s.restart_times) >= settings.FFMPEG_MAX_RESTARTS:
+                        s.state = "failed"
+                        logger.error(
+                            f"[FFmpeg] Stream {key} chết {len(s.restart_times)} lần trong "
+                            f"{RESTART_WINDOW_S:.0f}s (exit={s.last_exit_code}), ngừng tự khởi động lại"
+                        )
+                        continue
+                    stable = now - s.started_at >= STABLE_RUN_S
+                    s.backoff = settings.FFMPEG_RESTART_BASE_S if stable or not s.backoff else min(
+                        s.backoff * 2, settings.FFMPEG_RESTART_MAX_S
+                    )
+                    s.next_restart_at = now + s.backoff
+                    s.state = "backoff"
+                    logger.warning(
+                        f"[FFmpeg] Stream {key} thoát (exit={s.last_exit_code}), chạy lại sau {s.backoff:.1f}s"
+                    )
+                elif s.state == "backoff" and now >= s.next_restart_at:
+                    try:
+                        self._spawn(s)
+                        s.restarts += 1
+                        s.restart_times.append(now)
+                        self.restarted_total += 1
+                    except Exception as e:
+                        s.next_restart_at = now + s.backoff
+                        logger.error(f"[FFmpeg] Không chạy lại được stream {key}: {e}")
+        for key in idle:
+            logger.info(f"[FFmpeg] Stream {key} không ai xem quá {settings.FFMPEG_IDLE_STOP_S:.0f}s, dừng")
+            if self.stop(key):
+                self.idle_stopped_total += 1
+
+    # ============================================
+    # Thống kê
+    # ============================================
+    def info(self, key: str) -> Optional[Dict[str, Any]]:
+        s = self.get(key)
+        if s is None:
+            return None
+        now = time.monotonic()
+        return {
+            "key": s.key,
+            "state": s.state,
+            "pid": s.proc.pid if s.alive else None,
+            "uptime_s": round(now - s.started_at, 1) if s.alive else None,
+            "idle_s": round(now - s.last_access, 1),
+            "restarts": s.restarts,
+            "last_exit_code": s.last_exit_code,
+            **{k: s.progress.get(k) for k in ("fps", "bitrate_kbps", "speed", "frame")},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        streams = [self.info(k) for k in self.keys()]
+        streams = [s for s in streams if s is not None]
+        return {
+            "running": sum(1 for s in streams if s["state"] == "running"),
+            "max_processes": settings.FFMPEG_MAX_PROCESSES,
+            "started_total": self.started_total,
+            "restarted_total": self.restarted_total,
+            "idle_stopped_total": self.idle_stopped_total,
+            "rejected_full": self.rejected_full,
+            "streams": streams,
+        }
+
+
+ffmpeg_supervisor = FfmpegSupervisor()
@@ -0,0 +1,130 @@
+# app/services/frame_dedup_service.py
+"""
+Bỏ qua frame camera trùng lặp trước khi đưa vào YoloDetector.
+
+- Trong 1 lần quét: các frame gần như giống nhau chỉ giữ lại 1.
+- Giữa các lần quét: lưu hash frame của lần quét trước theo device,
+  cảnh không đổi → dùng lại kết quả cũ thay vì chạy YOLO + LLM.
+"""
+import copy
+import logging
+import threading
+import time
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.image_hash import dhash, hamming
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _LastScan:
+    frame_hash: int
+    result: Dict[str, Any]
+    scanned_at: float
+
+
+class DeviceFrameStore:
+    """Hash frame + kết quả của lần quét gần nhất cho từng device (trong RAM)."""
+
+    def __init__(self):
+        self._data: Dict[int, _LastScan] = {}
+        self._lock = threading.Lock()
+        self.reused_total = 0
+        self.frames_dropped_total = 0
+
+    def get(self, device_id: int) -> Optional[_LastScan]:
+        with self._lock:
+            return self._data.get(device_id)
+
+    def update(self, device_id: int, frame_hash: int, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[device_id] = _LastScan(
+                frame_hash=frame_hash,
+                result=copy.deepcopy(result),
+                scanned_at=time.time(),
+            )
+
+    def count_dropped(self, n: int) -> None:
+        with self._lock:
+            self.frames_dropped_total += n
+
+    def count_reused(self) -> None:
+        with self._lock:
+            self.reused_total += 1
+
+    def forget(self, device_id: int) -> None:
+        with self._lock:
+            self._data.pop(device_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "devices_tracked": len(self._data),
+                "reused_total": self.reused_total,
+                "frames_dropped_total": self.frames_dropped_total,
+            }
+
+
+frame_store = DeviceFrameStore()
+
+
+def hash_frames(frames: List[Any]) -> List[Optional[int]]:
+    hashes: List[Optional[int]] = []
+    for frame in frames:
+        try:
+            hashes.append(dhash(frame))
+        except Exception as e:
+            logger.debug(f"[FrameDedup] Không hash được frame: {e}")
+            hashes.append(None)
+    return hashes
+
+
+def dedupe_frames(
+    frames: List[Any],
+    max_distance: Optional[int] = None,
+) -> Tuple[List[Any], List[Optional[int]]]:
+    """Giữ lại các frame khác nhau rõ rệt (theo thứ tự gốc), trả về (frames, hashes)."""
+    if max_distance is None:
+        max_distance = settings.SCAN_DEDUP_MAX_DISTANCE
+
+    kept: List[Any] = []
+    kept_hashes: List[Optional[int]] = []
+    for frame, h in zip(frames, hash_frames(frames)):
+        if h is not None and any(
+            kh is not None and hamming(h, kh) <= max_distance for kh in kept_hashes
+        ):
+            continue
+        kept.append(frame)
+        kept_hashes.append(h)
+
+    if len(kept) < len(frames):
+        frame_store.count_dropped(len(frames) - len(kept))
+    return kept, kept_hashes
+
+
+def find_reusable_result(
+    device_id: int,
+    frame_hashes: List[Optional[int]],
+) -> Optional[Dict[str, Any]]:
+    """
+    Nếu mọi frame vừa chụp đều gần giống frame lần quét trước (và kết quả cũ
+    chưa quá SCAN_DEDUP_MAX_AGE_S) → trả về bản copy kết quả cũ.
+    """
+    last = frame_store.get(device_id)
+    if last is None or not frame_hashes or any(h is None for h in frame_hashes):
+        return None
+
+    if time.time() - last.scanned_at > settings.SCAN_DEDUP_MAX_AGE_S:
+        return None
+
+    max_distance = settings.SCAN_DEDUP_MAX_DISTANCE
+    if all(hamming(h, last.frame_hash) <= max_distance for h in frame_hashes):
+        frame_store.count_reused()
+        result = copy.deepcopy(last.result)
+        result["reused_from"] = datetime.fromtimestamp(last.scanned_at).isoformat()
+        return result
+    return None
@@ -1,18 +1,101 @@
 # backend/app/services/inference_service.py
 import os
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
 from io import BytesIO
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Tuple, Union
 
-from ultralytics import YOLO
+import numpy as np
 from PIL import Image
 
+from app.core.config import settings
+from app.core.startup import check_budget, record_phase
+from app.services.tiled_inference import predict_tiled_rows, should_tile, tiling_signature
+from app.utils.box_ops import image_size
+
+logger = logging.getLogger(__name__)
+
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 REPO_ROOT = os.path.abspath(os.path.join(THIS_DIR, "..", "..", ".."))
+EXPORTS_ROOT = os.path.join(REPO_ROOT, "ml", "exports")
+
+MODEL_VERSION = os.getenv("MODEL_VERSION", "v1.0")
+
+
+def read_model_metadata(model_dir: str) -> Dict[str, Any]:
+    """Đọc ml/exports/<version>/metadata.json (trả {} nếu không có)."""
+    meta_path = os.path.join(model_dir, "metadata.json")
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ModelGateError(RuntimeError):
+    """Biến thể model (vd: int8) không đạt ngưỡng độ chính xác → không được load."""
+
+
+def weights_file(metadata: Dict[str, Any], variant: Optional[str] = None) -> str:
+    """
+    Tên file weights trong metadata.json. variant (vd: "int8") lấy từ
+    metadata["variants"][variant]["weights"]; version chưa có biến thể đó
+    thì dùng weights gốc (FP32).
+    """
+    base = metadata.get("weights") or "best.pt"
+    if not variant:
+        return base
+    entry = (metadata.get("variants") or {}).get(variant)
+    if not entry or not entry.get("weights"):
+        logger.warning(f"[Inference] {metadata.get('version')} chưa có biến thể '{variant}', dùng {base}")
+        return base
+    return entry["weights"]
+
+
+def find_variant(metadata: Dict[str, Any], model_path: str):
+    """(tên biến thể, entry) nếu model_path là 1 biến thể khai báo trong metadata, ngược lại (None, None)."""
+    filename = os.path.basename(model_path)
+    for name, entry in (metadata.get("variants") or {}).items():
+        if entry.get("weights") == filename:
+            return name, entry
+    return None, None
+
+
+def resolve_model_path(version: str = MODEL_VERSION, variant: Optional[str] = None) -> str:
+    """
+    Ưu tiên env MODEL_PATH, nếu không có thì lấy file weights khai báo trong
+    metadata.json của ml/exports/<version> (mặc định best.pt, hoặc biến thể MODEL_VARIANT).
+    """
+    env_path = os.getenv("MODEL_PATH")
+    if env_path:
+        return env_path
+
+    if variant is None:
+        variant = settings.MODEL_VARIANT
+    model_dir = os.path.join(EXPORTS_ROOT, version)
+    return os.path.join(model_dir, weights_file(read_model_metadata(model_dir), variant))
+
 
-MODEL_PATH = os.getenv(
-    "MODEL_PATH",
-    os.path.join(REPO_ROOT, "ml", "exports", "v1.0", "best.pt")
-)
+def model_fingerprint(model_path: str) -> str:
+    """
+    Định danh của bộ weights: version trong metadata.json (+ biến thể) + mtime file weights
+    + cấu hình tile. Ghi đè best.pt mà không đổi version vẫn ra fingerprint khác.
+    """
+    model_dir = os.path.dirname(model_path)
+    metadata = read_model_metadata(model_dir)
+    version = metadata.get("version") or os.path.basename(model_dir)
+    variant, _ = find_variant(metadata, model_path)
+    if variant:
+        version = f"{version}+{variant}"
+    try:
+        mtime = int(os.path.getmtime(model_path))
+    except OSError:
+        mtime = 0
+    return f"{version}-{mtime}-{tiling_signature()}"
+
+
+MODEL_PATH = resolve_model_path()
 
 # 🔹 Map nhãn YOLO -> tên tiếng Việt
 VN_LABELS = {
@@ -24,50 +107,152 @@ VN_LABELS = {
 }
 
 
-class YoloDetector:
-    def __init__(self, model_path: str = MODEL_PATH):
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model not found: {model_path}")
+# Input chấp nhận cho detector:
+# - bytes / bytearray / memoryview: file ảnh (upload, snapshot camera)
+# - np.ndarray HWC uint8 BGR: frame OpenCV (RTSP/HLS), không qua encode JPEG
+# - PIL.Image: ảnh đã decode
+ImageInput = Union[bytes, bytearray, memoryview, np.ndarray, Image.Image]
+DecodedImage = Union[Image.Image, np.ndarray]
 
-        self.model = YOLO(model_path)    # YOLO sẽ tự xử lý toàn bộ ảnh
-        self.names = self.model.names    # id -> class_name
+
+class BaseDetector(ABC):
+    """Interface chung cho mọi backend (Ultralytics, ONNX Runtime...)."""
+
+    backend = "base"
+    names: Dict[int, str] = {}
+    model_version: str = "unknown"   # version trong metadata.json (lưu vào Detection)
+    fingerprint: str = "unknown"     # version + mtime weights + cấu hình tile (key cache)
+    # cạnh dài tối thiểu cần decode; JPEG lớn hơn được decode rút gọn (draft)
+    decode_size: int = 640
+
+    def load_image(self, raw: ImageInput) -> DecodedImage:
+        """
+        Decode input → ảnh cho model (raise nếu file không phải ảnh).
+
+        Frame ndarray (BGR) được trả nguyên, không copy. JPEG lớn được decode
+        thẳng ở độ phân giải rút gọn (DCT scaling) vì model chỉ nhìn ảnh
+        decode_size; kích thước gốc giữ trong img.info["orig_size"] để
+        bbox được scale về toạ độ ảnh gốc.
+        """
+        if isinstance(raw, np.ndarray):
+            return raw
+        if isinstance(raw, Image.Image):
+            return raw if raw.mode == "RGB" else raw.convert("RGB")
+
+        img = Image.open(BytesIO(raw))
+        orig_size = img.size
+        # bật tiling thì cần giữ đủ chi tiết cho các tile
+        target = self.decode_size
+        if target and settings.INFERENCE_TILING_ENABLED:
+            target = max(target, settings.INFERENCE_TILE_MAX_SIDE)
+        if img.format == "JPEG" and target:
+            scale = target / max(orig_size)
+            if scale < 0.5:
+                img.draft("RGB", (int(orig_size[0] * scale), int(orig_size[1] * scale)))
+
+        img = img.convert("RGB")
+        if img.size != orig_size:
+            img.info["orig_size"] = orig_size
+        return img
+
+    @staticmethod
+    def source_size(img: DecodedImage) -> Tuple[int, int]:
+        """(w, h) của ảnh gốc trước khi decode rút gọn."""
+        if isinstance(img, np.ndarray):
+            return int(img.shape[1]), int(img.shape[0])
+        return img.info.get("orig_size", img.size)
 
     def predict_bytes(
         self,
-        raw_bytes: bytes,
+        raw_bytes: ImageInput,
         conf: float = 0.5,
         iou: float = 0.5,
     ) -> Dict[str, Any]:
         """Predict + tự tạo giải thích nếu không phát hiện được bệnh"""
 
-        img = Image.open(BytesIO(raw_bytes)).convert("RGB")
+        img = self.load_image(raw_bytes)
+        return self.predict_images([img], conf=conf, iou=iou)[0]
 
-        results = self.model.predict(
-            img,
-            conf=conf,
-            iou=iou,
-            imgsz=640,
-            verbose=False,
-        )
+    def predict_array(
+        self,
+        frame: np.ndarray,
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> Dict[str, Any]:
+        """Predict trực tiếp trên frame BGR của OpenCV (không encode/decode JPEG)."""
+        return self.predict_images([frame], conf=conf, iou=iou)[0]
 
-        detections: List[Dict[str, Any]] = []
-        if not results:
-            # trường hợp YOLO không trả output
-            return self._no_detection_explanation()
+    def predict_batch(
+        self,
+        raw_list: List[ImageInput],
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> List[Dict[str, Any]]:
+        """Predict nhiều ảnh trong 1 lần gọi model, trả về kết quả theo đúng thứ tự input."""
+        imgs = [self.load_image(raw) for raw in raw_list]
+        return self.predict_images(imgs, conf=conf, iou=iou)
+
+    def predict_images(
+        self,
+        imgs: List[DecodedImage],
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> List[Dict[str, Any]]:
+        """
+        Chạy model trên 1 batch ảnh đã decode (cùng conf/iou).
+        Ảnh lớn (INFERENCE_TILING_ENABLED) đi đường cắt tile, còn lại chạy chung 1 batch.
+        """
+        if not imgs:
+            return []
 
-        r = results[0]
-        h, w = r.orig_shape
+        tiled = [should_tile(img) for img in imgs]
+        plain_idx = [i for i, t in enumerate(tiled) if not t]
 
-        # ----- Nếu không detect được bệnh -----
-        if r.boxes is None or len(r.boxes) == 0:
+        rows: List[Any] = [None] * len(imgs)
+        if plain_idx:
+            outputs = self.predict_rows([imgs[i] for i in plain_idx], conf=conf, iou=iou)
+            for i, r in zip(plain_idx, outputs):
+                rows[i] = r
+        for i, t in enumerate(tiled):
+            if t:
+                rows[i] = predict_tiled_rows(self, imgs[i], conf=conf, iou=iou)
+
+        return [self._rows_to_result(r, img) for r, img in zip(rows, imgs)]
+
+    @abstractmethod
+    def predict_rows(
+        self,
+        imgs: List[DecodedImage],
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> List[np.ndarray]:
+        """Backend cài đặt: mỗi ảnh → mảng (N, 6) x1, y1, x2, y2, conf, class_id theo toạ độ ảnh đó."""
+
+    def _rows_to_result(self, rows: np.ndarray, img: DecodedImage) -> Dict[str, Any]:
+        if len(rows) == 0:
             return self._no_detection_explanation()
+        w, h = image_size(img)
+        return self._format_detections(rows, w, h, self.source_size(img))
 
-        # ----- Có detect → trả đầy đủ -----
-        for box in r.boxes:
-            cls_id = int(box.cls[0].item())
-            conf_val = float(box.conf[0].item())
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
+    def _format_detections(
+        self,
+        rows: Iterable,
+        w: int,
+        h: int,
+        src_size: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        rows: (x1, y1, x2, y2, conf, class_id) theo ảnh (w, h) → dict detections trả cho API.
+        src_size: kích thước ảnh gốc nếu ảnh đã được decode rút gọn.
+        """
+        sx = sy = 1.0
+        if src_size is not None and tuple(src_size) != (w, h):
+            sx, sy = src_size[0] / w, src_size[1] / h
+            w, h = src_size
 
+        detections: List[Dict[str, Any]] = []
+        for x1, y1, x2, y2, conf_val, cls_id in rows:
+            cls_id = int(cls_id)
             class_key = self.names.get(cls_id, str(cls_id))
             class_vi = VN_LABELS.get(class_key, class_key)
 
@@ -75,10 +260,10 @@ class YoloDetector:
                 "class_id": cls_id,
                 "class_key": class_key,
                 "class_name": class_vi,
-                "confidence": round(conf_val, 4),
-                "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                "image_width": w,
-                "image_height": h,
+                "confidence": round(float(conf_val), 4),
+                "bbox": [float(x1) * sx, float(y1) * sy, float(x2) * sx, float(y2) * sy],
+                "image_width": int(w),
+                "image_height": int(h),
             })
 
         return {
@@ -115,9 +300,221 @@ class YoloDetector:
         }
 
 
-# instance dùng chung
-detector: YoloDetector | None = None
-try:
-    detector = YoloDetector(MODEL_PATH)
-except FileNotFoundError:
-    detector = None
+class YoloDetector(BaseDetector):
+    backend = "ultralytics"
+
+    def __init__(self, model_path: str = MODEL_PATH):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found: {model_path}")
+
+        # import muộn: chỉ backend .pt mới kéo theo torch/ultralytics
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)    # YOLO sẽ tự xử lý toàn bộ ảnh
+        self.names = self.model.names    # id -> class_name
+        # predictor của Ultralytics không thread-safe → mọi lần predict đi qua lock này
+        self._lock = threading.Lock()
+
+    def predict_rows(
+        self,
+        imgs: List[DecodedImage],
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> List[np.ndarray]:
+        """Chạy YOLO trên 1 batch ảnh (PIL RGB hoặc ndarray BGR) trong 1 lần predict."""
+        if not imgs:
+            return []
+
+        with self._lock:
+            results = self.model.predict(
+                imgs,
+                conf=conf,
+                iou=iou,
+                imgsz=640,
+                verbose=False,
+            )
+
+        if not results:
+            # trường hợp YOLO không trả output
+            return [np.empty((0, 6), dtype=np.float32) for _ in imgs]
+
+        return [self._result_to_rows(r) for r in results]
+
+    @staticmethod
+    def _result_to_rows(r) -> np.ndarray:
+        """Results của Ultralytics → (N, 6) x1, y1, x2, y2, conf, class_id."""
+        if r.boxes is None or len(r.boxes) == 0:
+            return np.empty((0, 6), dtype=np.float32)
+        return r.boxes.data.cpu().numpy()[:, :6]
+
+
+def create_detector(model_path: str = MODEL_PATH, enforce_gate: bool = True) -> BaseDetector:
+    """
+    Chọn backend theo metadata.json cạnh file weights (key "backend"),
+    nếu không khai báo thì theo đuôi file: .onnx → ONNX Runtime, còn lại → Ultralytics.
+    enforce_gate=False chỉ dùng khi benchmark biến thể quantize chưa có metrics.
+    """
+    metadata = read_model_metadata(os.path.dirname(model_path))
+    variant, variant_entry = find_variant(metadata, model_path)
+    if variant:
+        if variant_entry.get("quantization") and enforce_gate:
+            _check_accuracy_gate(variant, variant_entry, model_path)
+        backend = (variant_entry.get("backend") or "").lower()
+    else:
+        backend = (metadata.get("backend") or "").lower()
+    if not backend:
+        backend = "onnx" if model_path.lower().endswith(".onnx") else "ultralytics"
+
+    if backend == "onnx":
+        from app.services.onnx_detector import OnnxDetector
+
+        imgsz = (metadata.get("input_size") or [640])[0]
+        det: BaseDetector = OnnxDetector(model_path, names=_names_from_metadata(metadata), imgsz=imgsz)
+    else:
+        det = YoloDetector(model_path)
+
+    det.model_version = metadata.get("version") or os.path.basename(os.path.dirname(model_path))
+    if variant:
+        det.model_version = f"{det.model_version}+{variant}"
+    det.fingerprint = model_fingerprint(model_path)
+    return det
+
+
+def _check_accuracy_gate(variant: str, entry: Dict[str, Any], model_path: str) -> None:
+    """
+    Biến thể nén (int8...) chỉ được load khi đã được benchmark và mAP giảm
+    không quá MODEL_MAX_ACCURACY_DROP so với bản FP32.
+    """
+    drop = (entry.get("metrics") or {}).get("map50_drop")
+    if drop is None:
+        raise ModelGateError(
+            f"Biến thể '{variant}' ({model_path}) chưa có map50_drop trong metadata.json, "
+            f"hãy chạy bench_quantized_model.py --write-metadata"
+        )
+    if drop > settings.MODEL_MAX_ACCURACY_DROP:
+        raise ModelGateError(
+            f"Biến thể '{variant}' giảm mAP50 {drop:.4f} > ngưỡng {settings.MODEL_MAX_ACCURACY_DROP}, từ chối load"
+        )
+
+
+def _names_from_metadata(metadata: Dict[str, Any]) -> Dict[int, str]:
+    classes = metadata.get("classes") or []
+    return {i: name for i, name in enumerate(classes)}
+
+
+# ============================================
+# Vòng đời detector: load muộn + warm-up
+# ============================================
+# Không load model lúc import: worker chỉ phục vụ auth/news... (INFERENCE_ROLE=api)
+# không phải trả chi phí torch/model. Worker còn lại load ở startup (thread nền)
+# hoặc ở request /detect đầu tiên (INFERENCE_LAZY_LOAD). Model thực tế nằm trong
+# model_registry (có thể hot-swap), ở đây chỉ giữ trạng thái vòng đời.
+_state = "not_loaded"   # not_loaded | loading | ready | failed | disabled
+_load_error: str | None = None
+_load_lock = threading.Lock()
+
+
+def inference_enabled() -> bool:
+    return settings.INFERENCE_ROLE.lower() != "api"
+
+
+def peek_detector(version: Optional[str] = None) -> BaseDetector | None:
+    """Detector (mặc định hoặc `version`) nếu đã load, không kích hoạt load."""
+    from app.services.model_registry import registry
+
+    return registry.get(version) if version else registry.default_detector()
+
+
+def get_detector() -> BaseDetector | None:
+    """Detector mặc định; load (+ warm-up) ở lần gọi đầu. None nếu worker không chạy inference hoặc load lỗi."""
+    det = peek_detector()
+    if det is not None or _state in ("failed", "disabled"):
+        return det
+    return load_detector()
+
+
+def load_detector() -> BaseDetector | None:
+    global _state, _load_error
+    from app.services.model_registry import registry
+
+    if not inference_enabled():
+        _state = "disabled"
+        return None
+
+    with _load_lock:
+        # request khác đang chờ lock trong lúc load → dùng luôn kết quả
+        det = peek_detector()
+        if det is not None or _state == "failed":
+            return det
+
+        _state = "loading"
+        try:
+            loaded = registry.set_default(MODEL_VERSION)
+        except Exception as e:
+            _state = "failed"
+            _load_error = str(e)
+            logger.error(f"[Inference] Không load được model {MODEL_PATH}: {e}")
+            return None
+
+        record_phase("model_load", loaded.load_ms)
+        record_phase("model_warmup", loaded.warmup_ms)
+        _state = "ready"
+
+    logger.info(f"[Inference] Model {loaded.detector.fingerprint} ({loaded.detector.backend}) sẵn sàng")
+
+    if settings.MODEL_SHADOW_VERSION:
+        try:
+            registry.load(settings.MODEL_SHADOW_VERSION)
+            registry.shadow.configure(settings.MODEL_SHADOW_VERSION, settings.MODEL_SHADOW_SAMPLE_RATE)
+        except Exception as e:
+            logger.error(f"[Inference] Không load được model shadow {settings.MODEL_SHADOW_VERSION}: {e}")
+
+    return loaded.detector
+
+
+def warm_up(det: BaseDetector) -> None:
+    """
+    Chạy thử ảnh đen để khởi tạo graph/kernel trước request thật. Chạy cả batch 1
+    và batch lớn nhất của batch engine vì đổi shape input cũng phải cấp phát lại.
+    """
+    runs = settings.INFERENCE_WARMUP_RUNS
+    if runs <= 0:
+        return
+
+    dummy = np.zeros((det.decode_size, det.decode_size, 3), dtype=np.uint8)
+    sizes = {1}
+    if settings.INFERENCE_BATCHING_ENABLED:
+        sizes.add(max(1, settings.INFERENCE_MAX_BATCH_SIZE))
+
+    for n in sorted(sizes):
+        for _ in range(runs):
+            det.predict_rows([dummy] * n)
+
+
+def start_background_load() -> None:
+    """Gọi từ startup: load model ở thread nền để /healthz vẫn trả lời trong lúc chờ."""
+    if not inference_enabled() or settings.INFERENCE_LAZY_LOAD:
+        return
+
+    def _run():
+        load_detector()
+        check_budget("inference_ready")
+
+    threading.Thread(target=_run, name="inference-loader", daemon=True).start()
+
+
+def inference_status() -> Dict[str, Any]:
+    det = peek_detector()
+    state = _state if inference_enabled() else "disabled"
+    return {
+        "role": settings.INFERENCE_ROLE,
+        "lazy_load": settings.INFERENCE_LAZY_LOAD,
+        "state": state,
+        # lazy: chưa load vẫn nhận request (load ở request đầu)
+        "ready": state in ("ready", "disabled") or (settings.INFERENCE_LAZY_LOAD and state == "not_loaded"),
+        "error": _load_error,
+        "model_path": MODEL_PATH,
+        "backend": det.backend if det is not None else None,
+        "model_version": det.model_version if det is not None else None,
+        "fingerprint": det.fingerprint if det is not None else None,
+    }
@@ -0,0 +1,62 @@
+# app/services/job_handlers.py
+"""
+Handler cho các job trong job_queue_service (worker import module này).
+
+Job được giao ít nhất 1 lần → mỗi handler phải chạy lại được an toàn:
+- scan.device      : quét 1 camera (scan_orchestrator.scan_device)
+- enrich.detection : ghi tóm tắt LLM cho ảnh khi lần gọi trong API không có kết quả
+- dataset.export   : cắt ảnh detection vào DATASET_ROOT (ghi đè cùng tên file)
+"""
+import logging
+from typing import Any, Dict
+
+from app.core.database import SessionLocal
+from app.services.job_queue_service import PermanentJobError, job_handler
+
+logger = logging.getLogger(__name__)
+
+
+@job_handler("scan.device")
+def handle_scan_device(payload: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.scan_orchestrator import scan_orchestrator
+
+    result = scan_orchestrator.scan_device(int(payload["device_id"]), int(payload.get("num_images", 3)))
+    if result.get("saved"):
+        # quá ngân sách nhưng đã lưu kết quả + thông báo: chạy lại sẽ lưu / báo trùng
+        return result
+    if result["status"] in ("failed", "timeout"):
+        # camera mất kết nối tạm thời, chưa lưu gì → thử lại với backoff
+        raise RuntimeError(f"Camera {payload['device_id']}: {result.get('reason')}")
+    return result
+
+
+@job_handler("enrich.detection")
+def handle_enrich_detection(payload: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.enrichment_service import _write_detection_texts
+    from app.services.llm_service import summarize_detections_with_status
+
+    summary, care, from_llm = summarize_detections_with_status(
+        payload["detections"], payload.get("model_version", "")
+    )
+    if not from_llm:
+        raise RuntimeError("LLM chưa sẵn sàng, giữ job để thử lại")
+    updated = _write_detection_texts(int(payload["img_id"]), summary, care)
+    return {"img_id": payload["img_id"], "detections_updated": updated}
+
+
+@job_handler("dataset.export")
+def handle_dataset_export(payload: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.export_dataset_service import ExportError, export_detection_to_dataset
+
+    db = SessionLocal()
+    try:
+        saved = export_detection_to_dataset(
+            db=db,
+            detection_id=int(payload["detection_id"]),
+            split=payload.get("split", "train"),
+        )
+    except ExportError as e:
+        raise PermanentJobError(str(e))
+    finally:
+        db.close()
+    return {"saved_files": saved}
@@ -0,0 +1,385 @@
+# app/services/job_queue_service.py
+"""
+Hàng đợi job bền vững trên bảng `jobs` (DB chính, hoặc SQLite riêng qua
+JOB_QUEUE_DATABASE_URL khi chạy local) — thay cho việc chạy quét camera /
+enrichment / export ngay trong process API.
+
+- enqueue(): idempotency_key trùng → trả job cũ (vd "scan:<device>:<slot>" nên
+  nhiều uvicorn worker cùng chạy scheduler cũng chỉ tạo 1 job mỗi camera mỗi lượt);
+  requeue_finished=True → chỉ gộp với job đang queued/running, job done/dead được chạy lại
+- claim(): worker nhận job bằng UPDATE có điều kiện (compare-and-set) → mỗi job
+  chỉ 1 worker giữ lease; lease hết hạn (worker chết) → worker khác nhận lại
+  ⇒ giao ít nhất 1 lần, handler phải idempotent
+- fail(): retry với backoff mũ; hết JOB_MAX_ATTEMPTS hoặc PermanentJobError → "dead"
+
+Worker: python -m app.worker (app/worker.py), handler đăng ký bằng @job_handler.
+"""
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, create_engine, event, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.job_queue import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "done", "dead")
+
+
+class PermanentJobError(Exception):
+    """Lỗi không thể khắc phục bằng retry → job vào dead-letter ngay."""
+
+
+@dataclass
+class ClaimedJob:
+    job_id: int
+    queue: str
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+
+# =====================================================
+# Đăng ký handler
+# =====================================================
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+
+
+def job_handler(kind: str):
+    """@job_handler("scan.device") — queue của job là phần trước dấu chấm."""
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def queue_of(kind: str) -> str:
+    return kind.split(".", 1)[0]
+
+
+def _session_factory():
+    if not settings.JOB_QUEUE_DATABASE_URL:
+        return SessionLocal
+
+    url = settings.JOB_QUEUE_DATABASE_URL
+    is_sqlite = url.startswith("sqlite")
+    eng = create_engine(
+        url,
+        pool_pre_ping=True,
+        future=True,
+        connect_args={"check_same_thread": False, "timeout": 30} if is_sqlite else {},
+    )
+    if is_sqlite:
+        @event.listens_for(eng, "connect")
+        def _sqlite_pragmas(conn, _record):
+            cur = conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")   # API + nhiều worker cùng đọc/ghi 1 file
+            cur.execute("PRAGMA busy_timeout=30000")
+            cur.close()
+
+        # broker local: tự tạo bảng
+        Job.__table__.create(bind=eng, checkfirst=True)
+    return sessionmaker(autocommit=False, autoflush=False, bind=eng)
+
+
+class JobQueue:
+    def __init__(self, session_factory):
+        self._session = session_factory
+
+    # ============================================
+    # Producer
+    # ============================================
+    def enqueue(
+        self,
+        kind: str,
+        payload: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        priority: int = 0,
+        max_attempts: Optional[int] = None,
+        delay_s: float = 0.0,
+        requeue_finished: bool = False,
+    ) -> Tuple[int, bool]:
+        """
+        Trả về (job_id, created). created=False nếu idempotency_key đã có job.
+        requeue_finished: key không gắn với lượt/thời điểm (vd "export:<id>:train") →
+        job cũ đã done/dead được đưa lại về queued (cùng dòng, key là unique).
+        """
+        db = self._session()
+        try:
+            if idempotency_key:
+                existing = db.query(Job.job_id).filter(Job.idempotency_key == idempotency_key).first()
+                if existing is not None:
+                    if requeue_finished and self._requeue(
+                        db, existing[0], payload, priority, max_attempts, delay_s
+                    ):
+                        return existing[0], True
+                    return existing[0], False
+
+            job = Job(
+                queue=queue_of(kind),
+                kind=kind,
+                payload=payload or {},
+                idempotency_key=idempotency_key,
+                status="queued",
+                priority=priority,
+                max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+                run_after=datetime.utcnow() + timedelta(seconds=delay_s),
+            )
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                # producer khác vừa tạo cùng key
+                db.rollback()
+                existing = db.query(Job.job_id).filter(Job.idempotency_key == idempotency_key).first()
+                if existing is None:
+                    raise
+                return existing[0], False
+            return job.job_id, True
+        finally:
+            db.close()
+
+    @staticmethod
+    def _requeue(db, job_id: int, payload, priority: int, max_attempts, delay_s: float) -> bool:
+        """Job done/dead → queued (compare-and-set: 2 producer cùng lúc chỉ 1 bên thành công)."""
+        res = db.execute(
+            update(Job)
+            .where(Job.job_id == job_id, Job.status.in_(("done", "dead")))
+            .values(
+                status="queued",
+                payload=payload or {},
+                priority=priority,
+                attempts=0,
+                max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+                run_after=datetime.utcnow() + timedelta(seconds=delay_s),
+                lease_owner=None,
+                lease_expires_at=None,
+                last_error=None,
+                result=None,
+                started_at=None,
+                finished_at=None,
+            )
+        )
+        db.commit()
+        return res.rowcount == 1
+
+    # ============================================
+    # Worker
+    # ============================================
+    def claim(self, worker_id: str, queues: Iterable[str], limit: int = 1,
+              lease_s: Optional[float] = None) -> List[ClaimedJob]:
+        lease_s = lease_s or settings.JOB_LEASE_S
+        queues = list(queues)
+        db = self._session()
+        try:
+            now = datetime.utcnow()
+            self._dead_letter_expired(db, now)
+
+            claimable = or_(
+                and_(Job.status == "queued", Job.run_after <= now),
+                and_(Job.status == "running", Job.lease_expires_at < now),
+            )
+            candidates = (
+                db.query(Job.job_id)
+                .filter(Job.queue.in_(queues), claimable)
+                .order_by(Job.priority.desc(), Job.job_id.asc())
+                .limit(max(1, limit) * 3)
+                .all()
+            )
+
+            claimed: List[ClaimedJob] = []
+            for (job_id,) in candidates:
+                if len(claimed) >= limit:
+                    break
+                # chỉ 1 worker UPDATE thành công (điều kiện claimable kiểm tra lại trong cùng câu lệnh)
+                res = db.execute(
+                    update(Job)
+                    .where(Job.job_id == job_id, claimable)
+                    .values(
+                        status="running",
+                        lease_owner=worker_id,
+                        lease_expires_at=now + timedelta(seconds=lease_s),
+                        attempts=Job.attempts + 1,
+                        started_at=now,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+                if res.rowcount != 1:
+                    continue
+                job = db.get(Job, job_id)
+                claimed.append(ClaimedJob(
+                    job_id=job.job_id,
+                    queue=job.queue,
+                    kind=job.kind,
+                    payload=job.payload or {},
+                    attempts=job.attempts,
+                    max_attempts=job.max_attempts,
+                ))
+            return claimed
+        finally:
+            db.close()
+
+    @staticmethod
+    def _dead_letter_expired(db, now: datetime) -> None:
+        """Job hết lease mà đã dùng hết lượt thử (worker chết liên tục khi chạy nó) → dead."""
+        res = db.execute(
+            update(Job)
+            .where(
+                Job.status == "running",
+                Job.lease_expires_at < now,
+                Job.attempts >= Job.max_attempts,
+            )
+            .values(status="dead", finished_at=now, lease_owner=None,
+                    last_error="lease hết hạn sau lượt thử cuối")
+            .execution_options(synchronize_session=False)
+        )
+        if res.rowcount:
+            logger.warning(f"[JobQueue] {res.rowcount} job hết lease ở lượt thử cuối → dead")
+        db.commit()
+
+    def heartbeat(self, worker_id: str, job_ids: List[int], lease_s: Optional[float] = None) -> int:
+        """Gia hạn lease cho các job worker đang chạy."""
+        if not job_ids:
+            return 0
+        db = self._session()
+        try:
+            res = db.execute(
+                update(Job)
+                .where(Job.job_id.in_(job_ids), Job.lease_owner == worker_id, Job.status == "running")
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_s or settings.JOB_LEASE_S))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            return res.rowcount
+        finally:
+            db.close()
+
+    def complete(self, job: ClaimedJob, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        return self._finish(job, worker_id, status="done", result=result)
+
+    def fail(self, job: ClaimedJob, worker_id: str, error: str, permanent: bool = False) -> str:
+        """Trả về trạng thái mới: "queued" (sẽ thử lại) hoặc "dead"."""
+        if permanent or job.attempts >= job.max_attempts:
+            self._finish(job, worker_id, status="dead", error=error)
+            return "dead"
+
+        delay = min(settings.JOB_RETRY_MAX_S, settings.JOB_RETRY_BASE_S * 2 ** (job.attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        self._finish(job, worker_id, status="queued", error=error,
+                     run_after=datetime.utcnow() + timedelta(seconds=delay))
+        return "queued"
+
+    def _finish(self, job: ClaimedJob, worker_id: str, status: str, result=None, error=None, run_after=None) -> bool:
+        db = self._session()
+        try:
+            values: Dict[str, Any] = {"status": status, "lease_owner": None, "lease_expires_at": None}
+            if status == "queued":
+                values["run_after"] = run_after
+            else:
+                values["finished_at"] = datetime.utcnow()
+            if result is not None:
+                values["result"] = result
+            if error is not None:
+                values["last_error"] = error[:4000]
+
+            res = db.execute(
+                update(Job)
+                .where(Job.job_id == job.job_id, Job.lease_owner == worker_id, Job.status == "running")
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            if res.rowcount != 1:
+                # lease đã hết và job được worker khác nhận → kết quả lần này bỏ qua
+                logger.warning(f"[JobQueue] Job {job.job_id}: mất lease trước khi ghi trạng thái {status}")
+                return False
+            return True
+        finally:
+            db.close()
+
+    def purge_finished(self, older_than_s: Optional[float] = None) -> int:
+        """Xoá job done cũ (dead giữ lại để admin xem)."""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_s or settings.JOB_RETENTION_S)
+        db = self._session()
+        try:
+            n = (
+                db.query(Job)
+                .filter(Job.status == "done", Job.finished_at < cutoff)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return n
+        finally:
+            db.close()
+
+    # ============================================
+    # Thống kê (dashboard admin)
+    # ============================================
+    def stats(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        hour_ago = now - timedelta(hours=1)
+        db = self._session()
+        try:
+            queues: Dict[str, Dict[str, Any]] = {}
+
+            def q(name: str) -> Dict[str, Any]:
+                return queues.setdefault(name, {
+                    "queue": name,
+                    **{s: 0 for s in JOB_STATUSES},
+                    "ready": 0,
+                    "lag_s": 0.0,
+                    "done_last_5m": 0,
+                    "done_last_1h": 0,
+                    "throughput_per_min": 0.0,
+                    "avg_run_s": None,
+                    "retried_last_1h": 0,
+                })
+
+            for name, status, n in db.query(Job.queue, Job.status, func.count(Job.job_id)).group_by(Job.queue, Job.status):
+                q(name)[status] = n
+
+            # lag = job sẵn sàng chạy lâu nhất đã chờ bao lâu
+            for name, n, oldest in (
+                db.query(Job.queue, func.count(Job.job_id), func.min(Job.run_after))
+                .filter(Job.status == "queued", Job.run_after <= now)
+                .group_by(Job.queue)
+            ):
+                q(name)["ready"] = n
+                q(name)["lag_s"] = round((now - oldest).total_seconds(), 1) if oldest else 0.0
+
+            rows = (
+                db.query(Job.queue, Job.started_at, Job.finished_at, Job.attempts)
+                .filter(Job.status == "done", Job.finished_at >= hour_ago)
+                .all()
+            )
+            run_s: Dict[str, List[float]] = {}
+            five_min_ago = now - timedelta(minutes=5)
+            for name, started, finished, attempts in rows:
+                s = q(name)
+                s["done_last_1h"] += 1
+                if finished >= five_min_ago:
+                    s["done_last_5m"] += 1
+                if attempts > 1:
+                    s["retried_last_1h"] += 1
+                if started:
+                    run_s.setdefault(name, []).append((finished - started).total_seconds())
+
+            for name, s in queues.items():
+                s["throughput_per_min"] = round(s["done_last_1h"] / 60, 2)
+                if run_s.get(name):
+                    s["avg_run_s"] = round(sum(run_s[name]) / len(run_s[name]), 2)
+            return sorted(queues.values(), key=lambda s: s["queue"])
+        finally:
+            db.close()
+
+
+job_queue = JobQueue(_session_factory())
@@ -0,0 +1,340 @@
+# app/services/knowledge_index_service.py
+"""
+Chỉ mục BM25 trong RAM trên kiến thức bệnh cây đã có trong DB, dùng cho chatbot.
+
+Nguồn:
+- diseases: name + description + treatment_guideline (nội dung do admin soạn)
+- detections: description / treatment_guideline đã sinh cho ảnh (bỏ review "rejected"),
+  gộp các đoạn trùng nội dung
+
+Cập nhật tăng dần (KNOWLEDGE_REFRESH_S): đọc lại bảng diseases (nhỏ) + các
+detection mới / vừa được ghi tóm tắt (enrichment ghi sau khi insert) → chỉ
+thêm / sửa document thay đổi. Định kỳ KNOWLEDGE_FULL_REBUILD_S dựng lại toàn bộ
+để loại document đã bị xoá / reject.
+
+retrieve(): trả đoạn liên quan để chèn vào prompt; câu hỏi khớp rõ 1 bệnh
+(FAQ) → trả lời luôn từ nội dung bệnh, không gọi LLM.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.image_detection import Detection, Disease
+from app.utils.vi_text import tokenize
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+@dataclass
+class KnowledgeDoc:
+    doc_id: str                 # "disease:<id>" | "det:<hash nội dung>"
+    kind: str                   # "disease" | "detection"
+    title: str
+    text: str
+    disease_id: Optional[int] = None
+    description: Optional[str] = None
+    guideline: Optional[str] = None
+    tf: Counter = field(default_factory=Counter, repr=False)
+    length: int = 0
+
+
+@dataclass
+class Retrieval:
+    passages: List[Dict[str, Any]]
+    direct_answer: Optional[str] = None
+    latency_ms: float = 0.0
+
+
+class BM25Index:
+    """Inverted index hỗ trợ thêm / sửa / xoá từng document (không cần dựng lại)."""
+
+    def __init__(self):
+        self.docs: Dict[str, KnowledgeDoc] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_len = 0
+
+    def upsert(self, doc: KnowledgeDoc) -> bool:
+        """Trả về False nếu document không đổi nội dung."""
+        old = self.docs.get(doc.doc_id)
+        if old is not None and old.text == doc.text and old.title == doc.title:
+            return False
+        if old is not None:
+            self.remove(doc.doc_id)
+
+        doc.tf = Counter(tokenize(f"{doc.title} {doc.text}"))
+        doc.length = sum(doc.tf.values())
+        self.docs[doc.doc_id] = doc
+        self.total_len += doc.length
+        for term, n in doc.tf.items():
+            self.postings.setdefault(term, {})[doc.doc_id] = n
+        return True
+
+    def remove(self, doc_id: str) -> None:
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_len -= doc.length
+        for term in doc.tf:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def idf(self, term: str) -> float:
+        n = len(self.docs)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int) -> List[tuple]:
+        """[(score, doc, coverage)] — coverage: tỉ lệ (theo idf) term của câu hỏi có trong doc."""
+        if not self.docs:
+            return []
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        avg_len = self.total_len / len(self.docs)
+        weights = {t: self.idf(t) for t in terms}
+        total_weight = sum(weights.values()) or 1.0
+
+        scores: Dict[str, float] = {}
+        matched: Dict[str, float] = {}
+        for term in terms:
+            for doc_id, tf in self.postings.get(term, {}).items():
+                doc = self.docs[doc_id]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc.length / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + weights[term] * tf * (BM25_K1 + 1) / norm
+                matched[doc_id] = matched.get(doc_id, 0.0) + weights[term]
+
+        top = sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+        return [(score, self.docs[doc_id], matched[doc_id] / total_weight) for doc_id, score in top]
+
+
+def _detection_doc(disease_name: Optional[str], description: Optional[str], guideline: Optional[str]):
+    text = "\n".join(t for t in (description, guideline) if t)
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    return KnowledgeDoc(
+        doc_id=f"det:{digest}",
+        kind="detection",
+        title=disease_name or "",
+        text=text,
+        description=description,
+        guideline=guideline,
+    )
+
+
+class KnowledgeIndex:
+    def __init__(self):
+        self.index = BM25Index()
+        self._lock = threading.Lock()          # bảo vệ index khi refresh / search
+        self._refresh_lock = threading.Lock()  # chỉ 1 refresh chạy cùng lúc
+        self._built = False
+        self._last_refresh = 0.0
+        self._last_full_build = 0.0
+        self._detection_watermark = 0
+
+        self.refreshes = 0
+        self.docs_updated = 0
+        self.queries = 0
+        self.direct_answers = 0
+        self.grounded = 0
+        self._latencies = deque(maxlen=500)
+        self._stats_lock = threading.Lock()
+
+    # ============================================
+    # Dựng / cập nhật index từ DB
+    # ============================================
+    def refresh(self, full: bool = False) -> int:
+        """Đồng bộ index với DB, trả về số document thêm / sửa."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = time.time()
+            full = full or not self._built or now - self._last_full_build > settings.KNOWLEDGE_FULL_REBUILD_S
+            db = SessionLocal()
+            try:
+                docs = self._load_docs(db, full)
+            finally:
+                db.close()
+
+            changed = 0
+            with self._lock:
+                if full:
+                    fresh = BM25Index()
+                    for doc in docs:
+                        fresh.upsert(doc)
+                    changed = len(fresh.docs)
+                    self.index = fresh
+                    self._last_full_build = now
+                else:
+                    changed = sum(1 for doc in docs if self.index.upsert(doc))
+                self._built = True
+                self._last_refresh = now
+
+            self.refreshes += 1
+            self.docs_updated += changed
+            if changed:
+                logger.info(f"[Knowledge] {'Dựng lại' if full else 'Cập nhật'} index: {changed} document")
+            return changed
+        finally:
+            self._refresh_lock.release()
+
+    def _load_docs(self, db, full: bool) -> List[KnowledgeDoc]:
+        docs: List[KnowledgeDoc] = []
+        names: Dict[int, str] = {}
+
+        # bảng diseases nhỏ → luôn đọc lại toàn bộ, upsert tự bỏ qua doc không đổi
+        for dis in db.query(Disease).all():
+            names[dis.disease_id] = dis.name or ""
+            text = "\n".join(t for t in (dis.description, dis.treatment_guideline) if t)
+            if not text:
+                continue
+            docs.append(KnowledgeDoc(
+                doc_id=f"disease:{dis.disease_id}",
+                kind="disease",
+                title=dis.name or "",
+                text=text,
+                disease_id=dis.disease_id,
+                description=dis.description,
+                guideline=dis.treatment_guideline,
+            ))
+
+        query = db.query(
+            Detection.detection_id,
+            Detection.disease_id,
+            Detection.description,
+            Detection.treatment_guideline,
+        ).filter(
+            Detection.description.isnot(None),
+            Detection.review_status != "rejected",
+        )
+        if not full:
+            # detection mới + detection gần đây (tóm tắt LLM có thể được ghi sau khi insert)
+            recent = datetime.now() - timedelta(seconds=settings.KNOWLEDGE_RECHECK_WINDOW_S)
+            query = query.filter(
+                (Detection.detection_id > self._detection_watermark) | (Detection.created_at >= recent)
+            )
+        rows = (
+            query.order_by(Detection.detection_id.desc())
+            .limit(settings.KNOWLEDGE_MAX_DETECTION_ROWS)
+            .all()
+        )
+
+        seen = set()
+        for det_id, disease_id, description, guideline in rows:
+            self._detection_watermark = max(self._detection_watermark, det_id)
+            doc = _detection_doc(names.get(disease_id), description, guideline)
+            if doc.doc_id in seen:
+                continue
+            seen.add(doc.doc_id)
+            doc.disease_id = disease_id
+            docs.append(doc)
+        return docs
+
+    def _maybe_refresh(self) -> None:
+        if not self._built:
+            self.refresh()  # lần đầu: dựng đồng bộ
+        elif time.time() - self._last_refresh > settings.KNOWLEDGE_REFRESH_S:
+            threading.Thread(target=self._safe_refresh, name="knowledge-refresh", daemon=True).start()
+
+    def _safe_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"[Knowledge] Refresh lỗi: {e}")
+
+    # ============================================
+    # Truy vấn
+    # ============================================
+    def retrieve(self, question: str, k: Optional[int] = None) -> Retrieval:
+        """
+        Top-k đoạn liên quan + câu trả lời trực tiếp nếu câu hỏi khớp rõ 1 bệnh:
+        doc bệnh đứng đầu, phủ >= KNOWLEDGE_DIRECT_MIN_COVERAGE term của câu hỏi
+        và điểm gấp >= KNOWLEDGE_DIRECT_MIN_MARGIN lần doc bệnh kế tiếp.
+        """
+        t0 = time.perf_counter()
+        k = k or settings.KNOWLEDGE_TOP_K
+        try:
+            self._maybe_refresh()
+        except Exception as e:
+            logger.warning(f"[Knowledge] Không dựng được index: {e}")
+
+        with self._lock:
+            hits = self.index.search(question, k + 3)
+
+        passages = [
+            {
+                "doc_id": doc.doc_id,
+                "kind": doc.kind,
+                "title": doc.title,
+                "text": doc.text,
+                "score": round(score, 3),
+                "coverage": round(coverage, 3),
+            }
+            for score, doc, coverage in hits
+            if score >= settings.KNOWLEDGE_MIN_SCORE
+        ][:k]
+
+        direct = None
+        disease_hits = [(s, d, c) for s, d, c in hits if d.kind == "disease"]
+        if disease_hits and hits[0][1].kind == "disease":
+            score, doc, coverage = disease_hits[0]
+            runner_up = disease_hits[1][0] if len(disease_hits) > 1 else 0.0
+            if (
+                coverage >= settings.KNOWLEDGE_DIRECT_MIN_COVERAGE
+                and score >= settings.KNOWLEDGE_MIN_SCORE
+                and score >= settings.KNOWLEDGE_DIRECT_MIN_MARGIN * runner_up
+            ):
+                direct = self._format_answer(doc)
+
+        latency_ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            self.queries += 1
+            self._latencies.append(latency_ms)
+            if direct:
+                self.direct_answers += 1
+            elif passages:
+                self.grounded += 1
+        return Retrieval(passages=passages, direct_answer=direct, latency_ms=round(latency_ms, 2))
+
+    @staticmethod
+    def _format_answer(doc: KnowledgeDoc) -> str:
+        parts = [f"**{doc.title}**"]
+        if doc.description:
+            parts.append(doc.description.strip())
+        if doc.guideline:
+            parts.append("📌 **Hướng dẫn xử lý:**\n" + doc.guideline.strip())
+        return "\n\n".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            lat = sorted(self._latencies)
+            queries = self.queries
+            return {
+                "built": self._built,
+                "documents": len(self.index.docs),
+                "terms": len(self.index.postings),
+                "refreshes": self.refreshes,
+                "docs_updated": self.docs_updated,
+                "last_refresh": datetime.fromtimestamp(self._last_refresh).isoformat() if self._last_refresh else None,
+                "queries": queries,
+                "direct_answers": self.direct_answers,
+                "grounded": self.grounded,
+                "local_answer_rate": round(self.direct_answers / queries, 4) if queries else 0.0,
+                "latency_p50_ms": round(lat[len(lat) // 2], 2) if lat else None,
+                "latency_p95_ms": round(lat[int(0.95 * (len(lat) - 1))], 2) if lat else None,
+            }
+
+
+knowledge_index = KnowledgeIndex()
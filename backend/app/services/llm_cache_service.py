@@ -0,0 +1,166 @@
+# app/services/llm_cache_service.py
+"""
+Cache tóm tắt LLM (disease_summary, care_instructions) theo chữ ký detections.
+
+Prompt gửi Gemini chỉ phụ thuộc vào tập bệnh + số vùng (đã chia bucket), nên
+số prompt khác nhau chỉ vài chục dù ảnh nào cũng khác nhau → cache theo key
+do llm_service dựng (version template prompt + version model + bệnh:bucket).
+
+- Namespace = version template prompt: đổi template → purge cache đĩa cũ.
+- Các lượt miss cùng key đang chờ Gemini dùng chung 1 lần gọi (in-flight future).
+- Không cache kết quả rỗng (LLM lỗi / tắt) → lần sau còn thử lại.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.ttl_cache import DiskCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+Summary = Tuple[Optional[str], Optional[str]]
+
+
+class LLMSummaryCache:
+    def __init__(self, maxsize: int, ttl: float, disk_dir: str = ""):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(disk_dir, ttl=ttl) if disk_dir else None
+
+        self._inflight: Dict[Hashable, Future] = {}
+        self._namespace: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_empty = 0
+
+    @staticmethod
+    def _disk_key(key: str) -> str:
+        # key có ký tự như "|", ":" → đổi sang hash để làm tên file
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _use_namespace(self, namespace: str) -> None:
+        """Lần đầu gặp namespace (template prompt) mới → xoá cache của template cũ."""
+        with self._lock:
+            if namespace == self._namespace:
+                return
+            old, self._namespace = self._namespace, namespace
+
+        if old is not None:
+            logger.info(f"[LLMCache] Template prompt đổi {old} → {namespace}, xoá cache cũ")
+            self.memory.pop_where(lambda k: k[0] != namespace)
+        if self.disk is not None:
+            self.disk.purge(keep_namespace=namespace)
+
+    # ============================================
+    # Get / Put
+    # ============================================
+    def get(self, namespace: str, key: str) -> Optional[Summary]:
+        value = self.memory.get((namespace, key))
+        if value is None and self.disk is not None:
+            value = self.disk.get(namespace, self._disk_key(key))
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.memory.set((namespace, key), value)
+        if value is None:
+            return None
+        return value["disease_summary"], value["care_instructions"]
+
+    def put(self, namespace: str, key: str, summary: Summary) -> None:
+        disease_summary, care_instructions = summary
+        value = {
+            "key": key,
+            "disease_summary": disease_summary,
+            "care_instructions": care_instructions,
+        }
+        self.memory.set((namespace, key), value)
+        if self.disk is not None:
+            try:
+                self.disk.set(namespace, self._disk_key(key), value)
+            except OSError as e:
+                logger.warning(f"[LLMCache] Không ghi được cache đĩa: {e}")
+
+    def get_or_compute(
+        self,
+        namespace: str,
+        key: str,
+        compute: Callable[[], Summary],
+        wait_timeout: Optional[float] = None,
+    ) -> Summary:
+        """
+        Hit → trả luôn. Miss → thread đầu tiên gọi compute(), các thread cùng key
+        đến sau chờ kết quả đó (tối đa wait_timeout giây, quá hạn → TimeoutError).
+        """
+        self._use_namespace(namespace)
+
+        cached = self.get(namespace, key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get((namespace, key))
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[(namespace, key)] = future
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(timeout=wait_timeout)
+
+        try:
+            summary = compute()
+            if any(summary):
+                self.put(namespace, key, summary)
+            else:
+                with self._lock:
+                    self.upstream_empty += 1
+            future.set_result(summary)
+            return summary
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop((namespace, key), None)
+
+    def clear(self) -> None:
+        self.memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        mem = self.memory.stats()
+        with self._lock:
+            # memory.misses bao gồm cả lượt sau đó hit ở tầng đĩa
+            hits = mem["hits"] + self.disk_hits
+            misses = mem["misses"] - self.disk_hits
+            total = hits + misses
+            return {
+                "prompt_template": self._namespace,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "coalesced": self.coalesced,
+                "upstream_calls": self.upstream_calls,
+                "upstream_empty": self.upstream_empty,
+                "inflight": len(self._inflight),
+                "memory": mem,
+                "disk_enabled": self.disk is not None,
+                "disk_hits": self.disk_hits,
+            }
+
+
+# instance dùng chung (None nếu tắt cache)
+llm_summary_cache: LLMSummaryCache | None = None
+if settings.LLM_CACHE_ENABLED:
+    llm_summary_cache = LLMSummaryCache(
+        maxsize=settings.LLM_CACHE_MAX_ITEMS,
+        ttl=settings.LLM_CACHE_TTL_S,
+        disk_dir=settings.LLM_CACHE_DIR,
+    )
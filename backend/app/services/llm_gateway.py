@@ -0,0 +1,499 @@
+# app/services/llm_gateway.py
+"""
+Cổng gọi LLM dùng chung cho llm_service / chatbot_service / auto_detection_service.
+
+- 1 client Gemini (google-genai, API async) sống trên 1 event loop riêng
+  (thread "llm-gateway") → tái sử dụng connection pool cho mọi caller.
+- Mỗi lần gọi có deadline (gồm cả thời gian chờ rate limit + retry).
+- Token bucket giới hạn số request/giây gửi lên Gemini.
+- Retry lỗi tạm thời (timeout, 429, 5xx) với backoff + jitter.
+- Circuit breaker: lỗi liên tiếp quá ngưỡng → từ chối ngay trong
+  LLM_BREAKER_RESET_S giây (caller trả text dự phòng), sau đó thử lại 1 request.
+- LLM_BACKEND=fake: backend giả, không gọi mạng (test / dev offline).
+
+Caller đồng bộ (thread pool, scheduler) dùng generate(); code async dùng agenerate()
+hoặc astream() (nhận từng đoạn text khi model đang sinh, đo riêng time-to-first-token).
+Mọi lỗi upstream được gói thành LLMUnavailableError.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailableError(RuntimeError):
+    """LLM không trả lời được (chưa cấu hình, breaker mở, hết deadline, lỗi upstream)."""
+
+
+# =====================================================
+# Backend
+# =====================================================
+class GeminiBackend:
+    """Gemini qua SDK google-genai (client.aio), tạo client 1 lần trên loop của gateway."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model: str):
+        self.model = model
+        self._api_key = api_key
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._api_key)
+
+    async def generate(self, prompt: str) -> str:
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(api_key=self._api_key)
+        response = await self._client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt,
+        )
+        return (response.text or "").strip()
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(api_key=self._api_key)
+        chunks = await self._client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=prompt,
+        )
+        async for chunk in chunks:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeLLMBackend:
+    """
+    Backend giả cho test: trả lời theo responder(prompt) (mặc định: text đúng
+    format [DISEASE_SUMMARY]/[CARE_INSTRUCTIONS]), có thể giả lập độ trễ và lỗi.
+    """
+
+    name = "fake"
+    configured = True
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[str], str]] = None,
+        latency_s: float = 0.0,
+        fail_rate: float = 0.0,
+    ):
+        self.responder = responder or self._default_response
+        self.latency_s = latency_s
+        self.fail_rate = fail_rate
+        self.calls = 0
+
+    @staticmethod
+    def _default_response(prompt: str) -> str:
+        return (
+            "[DISEASE_SUMMARY]\n- (fake) Tóm tắt tình trạng cây.\n\n"
+            "[CARE_INSTRUCTIONS]\n- (fake) Hướng dẫn chăm sóc."
+        )
+
+    async def generate(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ConnectionError("fake upstream error")
+        return self.responder(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Trả từng từ của câu trả lời, latency_s là thời gian tới token đầu."""
+        text = await self.generate(prompt)
+        for i, word in enumerate(text.split(" ")):
+            yield word if i == 0 else " " + word
+            await asyncio.sleep(0)
+
+
+# =====================================================
+# Rate limit + circuit breaker
+# =====================================================
+class TokenBucket:
+    """rate token/giây, tối đa burst token. Chỉ dùng trên loop của gateway."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: float) -> bool:
+        """Chờ tới khi có token; không kịp trước deadline (monotonic) → False."""
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    return False
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """closed → (lỗi liên tiếp >= threshold) → open → (hết reset_s) → half_open → 1 request thử."""
+
+    def __init__(self, threshold: int, reset_s: float):
+        self.threshold = max(1, int(threshold))
+        self.reset_s = float(reset_s)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_s:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("[LLMGateway] Upstream hồi phục, đóng circuit breaker")
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Request thử của half_open bị huỷ (caller bỏ đi) → cho request sau thử lại."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    logger.warning(
+                        f"[LLMGateway] Mở circuit breaker sau {self.failures} lỗi liên tiếp "
+                        f"(thử lại sau {self.reset_s}s)"
+                    )
+                    self.opened_total += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opened_total": self.opened_total,
+            }
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Lỗi 4xx (trừ 408/429) là lỗi request → không retry, không tính vào breaker."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int) and 400 <= code < 500 and code not in (408, 429):
+        return False
+    return True
+
+
+# =====================================================
+# Gateway
+# =====================================================
+class LLMGateway:
+    def __init__(self, backend):
+        self.backend = backend
+        self.breaker = CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_S)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "success": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "rate_limited": 0,
+            "short_circuited": 0,
+            "streams": 0,
+            "streams_completed": 0,
+            "streams_failed": 0,
+        }
+        self._latency_ms_total = 0.0
+        self._stream_ttft_ms_total = 0.0
+        self._stream_total_ms_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(getattr(self.backend, "configured", False))
+
+    def set_backend(self, backend) -> None:
+        """Đổi backend (vd FakeLLMBackend trong test), reset breaker."""
+        self.backend = backend
+        self.breaker = CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_S)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._counters[name] += n
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    self._bucket = TokenBucket(settings.LLM_RATE_PER_S, settings.LLM_RATE_BURST)
+                    self._semaphore = asyncio.Semaphore(max(1, settings.LLM_MAX_CONCURRENCY))
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=_run, name="llm-gateway", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    # ============================================
+    # Gọi upstream (chạy trên loop của gateway)
+    # ============================================
+    async def _admit(self, deadline: float) -> None:
+        """
+        Qua breaker rồi lấy token rate limit. Không lấy được token (hết deadline /
+        caller huỷ) → nhả lượt thử half_open, nếu không breaker kẹt half_open mãi.
+        """
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailableError("LLM tạm ngưng (circuit breaker đang mở)")
+        acquired = False
+        try:
+            acquired = await self._bucket.acquire(deadline)
+        finally:
+            if not acquired:
+                self.breaker.release_probe()
+        if not acquired:
+            self._count("rate_limited")
+            raise LLMUnavailableError("LLM vượt giới hạn request/giây")
+
+    async def _call(self, prompt: str, timeout: float) -> str:
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            await self._admit(deadline)
+
+            remaining = deadline - time.monotonic()
+            try:
+                async with self._semaphore:
+                    text = await asyncio.wait_for(self.backend.generate(prompt), max(remaining, 0.001))
+                self.breaker.record_success()
+                return text
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                self.breaker.record_failure()
+                raise LLMUnavailableError(f"LLM không trả lời trong {timeout}s")
+            except Exception as e:
+                if not _is_retryable(e):
+                    # request sai (4xx): upstream vẫn sống → nhả lượt thử của half_open
+                    self.breaker.record_success()
+                    raise LLMUnavailableError(f"LLM từ chối request: {e}") from e
+                self.breaker.record_failure()
+                # backoff luỹ thừa + full jitter, không vượt deadline
+                delay = random.uniform(0, settings.LLM_RETRY_BASE_S * (2 ** attempt))
+                if attempt >= settings.LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    raise LLMUnavailableError(f"Lỗi gọi LLM: {e}") from e
+                attempt += 1
+                self._count("retries")
+                logger.info(f"[LLMGateway] Lỗi tạm thời ({e}), thử lại lần {attempt} sau {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _stream_into(self, prompt: str, timeout: float, emit: Callable[[str, Any], None]) -> None:
+        """
+        Chạy trên loop của gateway, đẩy ("chunk", text) / ("error", exc) / ("end", stats)
+        qua emit. timeout áp cho token đầu tiên; cả stream tối đa LLM_STREAM_TIMEOUT_S.
+        Chỉ retry khi chưa gửi token nào cho client.
+        """
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        total_deadline = time.monotonic() + max(timeout, settings.LLM_STREAM_TIMEOUT_S)
+        self._count("streams")
+        attempt = 0
+        ttft_ms = None
+        try:
+            while True:
+                await self._admit(deadline)
+
+                try:
+                    async with self._semaphore:
+                        chunks = self.backend.stream(prompt).__aiter__()
+                        while True:
+                            limit = deadline if ttft_ms is None else total_deadline
+                            try:
+                                text = await asyncio.wait_for(
+                                    chunks.__anext__(), max(limit - time.monotonic(), 0.001)
+                                )
+                            except StopAsyncIteration:
+                                break
+                            if ttft_ms is None:
+                                ttft_ms = (time.perf_counter() - t0) * 1000
+                            emit("chunk", text)
+                    self.breaker.record_success()
+                    break
+                except asyncio.CancelledError:
+                    self.breaker.release_probe()
+                    raise
+                except asyncio.TimeoutError:
+                    self._count("timeouts")
+                    self.breaker.record_failure()
+                    raise LLMUnavailableError(f"LLM stream quá thời gian (token đầu: {timeout}s)")
+                except Exception as e:
+                    if not _is_retryable(e):
+                        self.breaker.record_success()
+                        raise LLMUnavailableError(f"LLM từ chối request: {e}") from e
+                    self.breaker.record_failure()
+                    delay = random.uniform(0, settings.LLM_RETRY_BASE_S * (2 ** attempt))
+                    if ttft_ms is not None or attempt >= settings.LLM_MAX_RETRIES \
+                            or time.monotonic() + delay >= deadline:
+                        raise LLMUnavailableError(f"Lỗi gọi LLM: {e}") from e
+                    attempt += 1
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+        except LLMUnavailableError as e:
+            self._count("streams_failed")
+            emit("error", e)
+            return
+
+        total_ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            self._counters["streams_completed"] += 1
+            self._stream_ttft_ms_total += ttft_ms or total_ms
+            self._stream_total_ms_total += total_ms
+        emit("end", {"ttft_ms": round(ttft_ms or total_ms, 1), "total_ms": round(total_ms, 1)})
+
+    async def _generate(self, prompt: str, timeout: float) -> str:
+        t0 = time.perf_counter()
+        self._count("requests")
+        try:
+            text = await self._call(prompt, timeout)
+        except LLMUnavailableError:
+            self._count("failed")
+            raise
+        with self._stats_lock:
+            self._counters["success"] += 1
+            self._latency_ms_total += (time.perf_counter() - t0) * 1000
+        return text
+
+    def _submit(self, prompt: str, timeout: Optional[float]):
+        if not self.enabled:
+            raise LLMUnavailableError("LLM chưa được cấu hình (thiếu GEMINI_API_KEY)")
+        timeout = settings.LLM_TIMEOUT_S if timeout is None else timeout
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, timeout), loop), timeout
+
+    # ============================================
+    # API cho caller
+    # ============================================
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Gọi từ code đồng bộ (không gọi trong event loop). Lỗi → LLMUnavailableError."""
+        fut, timeout = self._submit(prompt, timeout)
+        try:
+            # deadline đã được áp trong _call, +1s để nhận lỗi timeout từ loop
+            return fut.result(timeout=timeout + 1)
+        except TimeoutError:
+            fut.cancel()
+            raise LLMUnavailableError(f"LLM không trả lời trong {timeout}s")
+
+    async def agenerate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Bản async cho route/service chạy trên event loop của app."""
+        fut, _ = self._submit(prompt, timeout)
+        return await asyncio.wrap_future(fut)
+
+    async def astream(
+        self,
+        prompt: str,
+        timeout: Optional[float] = None,
+        metrics: Optional[Dict[str, float]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Trả từng đoạn text khi model đang sinh. Lỗi (kể cả giữa chừng) → LLMUnavailableError.
+        metrics (nếu truyền) được điền ttft_ms / total_ms khi stream kết thúc.
+        Caller ngừng đọc (client ngắt kết nối) → huỷ request upstream.
+        """
+        if not self.enabled:
+            raise LLMUnavailableError("LLM chưa được cấu hình (thiếu GEMINI_API_KEY)")
+        timeout = settings.LLM_TIMEOUT_S if timeout is None else timeout
+
+        caller_loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(kind: str, value: Any) -> None:
+            caller_loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+        fut = asyncio.run_coroutine_threadsafe(
+            self._stream_into(prompt, timeout, emit), self._ensure_loop()
+        )
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    if metrics is not None:
+                        metrics.update(value)
+                    return
+        finally:
+            fut.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._counters)
+            avg = self._latency_ms_total / counters["success"] if counters["success"] else 0.0
+            ok_streams = counters["streams_completed"]
+            avg_ttft = self._stream_ttft_ms_total / ok_streams if ok_streams > 0 else 0.0
+            avg_stream = self._stream_total_ms_total / ok_streams if ok_streams > 0 else 0.0
+        return {
+            "backend": self.backend.name,
+            "enabled": self.enabled,
+            "model": getattr(self.backend, "model", None),
+            **counters,
+            "avg_latency_ms": round(avg, 1),
+            "stream_avg_ttft_ms": round(avg_ttft, 1),
+            "stream_avg_total_ms": round(avg_stream, 1),
+            "breaker": self.breaker.stats(),
+        }
+
+
+def _create_backend():
+    if settings.LLM_BACKEND == "fake":
+        return FakeLLMBackend()
+    return GeminiBackend(settings.GEMINI_API_KEY, settings.GEMINI_MODEL)
+
+
+llm_gateway = LLMGateway(_create_backend())
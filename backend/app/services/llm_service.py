@@ -1,42 +1,22 @@
 # ============================================
-#  llm_service.py – FULL WORKING VERSION (SDK mới)
+#  llm_service.py – tóm tắt bệnh + hướng dẫn chăm sóc bằng LLM
 # ============================================
 
-import os
-import json
 from collections import Counter
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import List, Dict, Any, Tuple, Optional
 
-# SDK MỚI – KHÔNG DÙNG google.generativeai NỮA
-from google import genai  
-from dotenv import load_dotenv
-
-# Load .env (đảm bảo chạy dù VSCode không inject)
-load_dotenv()
-
-# =====================================================
-# 1. LẤY API KEY + MODEL TỪ .env
-# =====================================================
-
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")   # KHÔNG BAO GIỜ LOG KEY RA !!!
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-
-print("[LLM] HAS API KEY:", bool(GEMINI_API_KEY))
-print("[LLM] USING MODEL:", GEMINI_MODEL)
+from app.core.config import settings
+from app.services.inference_service import VN_LABELS
+from app.services.llm_cache_service import llm_summary_cache
+from app.services.llm_gateway import LLMUnavailableError, llm_gateway
 
 # =====================================================
-# 2. TẠO CLIENT
+# 1-2. CLIENT GEMINI: DÙNG CHUNG QUA llm_gateway
+# (API key / model / timeout / rate limit cấu hình trong settings)
 # =====================================================
 
-client = None
-if GEMINI_API_KEY:
-    try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        print("[LLM] Gemini client initialized OK.")
-    except Exception as e:
-        print("[LLM] ERROR initializing Gemini client:", e)
-else:
-    print("[LLM] ❌ GEMINI_API_KEY missing! LLM disabled.")
+print("[LLM] Backend:", llm_gateway.backend.name, "| enabled:", llm_gateway.enabled)
 
 
 # =====================================================
@@ -56,14 +36,62 @@ HEALTHY_CLASS_KEYS = {
 
 
 # =====================================================
-# 4. TẠO PROMPT TỰ ĐỘNG
+# 4. CHUẨN HOÁ DETECTIONS → CHỮ KÝ PROMPT
 # =====================================================
 
-def _build_prompt_from_detections(detections: List[Dict[str, Any]]) -> str:
+# Đổi nội dung template prompt bên dưới → tăng version để bỏ cache cũ
+PROMPT_TEMPLATE_VERSION = "p2"
+
+# Số vùng bệnh được gom theo bucket: prompt (và cache) chỉ phân biệt mức độ
+COUNT_BUCKETS = ((1, "1"), (3, "2-3"), (9, "4-9"))
+COUNT_BUCKET_MAX = "10+"
+
+# (loại, ((class_key, bucket), ...)) với loại: "empty" | "healthy" | "disease"
+PromptSignature = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _count_bucket(count: int) -> str:
+    for upper, label in COUNT_BUCKETS:
+        if count <= upper:
+            return label
+    return COUNT_BUCKET_MAX
+
+
+def detection_signature(detections: List[Dict[str, Any]]) -> PromptSignature:
+    """Rút detections về đúng những gì prompt dùng: tập bệnh + bucket số vùng."""
+    if not detections:
+        return "empty", ()
+
+    disease_counts: Counter = Counter()
+    for det in detections:
+        # auto-scan chỉ có class_name (= class_key), /detect có cả 2
+        key = det.get("class_key") or det.get("class_name")
+        if key in DISEASE_CLASS_KEYS:
+            disease_counts[key] += 1
+
+    if not disease_counts:
+        return "healthy", ()
+    return "disease", tuple(
+        (key, _count_bucket(cnt)) for key, cnt in sorted(disease_counts.items())
+    )
+
+
+def signature_cache_key(signature: PromptSignature, model_version: str = "") -> str:
+    kind, items = signature
+    body = ",".join(f"{key}:{bucket}" for key, bucket in items)
+    return f"{PROMPT_TEMPLATE_VERSION}|{model_version or '-'}|{kind}|{body}"
+
+
+# =====================================================
+# 5. TẠO PROMPT TỪ CHỮ KÝ
+# =====================================================
+
+def _build_prompt(signature: PromptSignature) -> str:
     """Sinh prompt mô tả bệnh + yêu cầu LLM trả về nội dung dạng 2 phần."""
+    kind, items = signature
 
     # Không phát hiện gì
-    if not detections:
+    if kind == "empty":
         return (
             "Hệ thống AI không phát hiện bệnh rõ ràng.\n\n"
             "Hãy trả lời theo đúng cấu trúc sau:\n\n"
@@ -73,20 +101,8 @@ def _build_prompt_from_detections(detections: List[Dict[str, Any]]) -> str:
             "- Đưa ra hướng dẫn chăm sóc cơ bản để cây tiếp tục khỏe mạnh.\n"
         )
 
-    disease_items = []
-    healthy_items = []
-
-    for det in detections:
-        key = det.get("class_key")
-        name_vi = det.get("class_name")
-
-        if key in DISEASE_CLASS_KEYS:
-            disease_items.append(name_vi)
-        elif key in HEALTHY_CLASS_KEYS:
-            healthy_items.append(name_vi)
-
     # Chỉ khỏe
-    if len(disease_items) == 0:
+    if kind == "healthy":
         return (
             "AI nhận thấy các vùng quét đều thuộc nhóm khoẻ mạnh.\n\n"
             "Hãy trả lời theo đúng cấu trúc:\n\n"
@@ -97,8 +113,7 @@ def _build_prompt_from_detections(detections: List[Dict[str, Any]]) -> str:
         )
 
     # Có bệnh thật
-    disease_counts = Counter(disease_items)
-    lines = [f"- {name}: {cnt} vùng" for name, cnt in disease_counts.items()]
+    lines = [f"- {VN_LABELS.get(key, key)}: {bucket} vùng" for key, bucket in items]
 
     return f"""
 Bạn là chuyên gia bệnh cây bưởi.
@@ -119,53 +134,99 @@ Hãy trả lời theo đúng format:
 
 
 # =====================================================
-# 5. GỌI LLM + TÁCH KẾT QUẢ THÀNH 2 PHẦN
+# 6. GỌI LLM (QUA CACHE) + TÁCH KẾT QUẢ THÀNH 2 PHẦN
 # =====================================================
 
-def summarize_detections_with_llm(
-    detections: List[Dict[str, Any]]
-) -> Tuple[Optional[str], Optional[str]]:
-    """
-    Trả về: (disease_summary, care_instructions)
-    KHÔNG ĐỔI INTERFACE → tránh làm lỗi API detect.
-    """
-
-    if client is None:
-        print("[LLM] Client is None → LLM disabled.")
+def split_llm_sections(full_text: str) -> Tuple[Optional[str], Optional[str]]:
+    """Tách text trả về theo 2 mục [DISEASE_SUMMARY] / [CARE_INSTRUCTIONS]."""
+    full_text = (full_text or "").strip()
+    if not full_text:
         return None, None
 
-    prompt = _build_prompt_from_detections(detections)
+    text_lower = full_text.lower()
 
-    try:
-        # ===== GỌI GEMINI =====
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-        )
+    idx_ds = text_lower.find("[disease_summary]")
+    idx_ci = text_lower.find("[care_instructions]")
 
-        full_text = (response.text or "").strip()
-        if not full_text:
-            return None, None
+    if idx_ds == -1 or idx_ci == -1:
+        # LLM không theo format → return toàn bộ
+        return full_text, None
 
-        # ===== TÁCH HAI PHẦN =====
-        text_lower = full_text.lower()
+    disease_summary = full_text[idx_ds + len("[DISEASE_SUMMARY]"): idx_ci].strip()
+    care_instructions = full_text[idx_ci + len("[CARE_INSTRUCTIONS]"):].strip()
 
-        idx_ds = text_lower.find("[disease_summary]")
-        idx_ci = text_lower.find("[care_instructions]")
+    return disease_summary or None, care_instructions or None
 
-        if idx_ds == -1 or idx_ci == -1:
-            # LLM không theo format → return toàn bộ
-            return full_text, None
 
-        disease_summary = full_text[idx_ds + len("[DISEASE_SUMMARY]"): idx_ci].strip()
-        care_instructions = full_text[idx_ci + len("[CARE_INSTRUCTIONS]"):].strip()
+def _generate_summary(signature: PromptSignature) -> Tuple[Optional[str], Optional[str]]:
+    """Gọi LLM 1 lần cho chữ ký đã chuẩn hoá (lỗi upstream → LLMUnavailableError)."""
+    return split_llm_sections(llm_gateway.generate(_build_prompt(signature)))
 
-        disease_summary = disease_summary or None
-        care_instructions = care_instructions or None
 
-        return disease_summary, care_instructions
+def fallback_summary(signature: PromptSignature) -> Tuple[Optional[str], Optional[str]]:
+    """Text soạn sẵn khi LLM không dùng được (không cache, lần sau gọi lại LLM)."""
+    kind, items = signature
+    if kind == "disease":
+        names = ", ".join(VN_LABELS.get(key, key) for key, _ in items)
+        summary = (
+            f"AI phát hiện dấu hiệu: {names}.\n"
+            "Hệ thống tư vấn tự động đang tạm thời gián đoạn nên chưa có phân tích chi tiết."
+        )
+        care = (
+            "📌 **Trong lúc chờ tư vấn chi tiết:**\n"
+            "- Cách ly / cắt bỏ lá, quả bị bệnh nặng và tiêu huỷ xa vườn.\n"
+            "- Vệ sinh vườn, giữ tán thông thoáng, tránh tưới đẫm lên lá.\n"
+            "- Theo dõi thêm vài ngày và chụp lại ảnh rõ vùng bệnh.\n"
+            "- Nếu bệnh lan nhanh, liên hệ cán bộ kỹ thuật nông nghiệp địa phương."
+        )
+    else:
+        summary = "Chưa phát hiện dấu hiệu bệnh rõ ràng trên ảnh."
+        care = (
+            "- Duy trì tưới, bón phân cân đối và vệ sinh vườn định kỳ.\n"
+            "- Kiểm tra lá non, mặt dưới lá và quả thường xuyên để phát hiện sớm sâu bệnh."
+        )
+    return summary, care
 
-    except Exception as e:
-        # In lỗi chi tiết
-        print("LLM ERROR:", e)
-        return None, None
+
+def summarize_detections_with_status(
+    detections: List[Dict[str, Any]],
+    model_version: str = "",
+) -> Tuple[Optional[str], Optional[str], bool]:
+    """
+    Như summarize_detections_with_llm nhưng trả thêm from_llm:
+    False khi là text dự phòng / LLM tắt → caller không nên cache kết quả.
+    """
+    signature = detection_signature(detections)
+    if not llm_gateway.enabled:
+        print("[LLM] Chưa cấu hình GEMINI_API_KEY → LLM disabled.")
+        return None, None, False
+
+    try:
+        if llm_summary_cache is None:
+            summary = _generate_summary(signature)
+        else:
+            summary = llm_summary_cache.get_or_compute(
+                PROMPT_TEMPLATE_VERSION,
+                signature_cache_key(signature, model_version),
+                lambda: _generate_summary(signature),
+                wait_timeout=settings.STAGE_TIMEOUT_LLM_S,
+            )
+    except (LLMUnavailableError, FutureTimeoutError) as e:
+        print(f"[LLM] Dùng text dự phòng: {e}")
+        return (*fallback_summary(signature), False)
+    return (*summary, any(summary))
+
+
+def summarize_detections_with_llm(
+    detections: List[Dict[str, Any]],
+    model_version: str = "",
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Trả về: (disease_summary, care_instructions)
+    KHÔNG ĐỔI INTERFACE → tránh làm lỗi API detect.
+
+    model_version: version model sinh ra detections (nằm trong key cache).
+    LLM quá tải / lỗi → text soạn sẵn (fallback_summary).
+    """
+    disease_summary, care_instructions, _ = summarize_detections_with_status(detections, model_version)
+    return disease_summary, care_instructions
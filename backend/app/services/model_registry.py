@@ -0,0 +1,356 @@
+# app/services/model_registry.py
+"""
+Registry các model trong ml/exports/<version>/metadata.json.
+
+- Giữ tối đa MODEL_REGISTRY_MAX_LOADED model trong RAM (gỡ model ít dùng nhất,
+  trừ model mặc định và model shadow), kèm ước lượng RAM mỗi model chiếm.
+- Hot-swap: model mới được load + warm-up xong mới đổi con trỏ mặc định.
+  Request đang chạy vẫn giữ reference tới model cũ nên không bị rớt.
+- Shadow: chạy model ứng viên trên 1 tỉ lệ request /detect ở thread riêng
+  và thống kê độ lệch so với model mặc định.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import psutil
+
+from app.core.config import settings
+from app.services.detection_cache_service import detection_cache
+from app.services.inference_service import (
+    EXPORTS_ROOT,
+    MODEL_PATH,
+    MODEL_VERSION,
+    BaseDetector,
+    create_detector,
+    read_model_metadata,
+    warm_up,
+    weights_file,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _rss_bytes() -> int:
+    return psutil.Process().memory_info().rss
+
+
+def discover_versions() -> Dict[str, Dict[str, Any]]:
+    """Quét ml/exports/*/metadata.json → {version: {path, available, metadata}}."""
+    found: Dict[str, Dict[str, Any]] = {}
+    if not os.path.isdir(EXPORTS_ROOT):
+        return found
+
+    for name in sorted(os.listdir(EXPORTS_ROOT)):
+        model_dir = os.path.join(EXPORTS_ROOT, name)
+        if not os.path.isfile(os.path.join(model_dir, "metadata.json")):
+            continue
+        metadata = read_model_metadata(model_dir)
+        path = os.path.join(model_dir, weights_file(metadata, settings.MODEL_VARIANT))
+        found[name] = {
+            "version": name,
+            "path": path,
+            "available": os.path.exists(path),
+            "variants": sorted((metadata.get("variants") or {}).keys()),
+            "metadata": metadata,
+        }
+    return found
+
+
+@dataclass
+class LoadedModel:
+    version: str
+    path: str
+    detector: BaseDetector
+    memory_bytes: int      # RSS tăng thêm khi load (ước lượng, load song song sẽ lệch)
+    load_ms: float
+    warmup_ms: float
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "model_version": self.detector.model_version,
+            "fingerprint": self.detector.fingerprint,
+            "backend": self.detector.backend,
+            "path": self.path,
+            "memory_mb": round(self.memory_bytes / 2**20, 1),
+            "load_ms": round(self.load_ms, 1),
+            "warmup_ms": round(self.warmup_ms, 1),
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, max_loaded: int = 2):
+        self.max_loaded = max(1, int(max_loaded))
+        self._models: Dict[str, LoadedModel] = {}
+        self._default: Optional[str] = None
+        self._lock = threading.Lock()
+        # mỗi version 1 lock load: không load trùng, version khác vẫn load song song
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.swaps_total = 0
+        self.evictions_total = 0
+        self.shadow = ShadowRunner(self, max_pending=settings.MODEL_SHADOW_MAX_PENDING)
+
+    # ============================================
+    # Load / gỡ model
+    # ============================================
+    @staticmethod
+    def _path_for(version: str) -> str:
+        # env MODEL_PATH (nếu có) áp dụng cho version mặc định lúc khởi động
+        if version == MODEL_VERSION:
+            return MODEL_PATH
+        versions = discover_versions()
+        info = versions.get(version)
+        if info is None:
+            # cho phép gọi theo "version" trong metadata.json (có thể khác tên thư mục)
+            info = next((v for v in versions.values() if v["metadata"].get("version") == version), None)
+        if info is None:
+            raise KeyError(f"Không có model version '{version}' trong {EXPORTS_ROOT}")
+        return info["path"]
+
+    def load(self, version: str) -> LoadedModel:
+        with self._lock:
+            loaded = self._models.get(version)
+            if loaded is not None:
+                return loaded
+            load_lock = self._load_locks.setdefault(version, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                loaded = self._models.get(version)
+            if loaded is not None:
+                return loaded
+
+            path = self._path_for(version)
+            rss_before = _rss_bytes()
+            t0 = time.perf_counter()
+            det = create_detector(path)
+            t1 = time.perf_counter()
+            warm_up(det)
+            t2 = time.perf_counter()
+
+            loaded = LoadedModel(
+                version=version,
+                path=path,
+                detector=det,
+                memory_bytes=max(0, _rss_bytes() - rss_before),
+                load_ms=(t1 - t0) * 1000,
+                warmup_ms=(t2 - t1) * 1000,
+            )
+            with self._lock:
+                self._models[version] = loaded
+                self._evict_locked(keep=version)
+
+        logger.info(
+            f"[Registry] Loaded {version} ({det.backend}, ~{loaded.memory_bytes / 2**20:.0f} MB, "
+            f"{loaded.load_ms + loaded.warmup_ms:.0f} ms)"
+        )
+        self._sync_cache()
+        return loaded
+
+    def _evict_locked(self, keep: str) -> None:
+        """Gỡ model ít dùng nhất cho tới khi <= max_loaded (gọi khi đang giữ lock)."""
+        pinned = {keep, self._default, self.shadow.version}
+        while len(self._models) > self.max_loaded:
+            candidates = [m for v, m in self._models.items() if v not in pinned]
+            if not candidates:
+                logger.warning(f"[Registry] {len(self._models)} model đang load, vượt giới hạn {self.max_loaded}")
+                return
+            victim = min(candidates, key=lambda m: m.last_used)
+            del self._models[victim.version]
+            self.evictions_total += 1
+            logger.info(f"[Registry] Gỡ model {victim.version} (ít dùng nhất)")
+
+    def unload(self, version: str) -> bool:
+        with self._lock:
+            if version == self._default:
+                raise ValueError("Không gỡ được model mặc định, hãy đổi model mặc định trước")
+            removed = self._models.pop(version, None) is not None
+        if version == self.shadow.version:
+            self.shadow.configure(None, 0.0)
+        if removed:
+            logger.info(f"[Registry] Gỡ model {version}")
+            self._sync_cache()
+        return removed
+
+    def _sync_cache(self) -> None:
+        if detection_cache is not None:
+            with self._lock:
+                fingerprints = [m.detector.fingerprint for m in self._models.values()]
+            detection_cache.retain(fingerprints)
+
+    # ============================================
+    # Truy cập
+    # ============================================
+    def get(self, version: Optional[str] = None) -> Optional[BaseDetector]:
+        """Detector của `version` (mặc định nếu None) nếu đang load, không tự load."""
+        with self._lock:
+            loaded = self._models.get(version or self._default or "")
+            if loaded is None:
+                return None
+            loaded.last_used = time.time()
+            return loaded.detector
+
+    def default_detector(self) -> Optional[BaseDetector]:
+        with self._lock:
+            loaded = self._models.get(self._default or "")
+            return loaded.detector if loaded is not None else None
+
+    @property
+    def default_version(self) -> Optional[str]:
+        return self._default
+
+    def version_of(self, detector: BaseDetector) -> Optional[str]:
+        """
+        Khoá registry của detector đang load. Khác detector.model_version
+        (vd "v1.0+int8" là tag hiển thị / cache, không dùng để load).
+        """
+        with self._lock:
+            return next((v for v, m in self._models.items() if m.detector is detector), None)
+
+    def set_default(self, version: str) -> LoadedModel:
+        """Hot-swap: load + warm-up trước (ngoài lock), sau đó đổi con trỏ mặc định."""
+        loaded = self.load(version)
+        with self._lock:
+            old = self._default
+            self._default = version
+            if old is not None and old != version:
+                self.swaps_total += 1
+            # model mặc định cũ giờ có thể bị gỡ nếu vượt giới hạn
+            self._evict_locked(keep=version)
+        if old != version:
+            logger.info(f"[Registry] Model mặc định: {old} → {version}")
+            self._sync_cache()
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = [m.info() for m in self._models.values()]
+            total = sum(m.memory_bytes for m in self._models.values())
+            return {
+                "default": self._default,
+                "max_loaded": self.max_loaded,
+                "loaded": models,
+                "memory_mb_total": round(total / 2**20, 1),
+                "swaps_total": self.swaps_total,
+                "evictions_total": self.evictions_total,
+                "shadow": self.shadow.stats(),
+            }
+
+
+class ShadowRunner:
+    """Chạy model shadow trên request được lấy mẫu, ở 1 thread riêng với hàng đợi giới hạn."""
+
+    def __init__(self, registry: ModelRegistry, max_pending: int = 16):
+        self._registry = registry
+        self.version: Optional[str] = None
+        self.sample_rate = 0.0
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self.submitted = 0
+        self.dropped = 0
+        self.errors = 0
+        self.runs = 0
+        self.latency_ms_total = 0.0
+        self.same_count = 0
+        self.same_top_class = 0
+        self.conf_delta_total = 0.0
+        self.conf_delta_n = 0
+
+    def configure(self, version: Optional[str], sample_rate: float) -> None:
+        with self._lock:
+            self.version = version or None
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate))) if version else 0.0
+            self._reset_stats()
+            if self.version and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="model-shadow", daemon=True)
+                self._thread.start()
+        logger.info(f"[Shadow] version={self.version} sample_rate={self.sample_rate}")
+
+    def maybe_submit(self, raw, conf: float, iou: float, primary: Dict[str, Any]) -> bool:
+        """Gọi từ hot path: chỉ random + put_nowait, không bao giờ chặn."""
+        version, rate = self.version, self.sample_rate
+        if not version or rate <= 0 or random.random() >= rate:
+            return False
+        try:
+            self._queue.put_nowait((version, raw, conf, iou, primary))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _run(self) -> None:
+        while True:
+            version, raw, conf, iou, primary = self._queue.get()
+            det = self._registry.get(version)
+            if det is None or version != self.version:
+                continue
+            try:
+                t0 = time.perf_counter()
+                shadow = det.predict_bytes(raw, conf=conf, iou=iou)
+                elapsed_ms = (time.perf_counter() - t0) * 1000
+            except Exception as e:
+                logger.warning(f"[Shadow] {version} lỗi: {e}")
+                with self._lock:
+                    self.errors += 1
+                continue
+            self._compare(primary, shadow, elapsed_ms)
+
+    @staticmethod
+    def _top(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        dets = result.get("detections") or []
+        return max(dets, key=lambda d: d.get("confidence", 0.0)) if dets else None
+
+    def _compare(self, primary: Dict[str, Any], shadow: Dict[str, Any], elapsed_ms: float) -> None:
+        p_top, s_top = self._top(primary), self._top(shadow)
+        with self._lock:
+            self.runs += 1
+            self.latency_ms_total += elapsed_ms
+            if primary.get("num_detections", 0) == shadow.get("num_detections", 0):
+                self.same_count += 1
+            p_cls = p_top.get("class_key") if p_top else None
+            s_cls = s_top.get("class_key") if s_top else None
+            if p_cls == s_cls:
+                self.same_top_class += 1
+                if p_top and s_top:
+                    self.conf_delta_total += abs(p_top["confidence"] - s_top["confidence"])
+                    self.conf_delta_n += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            runs = self.runs
+            return {
+                "version": self.version,
+                "sample_rate": self.sample_rate,
+                "queue_depth": self._queue.qsize(),
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "runs": runs,
+                "avg_latency_ms": round(self.latency_ms_total / runs, 1) if runs else None,
+                "same_num_detections_rate": round(self.same_count / runs, 4) if runs else None,
+                "same_top_class_rate": round(self.same_top_class / runs, 4) if runs else None,
+                "avg_top_conf_delta": (
+                    round(self.conf_delta_total / self.conf_delta_n, 4) if self.conf_delta_n else None
+                ),
+            }
+
+
+# instance dùng chung (mỗi process 1 registry, kể cả worker của process pool)
+registry = ModelRegistry(max_loaded=settings.MODEL_REGISTRY_MAX_LOADED)
@@ -0,0 +1,150 @@
+# app/services/onnx_detector.py
+"""
+Backend ONNX Runtime cho detector (model YOLO export sang .onnx).
+
+Không cần torch/ultralytics: tự letterbox + NMS bằng NumPy và trả về
+đúng format dict như YoloDetector.predict_bytes.
+"""
+import ast
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.inference_service import BaseDetector, DecodedImage
+from app.utils.box_ops import batched_nms, image_size, letterbox, xywh2xyxy
+
+logger = logging.getLogger(__name__)
+
+MAX_DETECTIONS = 300
+
+
+def _names_from_onnx(session) -> Dict[int, str]:
+    """Ultralytics lưu `names` vào metadata của file .onnx dạng "{0: 'a', 1: 'b'}"."""
+    try:
+        raw = session.get_modelmeta().custom_metadata_map.get("names")
+        if raw:
+            return {int(k): str(v) for k, v in ast.literal_eval(raw).items()}
+    except Exception as e:
+        logger.debug(f"[ONNX] Không đọc được names từ metadata: {e}")
+    return {}
+
+
+class OnnxDetector(BaseDetector):
+    backend = "onnx"
+
+    def __init__(
+        self,
+        model_path: str,
+        names: Optional[Dict[int, str]] = None,
+        imgsz: int = 640,
+        providers: Optional[List[str]] = None,
+    ):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found: {model_path}")
+
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=opts,
+            providers=providers or ["CPUExecutionProvider"],
+        )
+
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        # shape: [batch, 3, H, W] – batch/H/W có thể là tên (dynamic) thay vì int
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+        self.imgsz = inp.shape[2] if isinstance(inp.shape[2], int) else imgsz
+
+        self.names = _names_from_onnx(self.session) or dict(names or {})
+        self.decode_size = self.imgsz
+        self._lock = threading.Lock()
+        # buffer input (N, 3, imgsz, imgsz) dùng lại giữa các lần predict,
+        # letterbox ghi thẳng vào đây → không cấp phát tensor mới mỗi request
+        self._input_buf = np.empty((0, 3, self.imgsz, self.imgsz), dtype=np.float32)
+
+    def _input_buffer(self, n: int) -> np.ndarray:
+        """Lấy buffer cho batch n ảnh (chỉ gọi khi đang giữ self._lock)."""
+        if self._input_buf.shape[0] < n:
+            self._input_buf = np.empty((n, 3, self.imgsz, self.imgsz), dtype=np.float32)
+        return self._input_buf[:n]
+
+    # ============================================
+    # Predict
+    # ============================================
+    def predict_rows(
+        self,
+        imgs: List[DecodedImage],
+        conf: float = 0.5,
+        iou: float = 0.5,
+    ) -> List[np.ndarray]:
+        """imgs: PIL RGB hoặc frame ndarray BGR (OpenCV)."""
+        if not imgs:
+            return []
+
+        with self._lock:
+            batch = self._input_buffer(len(imgs))
+            meta = [
+                letterbox(img, self.imgsz, out=batch[i], bgr=isinstance(img, np.ndarray))[1:]
+                for i, img in enumerate(imgs)
+            ]
+            outputs = self._run(batch)
+
+        return [
+            self._postprocess(pred, conf, iou, ratio, pad, *image_size(img))
+            for img, (ratio, pad), pred in zip(imgs, meta, outputs)
+        ]
+
+    def _run(self, batch: np.ndarray) -> List[np.ndarray]:
+        """Chạy session (gọi khi đang giữ lock); model export batch=1 (static) thì chạy từng ảnh."""
+        if self.dynamic_batch:
+            return list(self.session.run(None, {self.input_name: batch})[0])
+        return [
+            self.session.run(None, {self.input_name: batch[i:i + 1]})[0][0]
+            for i in range(len(batch))
+        ]
+
+    def _postprocess(
+        self,
+        pred: np.ndarray,
+        conf: float,
+        iou: float,
+        ratio: float,
+        pad: tuple,
+        orig_w: int,
+        orig_h: int,
+    ) -> np.ndarray:
+        """
+        pred: (4 + num_classes, num_anchors) như output YOLOv8.
+        Trả về mảng (N, 6): x1, y1, x2, y2, conf, class_id theo toạ độ ảnh gốc.
+        """
+        pred = pred.T  # (anchors, 4 + nc)
+        cls_scores = pred[:, 4:]
+        class_ids = cls_scores.argmax(axis=1)
+        scores = cls_scores[np.arange(len(class_ids)), class_ids]
+
+        mask = scores >= conf
+        if not mask.any():
+            return np.empty((0, 6), dtype=np.float32)
+
+        boxes = xywh2xyxy(pred[mask, :4])
+        scores = scores[mask]
+        class_ids = class_ids[mask]
+
+        keep = batched_nms(boxes, scores, class_ids, iou)[:MAX_DETECTIONS]
+        boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+        # Bỏ padding + scale về ảnh gốc
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_h)
+
+        return np.concatenate(
+            [boxes, scores[:, None], class_ids[:, None].astype(boxes.dtype)], axis=1
+        )
@@ -0,0 +1,220 @@
+# app/services/scan_context_service.py
+"""
+Nạp ngữ cảnh cho auto-detection (cảm biến 24h + lịch sử bệnh 7 ngày + thiết bị)
+bằng ít truy vấn nhất:
+
+- cảm biến: GROUP BY device_id, metric (avg/min/max/count tính trong DB,
+  dùng index idx_sr_device_time) thay vì kéo toàn bộ reading về Python
+- lịch sử: 1 truy vấn detections JOIN img LEFT JOIN diseases (hết N+1 det.disease),
+  nhiều thiết bị thì cắt 50 dòng / thiết bị bằng ROW_NUMBER()
+- load_scan_contexts(): cùng các truy vấn trên cho nhiều camera 1 lượt (scheduler)
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.devices import Device
+from app.models.image_detection import Detection, Disease, Img
+from app.models.sensor_readings import SensorReadings
+
+SENSOR_HOURS = 24
+HISTORY_DAYS = 7
+HISTORY_LIMIT = 50
+BATCH_SIZE = 500   # số device tối đa trong 1 mệnh đề IN
+
+NON_DISEASE_NAMES = ['Không xác định', 'pomelo_leaf_healthy', 'pomelo_fruit_healthy']
+
+
+@dataclass
+class ScanContext:
+    device_id: int
+    device: Optional[Device] = None
+    sensor_data: Dict[str, Any] = field(default_factory=dict)
+    recent_detections: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def trend_info(self) -> Dict[str, Any]:
+        return analyze_disease_trend(self.recent_detections)
+
+
+def _chunks(ids: List[int]) -> Iterable[List[int]]:
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+
+# =====================================================
+# Cảm biến
+# =====================================================
+def load_sensor_summaries(db: Session, device_ids: List[int], hours: int = SENSOR_HOURS) -> Dict[int, Dict[str, Any]]:
+    """{device_id: {metric: {avg, min, max, unit, count}}} — chỉ reading status="ok" có giá trị."""
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+    result: Dict[int, Dict[str, Any]] = {}
+    for chunk in _chunks(device_ids):
+        rows = (
+            db.query(
+                SensorReadings.device_id,
+                SensorReadings.metric,
+                func.avg(SensorReadings.value_num),
+                func.min(SensorReadings.value_num),
+                func.max(SensorReadings.value_num),
+                func.count(SensorReadings.value_num),
+                func.max(SensorReadings.unit),
+            )
+            .filter(
+                SensorReadings.device_id.in_(chunk),
+                SensorReadings.recorded_at >= cutoff_time,
+                SensorReadings.status == "ok",
+                SensorReadings.value_num.isnot(None),
+            )
+            .group_by(SensorReadings.device_id, SensorReadings.metric)
+            .all()
+        )
+        for device_id, metric, avg, vmin, vmax, count, unit in rows:
+            result.setdefault(device_id, {})[metric] = {
+                'avg': float(avg),
+                'min': float(vmin),
+                'max': float(vmax),
+                'unit': unit,
+                'count': int(count),
+            }
+    return result
+
+
+# =====================================================
+# Lịch sử phát hiện
+# =====================================================
+def _detection_row(disease_name, confidence, created_at) -> Dict[str, Any]:
+    return {
+        'disease_name': disease_name,
+        'confidence': float(confidence) if confidence else 0.0,
+        'created_at': created_at,
+    }
+
+
+def load_recent_detections(
+    db: Session,
+    device_ids: List[int],
+    days: int = HISTORY_DAYS,
+    limit: int = HISTORY_LIMIT,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """{device_id: [detection mới → cũ]}, tối đa `limit` dòng mỗi device."""
+    cutoff_time = datetime.utcnow() - timedelta(days=days)
+    result: Dict[int, List[Dict[str, Any]]] = {}
+
+    base = (
+        db.query(
+            Img.device_id.label("device_id"),
+            Disease.name.label("disease_name"),
+            Detection.confidence.label("confidence"),
+            Detection.created_at.label("created_at"),
+        )
+        .select_from(Detection)
+        .join(Img, Img.img_id == Detection.img_id)
+        .outerjoin(Disease, Disease.disease_id == Detection.disease_id)
+        .filter(Detection.created_at >= cutoff_time)
+    )
+
+    if len(device_ids) == 1:
+        rows = (
+            base.filter(Img.device_id == device_ids[0])
+            .order_by(Detection.created_at.desc())
+            .limit(limit)
+            .all()
+        )
+        result[device_ids[0]] = [_detection_row(r.disease_name, r.confidence, r.created_at) for r in rows]
+        return result
+
+    for chunk in _chunks(device_ids):
+        ranked = (
+            base.add_columns(
+                func.row_number().over(
+                    partition_by=Img.device_id,
+                    order_by=Detection.created_at.desc(),
+                ).label("rn")
+            )
+            .filter(Img.device_id.in_(chunk))
+            .subquery()
+        )
+        rows = (
+            db.query(ranked.c.device_id, ranked.c.disease_name, ranked.c.confidence, ranked.c.created_at)
+            .filter(ranked.c.rn <= limit)
+            .order_by(ranked.c.device_id, ranked.c.rn)
+            .all()
+        )
+        for device_id, disease_name, confidence, created_at in rows:
+            result.setdefault(device_id, []).append(_detection_row(disease_name, confidence, created_at))
+    return result
+
+
+def analyze_disease_trend(recent_detections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not recent_detections:
+        return {'has_history': False, 'trend': 'no_data'}
+
+    disease_counts = Counter()
+    disease_confidences = {}
+
+    for det in recent_detections:
+        disease_name = det.get('disease_name')
+        if disease_name and disease_name not in NON_DISEASE_NAMES:
+            disease_counts[disease_name] += 1
+            disease_confidences.setdefault(disease_name, []).append(det.get('confidence', 0.0))
+
+    disease_avg_conf = {k: sum(v)/len(v) for k, v in disease_confidences.items() if v}
+
+    if disease_counts:
+        most_common = disease_counts.most_common(1)[0]
+        trend = 'increasing' if most_common[1] >= 3 else 'stable'
+        return {
+            'has_history': True,
+            'trend': trend,
+            'most_common_disease': most_common[0],
+            'occurrence_count': most_common[1],
+            'avg_confidence': disease_avg_conf.get(most_common[0], 0.0),
+            'all_diseases': dict(disease_counts)
+        }
+    else:
+        return {'has_history': True, 'trend': 'healthy', 'most_common_disease': None}
+
+
+# =====================================================
+# Ngữ cảnh đầy đủ
+# =====================================================
+def load_scan_contexts(
+    db: Session,
+    device_ids: List[int],
+    with_devices: bool = False,
+) -> Dict[int, ScanContext]:
+    """
+    Ngữ cảnh cho nhiều camera: 3 truy vấn cho cả lô (thiết bị, cảm biến, lịch sử)
+    thay vì ~3 truy vấn + N lazy-load cho mỗi camera.
+    with_devices: nạp luôn Device (dùng được sau khi session đóng, chỉ đọc cột).
+    """
+    device_ids = list(dict.fromkeys(device_ids))
+    if not device_ids:
+        return {}
+
+    sensors = load_sensor_summaries(db, device_ids)
+    history = load_recent_detections(db, device_ids)
+    devices: Dict[int, Device] = {}
+    if with_devices:
+        for chunk in _chunks(device_ids):
+            for dev in db.query(Device).filter(Device.device_id.in_(chunk)).all():
+                devices[dev.device_id] = dev
+
+    return {
+        device_id: ScanContext(
+            device_id=device_id,
+            device=devices.get(device_id),
+            sensor_data=sensors.get(device_id, {}),
+            recent_detections=history.get(device_id, []),
+        )
+        for device_id in device_ids
+    }
+
+
+def load_scan_context(db: Session, device_id: int) -> ScanContext:
+    return load_scan_contexts(db, [device_id])[device_id]
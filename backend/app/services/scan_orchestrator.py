@@ -0,0 +1,267 @@
+# app/services/scan_orchestrator.py
+"""
+Quét tự động toàn bộ camera trong 1 lượt (scheduler gọi run()).
+
+- Mỗi camera chạy trong pool giới hạn SCAN_MAX_CONCURRENCY thread, có DB
+  session riêng và ngân sách SCAN_DEVICE_TIMEOUT_S (hết hạn → ngừng chụp
+  thêm, bỏ bước LLM còn lại).
+- Frame của mọi camera đi qua batch engine dùng chung → các camera chụp
+  xong cùng lúc được gom vào 1 lần model.predict.
+- Thiết bị + cảm biến + lịch sử bệnh của cả lượt nạp sẵn theo lô
+  (scan_context_service) thay vì vài truy vấn cho mỗi camera.
+- Không cho 2 lượt quét chạy chồng nhau (lượt sau bị bỏ, ghi vào stats).
+- Lượt quét quá SCAN_RUN_TIMEOUT_S: camera chưa bắt đầu bị huỷ (skip),
+  camera đang chạy bị ghi là timeout.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.device_type import DeviceType
+from app.models.devices import Device
+from app.services.auto_detection_service import detect_from_camera_auto
+from app.services.scan_context_service import ScanContext, load_scan_contexts
+
+logger = logging.getLogger(__name__)
+
+
+def active_camera_ids() -> List[int]:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Device.device_id)
+            .join(DeviceType)
+            .filter(
+                DeviceType.has_stream == True,  # noqa: E712
+                Device.status == "active",
+                Device.stream_url.isnot(None),
+                Device.stream_url != "",
+            )
+            .order_by(Device.device_id)
+            .all()
+        )
+        return [r[0] for r in rows]
+    finally:
+        db.close()
+
+
+def _make_predict(deadline: float):
+    """Frame → batch engine (gom với frame của camera khác); không có batcher → None (detector tự chạy)."""
+    from app.services.batch_inference_service import get_batch_engine
+
+    engine = get_batch_engine()
+    if engine is None:
+        return None
+
+    def predict(frame):
+        return engine.predict(frame, timeout=max(1.0, deadline - time.monotonic()))
+
+    return predict
+
+
+class ScanOrchestrator:
+    def __init__(self):
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.current: Optional[Dict[str, Any]] = None
+
+        self.runs = 0
+        self.overlap_rejected = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._run_lock.locked()
+
+    # ============================================
+    # 1 camera
+    # ============================================
+    def scan_device(self, device_id: int, num_images: int, context: Optional[ScanContext] = None) -> Dict[str, Any]:
+        started = time.monotonic()
+        deadline = started + settings.SCAN_DEVICE_TIMEOUT_S
+        db = SessionLocal()
+        try:
+            device = context.device if context is not None and context.device is not None else (
+                db.query(Device).filter(Device.device_id == device_id).first()
+            )
+            if device is None:
+                return {"device_id": device_id, "status": "skipped", "reason": "device_not_found"}
+            if not device.user_id:
+                return {"device_id": device_id, "status": "skipped", "reason": "no_owner"}
+
+            # không dừng stream: HLS đang chạy vừa là live view của người xem vừa là nguồn
+            # latest.jpg cho lần quét sau; stream không ai xem đã có ffmpeg_supervisor dừng
+            result = detect_from_camera_auto(
+                db, device, num_images=num_images, predict=_make_predict(deadline), deadline=deadline,
+                context=context, auto_stop_stream=False,
+            )
+            elapsed = time.monotonic() - started
+
+            if result.get("skipped"):
+                status, reason = "skipped", result.get("skip_reason")
+            elif not result.get("success"):
+                status, reason = "failed", result.get("error")
+            elif elapsed > settings.SCAN_DEVICE_TIMEOUT_S:
+                status, reason = "timeout", f"vượt ngân sách {settings.SCAN_DEVICE_TIMEOUT_S:.0f}s"
+            else:
+                status, reason = "ok", None
+
+            if result.get("has_disease"):
+                logger.warning(f"[Scan] ⚠️ Camera {device_id}: Phát hiện bệnh!")
+            return {
+                "device_id": device_id,
+                "status": status,
+                "reason": reason,
+                "has_disease": bool(result.get("has_disease")),
+                "detections_count": result.get("detections_count", 0),
+                # đã lưu Detection + gửi thông báo → không được quét lại (kể cả khi timeout)
+                "saved": bool(result.get("saved_result")),
+                "elapsed_ms": round(elapsed * 1000, 1),
+            }
+        except Exception as e:
+            logger.error(f"[Scan] Lỗi khi quét camera {device_id}: {e}", exc_info=True)
+            return {"device_id": device_id, "status": "failed", "reason": str(e),
+                    "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+        finally:
+            db.close()
+
+    # ============================================
+    # 1 lượt quét
+    # ============================================
+    def run(self, num_images: int = 3, trigger: str = "scheduler",
+            device_ids: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Quét mọi camera active (hoặc device_ids do lịch thích ứng chọn), trả về
+        báo cáo lượt quét (None nếu lượt trước chưa xong).
+        """
+        if not self._run_lock.acquire(blocking=False):
+            with self._stats_lock:
+                self.overlap_rejected += 1
+            logger.warning("[Scan] Lượt quét trước chưa xong, bỏ qua lượt này")
+            return None
+
+        try:
+            started_at = datetime.utcnow()
+            t0 = time.monotonic()
+            if device_ids is None:
+                device_ids = active_camera_ids()
+            self.current = {"started_at": started_at.isoformat(), "trigger": trigger, "devices_total": len(device_ids)}
+            logger.info(f"[Scan] Bắt đầu quét {len(device_ids)} camera ({trigger})...")
+
+            results: List[Dict[str, Any]] = []
+            if device_ids:
+                pool = ThreadPoolExecutor(
+                    max_workers=min(settings.SCAN_MAX_CONCURRENCY, len(device_ids)),
+                    thread_name_prefix="scan",
+                )
+                contexts = self._prefetch(device_ids)
+                futures = {
+                    pool.submit(self.scan_device, d, num_images, contexts.get(d)): d for d in device_ids
+                }
+                done, not_done = wait(futures, timeout=settings.SCAN_RUN_TIMEOUT_S)
+                results.extend(f.result() for f in done)
+                for f in not_done:
+                    device_id = futures[f]
+                    if f.cancel():
+                        results.append({"device_id": device_id, "status": "skipped", "reason": "run_timeout"})
+                    else:
+                        results.append({"device_id": device_id, "status": "timeout", "reason": "run_timeout"})
+                # không chờ thread đang kẹt (capture / LLM đều có timeout riêng và sẽ tự kết thúc)
+                pool.shutdown(wait=False, cancel_futures=True)
+
+            report = self._report(started_at, time.monotonic() - t0, trigger, results)
+            logger.info(
+                f"[Scan] Hoàn thành {report['devices_total']} camera trong {report['duration_s']}s "
+                f"(ok={report['succeeded']}, lỗi={report['failed']}, bỏ qua={len(report['skipped'])}, "
+                f"timeout={report['timed_out']})"
+            )
+            with self._stats_lock:
+                self.runs += 1
+                self.last_run = report
+            return report
+        finally:
+            self.current = None
+            self._run_lock.release()
+
+    @staticmethod
+    def _prefetch(device_ids: List[int]) -> Dict[int, ScanContext]:
+        db = SessionLocal()
+        try:
+            return load_scan_contexts(db, device_ids, with_devices=True)
+        except Exception as e:
+            # mỗi camera tự nạp ngữ cảnh của mình
+            logger.warning(f"[Scan] Không nạp được ngữ cảnh theo lô: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def enqueue_run(self, num_images: int = 3, slot: Optional[str] = None,
+                    device_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        JOB_QUEUE_ENABLED: thay vì quét trong process này, tạo 1 job "scan.device"
+        mỗi camera cho worker (app/worker.py). Key idempotent theo camera + lượt
+        (slot = giờ quét) → nhiều process cùng chạy scheduler vẫn chỉ quét 1 lần.
+        """
+        from app.services.job_queue_service import job_queue
+
+        slot = slot or datetime.utcnow().strftime("%Y%m%dT%H")
+        created = 0
+        if device_ids is None:
+            device_ids = active_camera_ids()
+        for device_id in device_ids:
+            _, is_new = job_queue.enqueue(
+                "scan.device",
+                {"device_id": device_id, "num_images": num_images},
+                idempotency_key=f"scan:{device_id}:{slot}",
+            )
+            created += int(is_new)
+        logger.info(f"[Scan] Lượt {slot}: đưa {created}/{len(device_ids)} camera vào hàng đợi")
+        return {"slot": slot, "devices_total": len(device_ids), "enqueued": created}
+
+    @staticmethod
+    def _report(started_at: datetime, duration: float, trigger: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        by_status: Dict[str, List[Dict[str, Any]]] = {}
+        for r in results:
+            by_status.setdefault(r["status"], []).append(r)
+        scanned = [r for r in results if r["status"] != "skipped"]
+        ok = by_status.get("ok", [])
+        elapsed = sorted(r["elapsed_ms"] for r in results if r.get("elapsed_ms") is not None)
+        return {
+            "trigger": trigger,
+            "started_at": started_at.isoformat(),
+            "duration_s": round(duration, 2),
+            "devices_total": len(results),
+            "succeeded": len(ok),
+            "failed": len(by_status.get("failed", [])),
+            "timed_out": len(by_status.get("timeout", [])),
+            "success_rate": round(len(ok) / len(scanned), 4) if scanned else None,
+            "with_disease": sum(1 for r in ok if r.get("has_disease")),
+            "device_p50_ms": elapsed[len(elapsed) // 2] if elapsed else None,
+            "device_max_ms": elapsed[-1] if elapsed else None,
+            "skipped": [
+                {"device_id": r["device_id"], "reason": r.get("reason")} for r in by_status.get("skipped", [])
+            ],
+            "errors": [
+                {"device_id": r["device_id"], "status": r["status"], "reason": r.get("reason")}
+                for r in by_status.get("failed", []) + by_status.get("timeout", [])
+            ],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "running": self.running,
+                "current": self.current,
+                "runs": self.runs,
+                "overlap_rejected": self.overlap_rejected,
+                "max_concurrency": settings.SCAN_MAX_CONCURRENCY,
+                "last_run": self.last_run,
+            }
+
+
+scan_orchestrator = ScanOrchestrator()
@@ -1,116 +1,91 @@
-# # app/services/scheduler_service.py
-# """
-# Scheduler để tự động quét ảnh từ camera 2 lần/ngày
-# """
-# from apscheduler.triggers.interval import IntervalTrigger
-# from apscheduler.schedulers.background import BackgroundScheduler
-# from apscheduler.triggers.cron import CronTrigger
-# from sqlalchemy.orm import Session
-# from app.core.database import SessionLocal
-# from app.models.devices import Device
-# from app.models.device_type import DeviceType
-# from app.services.auto_detection_service import detect_from_camera_auto
-# import logging
+# app/services/scheduler_service.py
+"""
+Scheduler để tự động quét ảnh từ camera.
 
-# logger = logging.getLogger(__name__)
+Chỉ chạy khi AUTO_SCAN_ENABLED=True. Việc quét do scan_orchestrator đảm nhận
+(song song có giới hạn, batch inference, ngân sách thời gian mỗi camera).
+- AUTO_SCAN_MODE="fixed"   : quét mọi camera vào các giờ AUTO_SCAN_HOURS (mặc định 8:00 và 18:00)
+- AUTO_SCAN_MODE="adaptive": mỗi AUTO_SCAN_TICK_S quét các camera đến hạn theo rủi ro (adaptive_scan_service)
+"""
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from app.core.config import settings
+from app.services.scan_orchestrator import scan_orchestrator
+import logging
 
-# scheduler = BackgroundScheduler()
+logger = logging.getLogger(__name__)
 
-# def scan_all_cameras():
-#     """
-#     Quét tất cả camera có stream_url và status = 'active'
-#     """
-#     db: Session = SessionLocal()
-#     try:
-#         # Lấy tất cả devices có camera (has_stream = True) và status = 'active'
-#         devices = db.query(Device).join(DeviceType).filter(
-#             DeviceType.has_stream == True,
-#             Device.status == 'active',
-#             Device.stream_url.isnot(None),
-#             Device.stream_url != ''
-#         ).all()
-        
-#         logger.info(f"[Scheduler] Bắt đầu quét {len(devices)} camera...")
-        
-#         for device in devices:
-#             try:
-#                 logger.info(f"[Scheduler] Quét camera: {device.name} (ID: {device.device_id})")
-#                 result = detect_from_camera_auto(db, device, num_images=3)
-                
-#                 if result.get('success'):
-#                     logger.info(f"[Scheduler] ✓ Camera {device.device_id}: {result.get('detections_count', 0)} detections")
-#                     if result.get('has_disease'):
-#                         logger.warning(f"[Scheduler] ⚠️ Camera {device.device_id}: Phát hiện bệnh!")
-#                 else:
-#                     logger.error(f"[Scheduler] ✗ Camera {device.device_id}: {result.get('error', 'Unknown error')}")
-#             except Exception as e:
-#                 logger.error(f"[Scheduler] Lỗi khi quét camera {device.device_id}: {e}", exc_info=True)
-        
-#         logger.info(f"[Scheduler] Hoàn thành quét {len(devices)} camera")
-#     except Exception as e:
-#         logger.error(f"[Scheduler] Lỗi khi quét cameras: {e}", exc_info=True)
-#     finally:
-#         db.close()
+scheduler = BackgroundScheduler()
 
-# # def start_scheduler():
-# #     """
-# #     Khởi động scheduler với 2 lần quét mỗi ngày:
-# #     - 8:00 sáng
-# #     - 18:00 chiều
-# #     """
-# #     if scheduler.running:
-# #         logger.warning("[Scheduler] Scheduler đã chạy rồi!")
-# #         return
-    
-# #     # Thêm job quét vào 8:00 sáng mỗi ngày
-# #     scheduler.add_job(
-# #         scan_all_cameras,
-# #         trigger=CronTrigger(hour=8, minute=0),
-# #         id='morning_scan',
-# #         name='Quét camera buổi sáng (8:00)',
-# #         replace_existing=True
-# #     )
-    
-# #     # Thêm job quét vào 18:00 chiều mỗi ngày
-# #     scheduler.add_job(
-# #         scan_all_cameras,
-# #         trigger=CronTrigger(hour=18, minute=0),
-# #         id='evening_scan',
-# #         name='Quét camera buổi chiều (18:00)',
-# #         replace_existing=True
-# #     )
-    
-# #     scheduler.start()
-# #     logger.info("[Scheduler] Đã khởi động scheduler - Quét camera 2 lần/ngày (8:00 và 18:00)")
+def scan_all_cameras():
+    """
+    Quét tất cả camera có stream_url và status = 'active'
+    """
+    try:
+        if settings.JOB_QUEUE_ENABLED:
+            # quét ở worker riêng (python -m app.worker), API chỉ tạo job
+            scan_orchestrator.enqueue_run(num_images=settings.AUTO_SCAN_NUM_IMAGES)
+        else:
+            scan_orchestrator.run(num_images=settings.AUTO_SCAN_NUM_IMAGES, trigger="scheduler")
+    except Exception as e:
+        logger.error(f"[Scheduler] Lỗi khi quét cameras: {e}", exc_info=True)
 
-# def start_scheduler():
-#     if scheduler.running:
-#         logger.warning("[Scheduler] Scheduler đã chạy rồi!")
-#         return
+def adaptive_tick():
+    """Quét các camera đến hạn theo lịch thích ứng."""
+    from app.services.adaptive_scan_service import adaptive_scheduler
 
-#     # ✅ TEST: quét mỗi 15 giây
-#     scheduler.add_job(
-#         scan_all_cameras,
-#         trigger=IntervalTrigger(seconds=30),
-#         id='test_scan_every_15s',
-#         name='[TEST] Quét camera mỗi 15s',
-#         replace_existing=True,
-#         max_instances=1,
-#         coalesce=True,
-#         misfire_grace_time=15,
-#     )
+    try:
+        adaptive_scheduler.tick()
+    except Exception as e:
+        logger.error(f"[Scheduler] Lỗi khi chạy lịch quét thích ứng: {e}", exc_info=True)
 
-#     scheduler.start()
-#     logger.info("[Scheduler] Đã khởi động scheduler - TEST mỗi 15s")
+def start_scheduler():
+    """
+    Khởi động scheduler theo AUTO_SCAN_MODE.
+    """
+    if not settings.AUTO_SCAN_ENABLED:
+        logger.info("[Scheduler] AUTO_SCAN_ENABLED=False → không quét camera tự động")
+        return
 
+    if scheduler.running:
+        logger.warning("[Scheduler] Scheduler đã chạy rồi!")
+        return
 
-#     scheduler.start()
-#     logger.info("[Scheduler] Đã khởi động scheduler - TEST mỗi 1 phút")
+    if settings.AUTO_SCAN_MODE == "adaptive":
+        scheduler.add_job(
+            adaptive_tick,
+            trigger=IntervalTrigger(seconds=settings.AUTO_SCAN_TICK_S),
+            id='camera_scan_adaptive',
+            name='Quét camera theo rủi ro',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=int(settings.AUTO_SCAN_TICK_S),
+        )
+        scheduler.start()
+        logger.info(f"[Scheduler] Đã khởi động scheduler - Lịch quét thích ứng, tick mỗi {settings.AUTO_SCAN_TICK_S:.0f}s")
+        return
 
-# def stop_scheduler():
-#     """
-#     Dừng scheduler
-#     """
-#     if scheduler.running:
-#         scheduler.shutdown()
-#         logger.info("[Scheduler] Đã dừng scheduler")
+    scheduler.add_job(
+        scan_all_cameras,
+        trigger=CronTrigger(hour=settings.AUTO_SCAN_HOURS, minute=0),
+        id='camera_scan',
+        name=f'Quét camera ({settings.AUTO_SCAN_HOURS}h)',
+        replace_existing=True,
+        # lượt trước chưa xong thì bỏ lượt này (scan_orchestrator cũng tự chặn chạy chồng)
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=300,
+    )
+
+    scheduler.start()
+    logger.info(f"[Scheduler] Đã khởi động scheduler - Quét camera lúc {settings.AUTO_SCAN_HOURS}h mỗi ngày")
+
+def stop_scheduler():
+    """
+    Dừng scheduler
+    """
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+        logger.info("[Scheduler] Đã dừng scheduler")
@@ -0,0 +1,105 @@
+# app/services/stream_probe.py
+"""
+Dò codec nguồn camera bằng ffprobe để chọn cách tạo HLS:
+
+- "copy"     : nguồn H.264 (profile / pixel format / độ phân giải trình duyệt phát được)
+               → remux `-c:v copy`, không encode lại (rẻ hơn ~1 core mỗi camera)
+- "transcode": còn lại (H.265, MJPEG, profile lạ, quá lớn...) → libx264 như trước,
+               nguồn MJPEG thu nhỏ về tối đa STREAM_MJPEG_MAX_WIDTH
+
+Kết quả ffprobe cache theo URL (STREAM_PROBE_TTL_S); ffprobe lỗi / không có → transcode.
+"""
+import json
+import logging
+import subprocess
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# profile H.264 mà hls.js / Safari / ExoPlayer đều phát được
+COPY_PROFILES = {"baseline", "constrained baseline", "main", "high"}
+COPY_PIX_FMTS = {"yuv420p", "yuvj420p"}
+
+_probe_cache = TTLCache(maxsize=256, ttl=settings.STREAM_PROBE_TTL_S)
+
+
+@dataclass
+class VideoPlan:
+    mode: str                       # "copy" | "transcode"
+    reason: str
+    source: Optional[Dict[str, Any]] = None
+    max_width: Optional[int] = None  # transcode: thu nhỏ nếu rộng hơn
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "reason": self.reason, "source": self.source, "max_width": self.max_width}
+
+
+def probe_video(url: str) -> Optional[Dict[str, Any]]:
+    """codec_name / profile / width / height / pix_fmt của luồng video đầu tiên (None nếu lỗi)."""
+    cached = _probe_cache.get(url)
+    if cached is not None:
+        return cached
+
+    cmd = ["ffprobe", "-v", "error"]
+    if url.lower().startswith("rtsp://"):
+        cmd += ["-rtsp_transport", "tcp"]
+    cmd += [
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,width,height,pix_fmt,avg_frame_rate",
+        "-of", "json",
+        url,
+    ]
+    try:
+        out = subprocess.run(
+            cmd, capture_output=True, timeout=settings.STREAM_PROBE_TIMEOUT_S, check=True
+        ).stdout
+        streams = json.loads(out or b"{}").get("streams") or []
+    except FileNotFoundError:
+        logger.warning("[StreamProbe] ffprobe not found, luôn transcode")
+        return None
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError, ValueError) as e:
+        logger.warning(f"[StreamProbe] Không dò được codec {url}: {type(e).__name__}")
+        return None
+
+    if not streams:
+        return None
+    info = streams[0]
+    _probe_cache.set(url, info)
+    return info
+
+
+def plan_video(url: str) -> VideoPlan:
+    """Chọn remux hay transcode cho nguồn camera."""
+    if not url.lower().startswith("rtsp://"):
+        # DroidCam / HTTP MJPEG: luôn phải encode, chỉ giới hạn độ phân giải
+        return VideoPlan("transcode", "mjpeg_source", max_width=settings.STREAM_MJPEG_MAX_WIDTH or None)
+    if not settings.STREAM_PASSTHROUGH_ENABLED:
+        return VideoPlan("transcode", "passthrough_disabled")
+
+    info = probe_video(url)
+    if info is None:
+        return VideoPlan("transcode", "probe_failed")
+
+    codec = (info.get("codec_name") or "").lower()
+    profile = (info.get("profile") or "").lower()
+    pix_fmt = (info.get("pix_fmt") or "").lower()
+    width, height = int(info.get("width") or 0), int(info.get("height") or 0)
+
+    if codec != "h264":
+        reason = f"codec_{codec or 'unknown'}"
+    elif profile not in COPY_PROFILES:
+        reason = f"profile_{profile.replace(' ', '_') or 'unknown'}"
+    elif pix_fmt and pix_fmt not in COPY_PIX_FMTS:
+        reason = f"pix_fmt_{pix_fmt}"
+    elif width > settings.STREAM_COPY_MAX_WIDTH or height > settings.STREAM_COPY_MAX_HEIGHT:
+        reason = f"resolution_{width}x{height}"
+    else:
+        return VideoPlan("copy", "h264_compatible", source=info)
+
+    # transcode vì độ phân giải quá lớn → thu nhỏ luôn về giới hạn copy
+    max_width = settings.STREAM_COPY_MAX_WIDTH if reason.startswith("resolution") else None
+    return VideoPlan("transcode", reason, source=info, max_width=max_width)
@@ -1,16 +1,19 @@
-import subprocess
 import os
-import threading
 from typing import Optional
 from pathlib import Path
 import shutil
 import logging
+import hashlib
+import time
+
+from app.core.config import settings
+from app.services.ffmpeg_supervisor import SupervisorFullError, ffmpeg_supervisor
+from app.services.stream_probe import VideoPlan, plan_video
 
 logger = logging.getLogger(__name__)
 
-_procs = {}  # {device_id: {'proc': Popen, 'rtsp_url': str, 'log_file': file_obj}}
-_temp_procs = {}  # {key: {'proc': Popen, 'rtsp_url': str, 'log_file': file_obj}}
-_lock = threading.Lock()
+# Tiến trình ffmpeg do ffmpeg_supervisor giữ, khoá = tên thư mục HLS ("<device_id>", "temp-<key>")
+_plans = {}  # {key: VideoPlan} — remux hay transcode cho stream đang chạy
 
 HLS_ROOT = Path("media/hls")
 HLS_ROOT.mkdir(parents=True, exist_ok=True)
@@ -36,291 +39,236 @@ def hls_url_for_temp(key: str) -> str:
     return f"/media/hls/temp-{key}/index.m3u8"
 
 
-def start_stream(device_id: int, rtsp_url: str) -> Optional[str]:
-    """Start ffmpeg to transcode RTSP -> HLS for the given device.
-    Returns HLS index path (relative) or None on failure.
-    
-    ✅ FIX: 
-    - Cleanup old process if RTSP URL changed
-    - Store log_file handle để close properly
+# ===== Frame cho detection từ chính tiến trình ffmpeg đang phát HLS =====
+SNAPSHOT_NAME = "latest.jpg"
+
+
+def snapshot_output_args(path: str) -> list:
+    """Output thứ 2 cho ffmpeg: JPEG STREAM_SNAPSHOT_FPS ảnh/giây ghi đè vào `path`.
+
+    Dùng chung frame đã decode cho HLS → detection không mở thêm kết nối camera
+    và không decode lại segment .ts.
     """
-    with _lock:
-        if device_id in _procs:
-            proc_info = _procs[device_id]
-            old_rtsp = proc_info.get('rtsp_url')
-            
-            # ✅ Nếu RTSP URL thay đổi → stop stream cũ, start mới
-            if old_rtsp != rtsp_url:
-                logger.info(f"[Stream] Device {device_id}: RTSP URL changed, stopping old stream")
-                _cleanup_proc(device_id)
-            else:
-                # RTSP URL không đổi, check process
-                proc = proc_info['proc']
-                if proc.poll() is not None:
-                    logger.info(f"[Stream] Device {device_id}: Old process died, restarting...")
-                    _cleanup_proc(device_id)
-                else:
-                    # Process đang chạy, RTSP URL không đổi → return HLS hiện tại
-                    logger.debug(f"[Stream] Device {device_id}: Stream already running")
-                    return hls_url_for(device_id)
-
-        out_dir = _hls_dir(device_id)
-        index_path = out_dir / "index.m3u8"
-
-        # ffmpeg command: re-encode to H.264 + AAC and produce short HLS segments
-        cmd = ["ffmpeg", "-y"]
-        url_lower = rtsp_url.lower()
-        if url_lower.startswith('rtsp://'):
-            cmd += ["-rtsp_transport", "tcp"]
-        else:
-            # DroidCam / HTTP MJPEG streams need explicit demuxer
-            cmd += ["-f", "mjpeg", "-analyzeduration", "0", "-probesize", "32"]
-        cmd += [
-            "-i", rtsp_url,
-            "-c:v",
-            "libx264",
-            "-preset",
-            "veryfast",
-            "-g",
-            "50",
-            "-sc_threshold",
-            "0",
-            "-an",
-            "-f",
-            "hls",
-            "-hls_time",
-            "2",
-            "-hls_list_size",
-            "6",
-            "-hls_flags",
-            "independent_segments+append_list",
-            "-hls_segment_filename",
-            "segment_%03d.ts",
-            "index.m3u8",
-        ]
+    if not settings.STREAM_SNAPSHOT_ENABLED:
+        return []
+    return [
+        "-an",
+        "-vf", f"fps={settings.STREAM_SNAPSHOT_FPS}",
+        "-q:v", "4",
+        "-f", "image2",
+        "-update", "1",
+        path,
+    ]
+
+
+def session_id_for_url(url: str) -> str:
+    """Thư mục HLS của /stream/hls?mjpeg_url=... (routes_stream) đặt theo md5 URL."""
+    return hashlib.md5(url.encode()).hexdigest()[:8]
+
+
+def _snapshot_candidates(device_id: Optional[int], stream_url: Optional[str]) -> list:
+    paths = []
+    if device_id is not None:
+        paths.append(HLS_ROOT / str(device_id) / SNAPSHOT_NAME)
+    if stream_url:
+        paths.append(HLS_ROOT / session_id_for_url(stream_url.strip()) / SNAPSHOT_NAME)
+    return paths
+
+
+def _fresh_snapshot(device_id: Optional[int], stream_url: Optional[str]) -> Optional[Path]:
+    max_age = settings.STREAM_SNAPSHOT_MAX_AGE_S
+    for path in _snapshot_candidates(device_id, stream_url):
+        try:
+            if time.time() - path.stat().st_mtime <= max_age:
+                return path
+        except OSError:
+            continue
+    return None
+
+
+def has_live_snapshot(device_id: Optional[int], stream_url: Optional[str] = None) -> bool:
+    """ffmpeg đang phát camera này và vừa ghi latest.jpg."""
+    return settings.STREAM_SNAPSHOT_ENABLED and _fresh_snapshot(device_id, stream_url) is not None
+
+
+def read_snapshot(device_id: Optional[int], stream_url: Optional[str] = None) -> Optional[bytes]:
+    """JPEG mới nhất do ffmpeg ghi (None nếu không có stream đang chạy / ảnh đã cũ).
 
-        # open subprocess
+    ffmpeg ghi đè file tại chỗ → đọc trúng lúc đang ghi thì thiếu EOI, đọc lại.
+    """
+    if not settings.STREAM_SNAPSHOT_ENABLED:
+        return None
+    path = _fresh_snapshot(device_id, stream_url)
+    if path is None:
+        return None
+    for _ in range(3):
         try:
-            log_file = open(out_dir / "ffmpeg.log", "ab")
-            proc = subprocess.Popen(
-                cmd,
-                stdout=log_file,
-                stderr=log_file,
-                cwd=str(out_dir),
-            )
-            logger.info(f"[Stream] Started stream for device {device_id}, PID={proc.pid}")
-        except FileNotFoundError:
-            # ffmpeg not installed
-            logger.error(f"[Stream] ffmpeg not found")
+            data = path.read_bytes()
+        except OSError:
             return None
+        if data[:2] == b"\xff\xd8" and data.endswith(b"\xff\xd9"):
+            return data
+        time.sleep(0.05)
+    return None
 
-        _procs[device_id] = {
-            'proc': proc,
-            'rtsp_url': rtsp_url,
-            'log_file': log_file
-        }
-        return hls_url_for(device_id)
 
+def release_camera_reader(device_id: Optional[int], url: str) -> None:
+    try:
+        from app.services.camera_session_service import camera_sessions
+        if device_id is not None:
+            camera_sessions.close(device_id)
+        camera_sessions.close_url(url)
+    except Exception as e:
+        logger.warning(f"[Stream] Không đóng được reader camera: {e}")
 
-def start_stream_temp(key: str, rtsp_url: str) -> Optional[str]:
-    """Start ffmpeg for a temporary key (no DB).
-    
-    ✅ FIX: Store log_file handle để close properly
+
+def build_hls_cmd(source_url: str, plan: VideoPlan) -> list:
+    """ffmpeg: nguồn camera → HLS (segment 2s) + latest.jpg cho detection.
+
+    plan.mode == "copy": remux H.264 của camera (segment cắt theo keyframe nguồn);
+    "transcode": libx264, thu nhỏ nếu nguồn rộng hơn plan.max_width.
     """
-    with _lock:
-        if key in _temp_procs:
-            proc_info = _temp_procs[key]
-            proc = proc_info['proc']
-            if proc.poll() is not None:
-                logger.info(f"[Stream] Temp key {key}: Old process died, restarting...")
-                _cleanup_temp_proc(key)
-            else:
-                logger.debug(f"[Stream] Temp key {key}: Stream already running")
-                return hls_url_for_temp(key)
-
-        out_dir = _hls_temp_dir(key)
-        index_path = out_dir / "index.m3u8"
-
-        # build ffmpeg command depending on URL scheme
-        cmd = ["ffmpeg", "-y"]
-        url_lower = rtsp_url.lower()
-        if url_lower.startswith('rtsp://'):
-            cmd += ["-rtsp_transport", "tcp"]
-        else:
-            cmd += ["-f", "mjpeg", "-analyzeduration", "0", "-probesize", "32"]
+    cmd = ["ffmpeg", "-y"]
+    url_lower = source_url.lower()
+    if url_lower.startswith('rtsp://'):
+        cmd += ["-rtsp_transport", "tcp"]
+    else:
+        # DroidCam / HTTP MJPEG streams need explicit demuxer
+        cmd += ["-f", "mjpeg", "-analyzeduration", "0", "-probesize", "32"]
+    cmd += ["-i", source_url]
+    if plan.mode == "copy":
+        cmd += ["-c:v", "copy"]
+    else:
+        if plan.max_width:
+            cmd += ["-vf", f"scale=w='min({plan.max_width},iw)':h=-2"]
         cmd += [
-            "-i", rtsp_url,
             "-c:v",
             "libx264",
             "-preset",
             "veryfast",
+            "-threads",
+            str(settings.FFMPEG_THREADS),
             "-g",
             "50",
             "-sc_threshold",
             "0",
-            "-an",
-            "-f",
-            "hls",
-            "-hls_time",
-            "2",
-            "-hls_list_size",
-            "6",
-            "-hls_flags",
-            "independent_segments+append_list",
-            "-hls_segment_filename",
-            "segment_%03d.ts",
-            "index.m3u8",
         ]
+    cmd += [
+        "-an",
+        "-f",
+        "hls",
+        "-hls_time",
+        "2",
+        "-hls_list_size",
+        "6",
+        "-hls_flags",
+        "independent_segments+append_list",
+        "-hls_segment_filename",
+        "segment_%03d.ts",
+        "index.m3u8",
+    ]
+    # output thứ 2: frame JPEG cho auto-detection (camera_service đọc latest.jpg)
+    cmd += snapshot_output_args(SNAPSHOT_NAME)
+    return cmd
+
+
+def _start_supervised(key: str, source_url: str, out_dir: Path) -> bool:
+    prev = ffmpeg_supervisor.get(key)
+    if prev is not None and prev.alive and prev.source_url == source_url:
+        cmd = prev.cmd  # đang chạy: không ffprobe lại (camera rẻ không chịu thêm kết nối)
+    else:
+        plan = plan_video(source_url)
+        if prev is not None and prev.state == "failed" and _plans.get(key, plan).mode == "copy":
+            # remux chết liên tục (vd SPS/PPS nguồn lỗi) → encode lại
+            plan = VideoPlan("transcode", "copy_failed", source=plan.source)
+        _plans[key] = plan
+        logger.info(f"[Stream] {key}: video {plan.mode} ({plan.reason})")
+        cmd = build_hls_cmd(source_url, plan)
+    try:
+        ffmpeg_supervisor.start(key, cmd, out_dir, source_url=source_url)
+        return True
+    except FileNotFoundError:
+        logger.error(f"[Stream] ffmpeg not found")
+    except SupervisorFullError as e:
+        logger.warning(f"[Stream] {e}, từ chối stream {key}")
+    except Exception as e:
+        logger.error(f"[Stream] Không chạy được ffmpeg cho {key}: {e}")
+    return False
 
-        try:
-            log_file = open(out_dir / "ffmpeg.log", "ab")
-            proc = subprocess.Popen(
-                cmd,
-                stdout=log_file,
-                stderr=log_file,
-                cwd=str(out_dir),
-            )
-            logger.info(f"[Stream] Started temp stream for key {key}, PID={proc.pid}")
-        except FileNotFoundError:
-            logger.error(f"[Stream] ffmpeg not found for temp key {key}")
-            return None
-
-        _temp_procs[key] = {
-            'proc': proc,
-            'rtsp_url': rtsp_url,
-            'log_file': log_file
-        }
-        return hls_url_for_temp(key)
 
+def start_stream(device_id: int, rtsp_url: str) -> Optional[str]:
+    """Start ffmpeg to transcode RTSP -> HLS for the given device.
+    Returns HLS index path (relative) or None on failure.
 
-def stop_stream(device_id: int) -> bool:
-    """Stop stream for device.
-    
-    ✅ FIX: Close log_file và cleanup properly
+    ffmpeg_supervisor giữ tiến trình: URL đổi → chạy lại, chết → tự restart,
+    không ai xem → tự dừng.
     """
-    with _lock:
-        return _cleanup_proc(device_id)
+    # không giữ lock chung khi ffprobe (tới STREAM_PROBE_TIMEOUT_S);
+    # ffmpeg_supervisor.start tự đảm bảo mỗi key chỉ 1 tiến trình
+    if not is_running(device_id):
+        # camera rẻ chỉ phục vụ được 1 client: ffmpeg thay reader của camera_session_service
+        # (detection đọc latest.jpg của ffmpeg thay vì mở kết nối riêng)
+        release_camera_reader(device_id, rtsp_url)
+    if not _start_supervised(str(device_id), rtsp_url, _hls_dir(device_id)):
+        return None
+    return hls_url_for(device_id)
 
 
-def stop_stream_temp(key: str) -> bool:
-    """Stop temp stream.
-    
-    ✅ FIX: Close log_file và cleanup properly
-    """
-    with _lock:
-        return _cleanup_temp_proc(key)
+def start_stream_temp(key: str, rtsp_url: str) -> Optional[str]:
+    """Start ffmpeg for a temporary key (no DB)."""
+    if not _start_supervised(f"temp-{key}", rtsp_url, _hls_temp_dir(key)):
+        return None
+    return hls_url_for_temp(key)
 
 
-def _cleanup_proc(device_id: int) -> bool:
-    """⚙️ Internal: Cleanup process for device (must hold lock)."""
-    proc_info = _procs.get(device_id)
-    if not proc_info:
-        return False
-    
-    proc = proc_info['proc']
-    log_file = proc_info.get('log_file')
-    
-    try:
-        proc.terminate()
-        proc.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-    except Exception as e:
-        logger.warning(f"[Stream] Error terminating process {device_id}: {e}")
-    
-    # ✅ Close log file
-    if log_file and not log_file.closed:
-        try:
-            log_file.close()
-        except Exception as e:
-            logger.warning(f"[Stream] Error closing log file for device {device_id}: {e}")
-    
-    del _procs[device_id]
-    logger.info(f"[Stream] Stopped stream for device {device_id}")
-    return True
+def stop_stream(device_id: int) -> bool:
+    """Stop stream for device."""
+    return ffmpeg_supervisor.stop(str(device_id))
 
 
-def _cleanup_temp_proc(key: str) -> bool:
-    """⚙️ Internal: Cleanup temp process (must hold lock)."""
-    proc_info = _temp_procs.get(key)
-    if not proc_info:
-        return False
-    
-    proc = proc_info['proc']
-    log_file = proc_info.get('log_file')
-    
-    try:
-        proc.terminate()
-        proc.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-    except Exception as e:
-        logger.warning(f"[Stream] Error terminating temp process {key}: {e}")
-    
-    # ✅ Close log file
-    if log_file and not log_file.closed:
-        try:
-            log_file.close()
-        except Exception as e:
-            logger.warning(f"[Stream] Error closing log file for temp key {key}: {e}")
-    
-    del _temp_procs[key]
-    logger.info(f"[Stream] Stopped temp stream for key {key}")
-    return True
+def stop_stream_temp(key: str) -> bool:
+    """Stop temp stream."""
+    return ffmpeg_supervisor.stop(f"temp-{key}")
 
 
 def is_running(device_id: int) -> bool:
-    with _lock:
-        proc_info = _procs.get(device_id)
-        if not proc_info:
-            return False
-        proc = proc_info['proc']
-        return proc.poll() is None
+    return ffmpeg_supervisor.is_running(str(device_id))
 
 
 def is_running_temp(key: str) -> bool:
-    with _lock:
-        proc_info = _temp_procs.get(key)
-        if not proc_info:
-            return False
-        proc = proc_info['proc']
-        return proc.poll() is None
+    return ffmpeg_supervisor.is_running(f"temp-{key}")
 
 
 def get_stream_info(device_id: int) -> Optional[dict]:
-    """Get stream info for device (URL, PID, status)."""
-    with _lock:
-        proc_info = _procs.get(device_id)
-        if not proc_info:
-            return None
-        
-        proc = proc_info['proc']
-        is_running_now = proc.poll() is None
-        
-        return {
-            'device_id': device_id,
-            'rtsp_url': proc_info.get('rtsp_url'),
-            'hls_url': hls_url_for(device_id),
-            'running': is_running_now,
-            'pid': proc.pid if is_running_now else None
-        }
+    """Get stream info for device (URL, PID, status, fps/bitrate từ ffmpeg -progress)."""
+    stream = ffmpeg_supervisor.get(str(device_id))
+    if stream is None:
+        return None
+    info = ffmpeg_supervisor.info(str(device_id)) or {}
+    return {
+        'device_id': device_id,
+        'rtsp_url': stream.source_url,
+        'hls_url': hls_url_for(device_id),
+        'running': stream.alive,
+        'pid': info.get('pid'),
+        'state': info.get('state'),
+        'restarts': info.get('restarts'),
+        'fps': info.get('fps'),
+        'bitrate_kbps': info.get('bitrate_kbps'),
+        'video': _plans[str(device_id)].to_dict() if str(device_id) in _plans else None,
+    }
 
 
 def list_active_streams() -> list[dict]:
-    """List all active streams."""
-    with _lock:
-        result = []
-        for device_id, proc_info in _procs.items():
-            proc = proc_info['proc']
-            if proc.poll() is None:  # Still running
-                result.append({
-                    'device_id': device_id,
-                    'rtsp_url': proc_info.get('rtsp_url'),
-                    'hls_url': hls_url_for(device_id),
-                    'running': True,
-                    'pid': proc.pid
-                })
-        return result
+    """List all active device streams."""
+    result = []
+    for key in ffmpeg_supervisor.keys():
+        if not key.isdigit():
+            continue
+        info = get_stream_info(int(key))
+        if info and info['running']:
+            result.append(info)
+    return result
 
 
 def check_stream_health(device_id: int) -> dict:
@@ -335,74 +283,78 @@ def check_stream_health(device_id: int) -> dict:
             'last_update': float | None  # seconds ago
         }
     """
-    with _lock:
-        proc_info = _procs.get(device_id)
-        
-        if not proc_info:
-            return {
-                'healthy': False,
-                'running': False,
-                'error': 'Stream chưa được khởi động',
-                'hls_exists': False,
-                'last_update': None
-            }
-        
-        proc = proc_info['proc']
-        is_running = proc.poll() is None
-        
-        if not is_running:
-            return {
-                'healthy': False,
-                'running': False,
-                'error': 'Quá trình stream đã dừng',
-                'hls_exists': False,
-                'last_update': None
-            }
-        
-        # Check HLS files
-        hls_dir = _hls_dir(device_id)
-        index_file = hls_dir / "index.m3u8"
-        
-        if not index_file.exists():
-            return {
-                'healthy': False,
-                'running': True,
-                'error': 'Đang chờ stream khởi tạo...',
-                'hls_exists': False,
-                'last_update': None
-            }
-        
-        # Check for recent .ts segments
-        import time
-        ts_files = sorted(hls_dir.glob("*.ts"), key=lambda p: p.stat().st_mtime, reverse=True)
-        
-        if not ts_files:
-            return {
-                'healthy': False,
-                'running': True,
-                'error': 'Không có dữ liệu video',
-                'hls_exists': True,
-                'last_update': None
-            }
-        
-        # Check if latest segment is recent (within 10 seconds)
-        latest_ts = ts_files[0]
-        last_modified = latest_ts.stat().st_mtime
-        seconds_ago = time.time() - last_modified
-        
-        if seconds_ago > 10:
-            return {
-                'healthy': False,
-                'running': True,
-                'error': f'Stream không cập nhật (dừng {int(seconds_ago)}s trước)',
-                'hls_exists': True,
-                'last_update': seconds_ago
-            }
-        
+    stream = ffmpeg_supervisor.get(str(device_id))
+
+    if stream is None:
+        return {
+            'healthy': False,
+            'running': False,
+            'error': 'Stream chưa được khởi động',
+            'hls_exists': False,
+            'last_update': None
+        }
+
+    if stream.state == 'backoff':
+        return {
+            'healthy': False,
+            'running': False,
+            'error': 'ffmpeg bị dừng, đang khởi động lại...',
+            'hls_exists': False,
+            'last_update': None
+        }
+
+    if not stream.alive:
+        return {
+            'healthy': False,
+            'running': False,
+            'error': 'Quá trình stream đã dừng',
+            'hls_exists': False,
+            'last_update': None
+        }
+
+    # Check HLS files
+    hls_dir = _hls_dir(device_id)
+    index_file = hls_dir / "index.m3u8"
+
+    if not index_file.exists():
+        return {
+            'healthy': False,
+            'running': True,
+            'error': 'Đang chờ stream khởi tạo...',
+            'hls_exists': False,
+            'last_update': None
+        }
+
+    # Check for recent .ts segments
+    ts_files = sorted(hls_dir.glob("*.ts"), key=lambda p: p.stat().st_mtime, reverse=True)
+
+    if not ts_files:
         return {
-            'healthy': True,
+            'healthy': False,
             'running': True,
-            'error': None,
+            'error': 'Không có dữ liệu video',
+            'hls_exists': True,
+            'last_update': None
+        }
+
+    # Check if latest segment is recent (within 10 seconds)
+    latest_ts = ts_files[0]
+    last_modified = latest_ts.stat().st_mtime
+    seconds_ago = time.time() - last_modified
+
+    if seconds_ago > 10:
+        return {
+            'healthy': False,
+            'running': True,
+            'error': f'Stream không cập nhật (dừng {int(seconds_ago)}s trước)',
             'hls_exists': True,
             'last_update': seconds_ago
-        }
\ No newline at end of file
+        }
+
+    return {
+        'healthy': True,
+        'running': True,
+        'error': None,
+        'hls_exists': True,
+        'last_update': seconds_ago
+    }
@@ -0,0 +1,138 @@
+# app/services/tiled_inference.py
+"""
+Sliced inference cho ảnh độ phân giải cao (ảnh chụp điện thoại 12 MP).
+
+Chạy 1 lượt imgsz=640 thì ảnh lớn bị thu nhỏ ~6 lần → vết sâu vẽ bùa nhỏ
+biến mất. Chế độ này cắt ảnh thành các tile chồng lấn, chạy tất cả tile
++ 1 lượt toàn ảnh (cho đối tượng lớn hơn 1 tile) trong cùng 1 batch, rồi
+gộp box giữa các tile (greedy merge theo IoS, từng class).
+"""
+import hashlib
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import settings
+from app.utils.box_ops import box_ios, image_size, resize_to_array
+
+MAX_DETECTIONS = 300
+
+Box = Tuple[int, int, int, int]
+
+
+def tile_grid(w: int, h: int, tile: int, overlap: float) -> List[Box]:
+    """
+    Lưới tile (x1, y1, x2, y2) phủ kín ảnh w x h. Tile cuối mỗi hàng/cột
+    được đẩy sát mép ảnh nên mọi tile đều đủ kích thước (nếu ảnh >= tile).
+    """
+    stride = max(1, int(tile * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile:
+            return [0]
+        pos = list(range(0, length - tile, stride))
+        pos.append(length - tile)
+        return pos
+
+    return [
+        (x, y, min(x + tile, w), min(y + tile, h))
+        for y in starts(h)
+        for x in starts(w)
+    ]
+
+
+def tiling_signature() -> str:
+    """
+    Định danh cấu hình tile, ghép vào fingerprint model (key cache kết quả):
+    bật tile / đổi INFERENCE_TILE_* thì cache cũ (kết quả không tile) không còn khớp.
+    """
+    if not settings.INFERENCE_TILING_ENABLED:
+        return "notile"
+    cfg = (
+        f"{settings.INFERENCE_TILE_SIZE}|{settings.INFERENCE_TILE_OVERLAP}|"
+        f"{settings.INFERENCE_TILE_MIN_SIDE}|{settings.INFERENCE_TILE_MAX_SIDE}|"
+        f"{settings.INFERENCE_TILE_MERGE_THRESHOLD}"
+    )
+    return "tile" + hashlib.md5(cfg.encode()).hexdigest()[:8]
+
+
+def should_tile(img) -> bool:
+    if not settings.INFERENCE_TILING_ENABLED:
+        return False
+    return max(image_size(img)) >= settings.INFERENCE_TILE_MIN_SIDE
+
+
+def _downscale(img, scale: float):
+    w, h = image_size(img)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    if isinstance(img, np.ndarray):
+        return resize_to_array(img, new_w, new_h)
+    return img.resize((new_w, new_h), Image.BILINEAR)
+
+
+def _crop(img, box: Box):
+    x1, y1, x2, y2 = box
+    if isinstance(img, np.ndarray):
+        return img[y1:y2, x1:x2]  # view, không copy
+    return img.crop(box)
+
+
+def merge_tile_rows(parts: List[np.ndarray], threshold: float) -> np.ndarray:
+    """
+    Gộp rows (N, 6) từ các tile (đã về toạ độ ảnh). Giống NMS nhưng box giữ lại
+    được nới thành hợp của các box cùng class nó đè (IoS > threshold): vết bệnh
+    nằm trên mép tile bị cắt làm nhiều mảnh sẽ được ghép lại thành 1 box đầy đủ.
+    """
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.empty((0, 6), dtype=np.float32)
+
+    rows = np.concatenate(parts).astype(np.float32, copy=False)
+    order = rows[:, 4].argsort()[::-1]
+    merged = []
+    while order.size > 0 and len(merged) < MAX_DETECTIONS:
+        i, rest = order[0], order[1:]
+        match = (rows[rest, 5] == rows[i, 5]) & (box_ios(rows[i, :4], rows[rest, :4]) > threshold)
+        group = rows[np.concatenate(([i], rest[match]))]
+
+        row = rows[i].copy()
+        row[:2] = group[:, :2].min(axis=0)
+        row[2:4] = group[:, 2:4].max(axis=0)
+        merged.append(row)
+        order = rest[~match]
+
+    return np.stack(merged)
+
+
+def predict_tiled_rows(detector, img, conf: float = 0.5, iou: float = 0.5) -> np.ndarray:
+    """
+    Chạy detector.predict_rows trên các tile của `img` + chính `img`,
+    trả về rows (N, 6) theo toạ độ của `img`.
+    """
+    w, h = image_size(img)
+    # ảnh quá lớn → thu nhỏ trước để giới hạn số tile
+    scale = min(1.0, settings.INFERENCE_TILE_MAX_SIDE / max(w, h))
+    work = _downscale(img, scale) if scale < 1.0 else img
+
+    boxes = tile_grid(
+        *image_size(work),
+        tile=settings.INFERENCE_TILE_SIZE,
+        overlap=settings.INFERENCE_TILE_OVERLAP,
+    )
+    outputs = detector.predict_rows([_crop(work, b) for b in boxes] + [img], conf=conf, iou=iou)
+
+    parts = [outputs[-1]]
+    for (x1, y1, _, _), rows in zip(boxes, outputs[:-1]):
+        if len(rows) == 0:
+            continue
+        rows = np.array(rows, dtype=np.float32)
+        rows[:, [0, 2]] += x1
+        rows[:, [1, 3]] += y1
+        rows[:, :4] /= scale
+        parts.append(rows)
+
+    merged = merge_tile_rows(parts, settings.INFERENCE_TILE_MERGE_THRESHOLD)
+    merged[:, [0, 2]] = merged[:, [0, 2]].clip(0, w)
+    merged[:, [1, 3]] = merged[:, [1, 3]].clip(0, h)
+    return merged
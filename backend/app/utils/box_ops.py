@@ -0,0 +1,145 @@
+# app/utils/box_ops.py
+"""
+Các phép xử lý box dùng chung cho detector (thuần NumPy, không cần torch):
+letterbox tiền xử lý ảnh, đổi toạ độ, NMS.
+"""
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:  # cv2 không bắt buộc, fallback sang PIL
+    cv2 = None
+
+LETTERBOX_COLOR = 114  # giống Ultralytics
+
+
+def resize_to_array(img: Union[Image.Image, np.ndarray], new_w: int, new_h: int) -> np.ndarray:
+    """Resize về HWC uint8 (giữ nguyên thứ tự kênh của input)."""
+    if isinstance(img, np.ndarray):
+        if img.shape[1] == new_w and img.shape[0] == new_h:
+            return img
+        if cv2 is not None:
+            return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        return np.asarray(Image.fromarray(img).resize((new_w, new_h), Image.BILINEAR))
+
+    if img.size != (new_w, new_h):
+        img = img.resize((new_w, new_h), Image.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def image_size(img: Union[Image.Image, np.ndarray]) -> Tuple[int, int]:
+    """(w, h) cho cả PIL Image lẫn ndarray HWC."""
+    if isinstance(img, np.ndarray):
+        return int(img.shape[1]), int(img.shape[0])
+    return img.size
+
+
+def letterbox(
+    img: Union[Image.Image, np.ndarray],
+    new_size: int = 640,
+    out: Optional[np.ndarray] = None,
+    bgr: bool = False,
+) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    Resize giữ tỉ lệ + pad về (new_size, new_size) giống Ultralytics.
+
+    img : PIL RGB hoặc ndarray HWC uint8 (bgr=True nếu là frame OpenCV).
+    out : buffer (3, new_size, new_size) float32 có sẵn để ghi thẳng vào
+          (tránh cấp phát mảng mới mỗi lần predict).
+
+    Returns:
+        (tensor CHW float32 RGB [0..1], ratio, (pad_w, pad_h))
+    """
+    w, h = image_size(img)
+    r = min(new_size / w, new_size / h)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    pad_w = (new_size - new_w) / 2
+    pad_h = (new_size - new_h) / 2
+    top = int(round(pad_h - 0.1))
+    left = int(round(pad_w - 0.1))
+
+    resized = resize_to_array(img, new_w, new_h)
+    if bgr:
+        resized = resized[..., ::-1]  # view, không copy
+
+    if out is None:
+        out = np.empty((3, new_size, new_size), dtype=np.float32)
+    out.fill(LETTERBOX_COLOR / 255.0)
+    # HWC uint8 → CHW float32 [0..1], ghi thẳng vào vùng giữa của buffer
+    np.multiply(
+        resized.transpose(2, 0, 1),
+        1.0 / 255.0,
+        out=out[:, top:top + new_h, left:left + new_w],
+        casting="unsafe",
+    )
+    return out, r, (left, top)
+
+
+def xywh2xyxy(boxes: np.ndarray) -> np.ndarray:
+    """(cx, cy, w, h) → (x1, y1, x2, y2)."""
+    out = np.empty_like(boxes)
+    half_w = boxes[:, 2] / 2
+    half_h = boxes[:, 3] / 2
+    out[:, 0] = boxes[:, 0] - half_w
+    out[:, 1] = boxes[:, 1] - half_h
+    out[:, 2] = boxes[:, 0] + half_w
+    out[:, 3] = boxes[:, 1] + half_h
+    return out
+
+
+def _intersection_and_areas(box: np.ndarray, boxes: np.ndarray):
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+
+    inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter, area, areas
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU giữa 1 box (4,) và nhiều box (N, 4), tính vector hoá."""
+    inter, area, areas = _intersection_and_areas(box, boxes)
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def box_ios(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Intersection over smaller: giao / diện tích box nhỏ hơn.
+    Dùng khi gộp kết quả giữa các tile: box bị tile cắt cụt nằm gọn trong
+    box đầy đủ → IoU thấp nhưng IoS ≈ 1.
+    """
+    inter, area, areas = _intersection_and_areas(box, boxes)
+    return inter / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thres: float) -> np.ndarray:
+    """Greedy NMS, trả về index các box giữ lại (sắp theo score giảm dần)."""
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        ious = box_iou(boxes[i], boxes[order[1:]])
+        order = order[1:][ious <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    iou_thres: float,
+) -> np.ndarray:
+    """NMS theo từng class (dịch box theo class_id để các class không đè nhau)."""
+    if boxes.size == 0:
+        return np.empty((0,), dtype=np.int64)
+    offset = classes.astype(boxes.dtype)[:, None] * (boxes.max() + 1)
+    return nms(boxes + offset, scores, iou_thres)
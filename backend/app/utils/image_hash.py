@@ -0,0 +1,56 @@
+# app/utils/image_hash.py
+"""
+Perceptual hash (dHash) để nhận biết 2 frame camera gần như giống nhau.
+"""
+from io import BytesIO
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# ndarray: frame HWC BGR của OpenCV (hoặc ảnh xám 2D)
+ImageLike = Union[bytes, Image.Image, np.ndarray]
+
+
+def dhash(image: ImageLike, hash_size: int = 8) -> int:
+    """
+    Difference hash: thu nhỏ ảnh xám về (hash_size+1) x hash_size rồi so sánh
+    từng cặp pixel kề nhau theo chiều ngang → số nguyên hash_size*hash_size bit.
+    """
+    if isinstance(image, np.ndarray):
+        pixels = _small_gray_from_array(image, hash_size)
+    else:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = Image.open(BytesIO(image))
+
+        # draft: JPEG lớn được decode ở độ phân giải thấp (nhanh hơn nhiều)
+        image.draft("L", (hash_size * 16, hash_size * 16))
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = np.asarray(small, dtype=np.int16)
+
+    diff = pixels[:, 1:] > pixels[:, :-1]
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _small_gray_from_array(frame: np.ndarray, hash_size: int) -> np.ndarray:
+    size = (hash_size + 1, hash_size)
+    if cv2 is not None:
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # INTER_AREA: trung bình vùng, ổn định hơn khi thu nhỏ mạnh
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    img = Image.fromarray(frame if frame.ndim == 2 else frame[..., ::-1].copy())
+    return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.int16)
+
+
+def hamming(a: int, b: int) -> int:
+    """Số bit khác nhau giữa 2 hash."""
+    return bin(a ^ b).count("1")
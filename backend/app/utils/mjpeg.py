@@ -0,0 +1,179 @@
+# app/utils/mjpeg.py
+"""
+Tách frame JPEG từ luồng MJPEG (multipart/x-mixed-replace) theo kiểu tăng dần.
+
+- Có boundary (lấy từ Content-Type): tìm boundary → header của part →
+  Content-Length thì cắt đúng số byte, không quét nội dung ảnh.
+- Không có boundary / Content-Length: quét SOI (FF D8) / EOI (FF D9) nhưng
+  chỉ từ vị trí chưa quét (không quét lại từ đầu buffer mỗi chunk).
+- Buffer dùng lại: phần đã tiêu thụ được cắt khi vượt nửa buffer; dữ liệu chưa
+  thành frame vượt max_frame_bytes thì bỏ và đồng bộ lại (RAM có giới hạn).
+"""
+import re
+from typing import Iterator, List, Optional
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+HEADER_MAX_BYTES = 8192
+BOUNDARY_SEARCH_BYTES = 65536   # không thấy boundary sau bấy nhiêu byte → chuyển sang quét SOI/EOI
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";,]+)"?', re.IGNORECASE)
+_LENGTH_RE = re.compile(rb"content-length\s*:\s*(\d+)", re.IGNORECASE)
+
+
+def boundary_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    m = _BOUNDARY_RE.search(content_type or "")
+    if not m:
+        return None
+    # camera hay gửi boundary kèm/không kèm "--" → tìm phần lõi, khớp cả 2 kiểu
+    return m.group(1).strip().lstrip("-") or None
+
+
+class MjpegDemuxer:
+    def __init__(self, boundary: Optional[str] = None, max_frame_bytes: int = 4_000_000):
+        self._boundary = boundary.encode() if boundary else None
+        self.max_frame_bytes = max_frame_bytes
+        self._buf = bytearray()
+        self._pos = 0                   # đầu phần chưa tiêu thụ
+        self._scan = 0                  # đã quét tới đây mà chưa khớp
+        self._body: Optional[int] = None  # đầu nội dung part hiện tại
+        self._length: Optional[int] = None
+
+        self.frames = 0
+        self.resyncs = 0
+        self.peak_buffer = 0
+
+    @property
+    def mode(self) -> str:
+        return "boundary" if self._boundary else "markers"
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Thêm chunk, trả các frame hoàn chỉnh (cũ → mới)."""
+        self._buf.extend(data)
+        self.peak_buffer = max(self.peak_buffer, len(self._buf))
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        if len(self._buf) - self._pos > self.max_frame_bytes:
+            self._reset()
+        return frames
+
+    def _reset(self) -> None:
+        """Bỏ dữ liệu đang dở (frame quá lớn / rác), đồng bộ lại ở part sau."""
+        self._buf.clear()
+        self._pos = self._scan = 0
+        self._body = self._length = None
+        self.resyncs += 1
+
+    def _compact(self) -> None:
+        if self._pos > len(self._buf) // 2:
+            del self._buf[:self._pos]
+            self._scan -= self._pos
+            if self._body is not None:
+                self._body -= self._pos
+            self._pos = 0
+
+    def _find_body(self) -> bool:
+        """Tìm đầu part tiếp theo (sau header nếu có boundary, tại SOI nếu không)."""
+        buf = self._buf
+        if self._boundary:
+            b = buf.find(self._boundary, self._scan)
+            if b == -1:
+                if len(buf) - self._pos > BOUNDARY_SEARCH_BYTES:
+                    # Content-Type khai báo boundary khác với thực tế → quét marker
+                    self._boundary = None
+                    self._scan = self._pos
+                    return self._find_body()
+                self._scan = max(self._pos, len(buf) - len(self._boundary))
+                return False
+            h_end = buf.find(b"\r\n\r\n", b)
+            if h_end == -1:
+                if len(buf) - b > HEADER_MAX_BYTES:
+                    self._scan = b + len(self._boundary)
+                    self.resyncs += 1
+                else:
+                    self._scan = b
+                return False
+            m = _LENGTH_RE.search(buf, b, h_end)
+            self._length = int(m.group(1)) if m else None
+            self._body = h_end + 4
+        else:
+            s = buf.find(SOI, self._scan)
+            if s == -1:
+                self._scan = max(self._pos, len(buf) - 1)
+                return False
+            self._body, self._length = s, None
+        self._scan = self._body
+        return True
+
+    def _next_frame(self) -> Optional[bytes]:
+        buf = self._buf
+        if self._body is None and not self._find_body():
+            return None
+
+        frame = None
+        if self._length is not None:
+            end = self._body + self._length
+            if len(buf) < end:
+                return None
+            if buf[self._body:self._body + 2] == SOI:
+                frame = bytes(buf[self._body:end])
+            else:
+                # Content-Length không khớp nội dung → quét marker cho part này
+                self._length = None
+                self.resyncs += 1
+
+        if frame is None:
+            if buf[self._body:self._body + 2] != SOI:
+                s = buf.find(SOI, self._body)
+                if s == -1:
+                    return None
+                self._body = s
+            e = buf.find(EOI, max(self._scan, self._body + 2))
+            if e == -1:
+                self._scan = max(self._body + 2, len(buf) - 1)
+                return None
+            end = e + 2
+            frame = bytes(buf[self._body:end])
+
+        self._pos = self._scan = end
+        self._body = self._length = None
+        self.frames += 1
+        self._compact()
+        return frame
+
+
+def iter_frames(resp, chunk_size: int = 4096, max_frame_bytes: int = 4_000_000) -> Iterator[bytes]:
+    """Frame JPEG liên tục từ response requests (stream=True)."""
+    demuxer = MjpegDemuxer(
+        boundary_from_content_type(resp.headers.get("content-type")),
+        max_frame_bytes=max_frame_bytes,
+    )
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        if chunk:
+            yield from demuxer.feed(chunk)
+
+
+def latest_frame(resp, chunk_size: int = 4096, max_bytes: int = 2_000_000) -> Optional[bytes]:
+    """
+    Frame mới nhất trong đợt dữ liệu đầu tiên có frame hoàn chỉnh: camera hay
+    đẩy dồn vài frame đã đệm khi vừa kết nối, frame cuối của đợt đó là mới nhất.
+    """
+    demuxer = MjpegDemuxer(
+        boundary_from_content_type(resp.headers.get("content-type")),
+        max_frame_bytes=max_bytes,
+    )
+    received = 0
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        if not chunk:
+            continue
+        received += len(chunk)
+        frames = demuxer.feed(chunk)
+        if frames:
+            return frames[-1]
+        if received > max_bytes and demuxer.frames == 0:
+            return None
+    return None
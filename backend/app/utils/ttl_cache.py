@@ -0,0 +1,147 @@
+# app/utils/ttl_cache.py
+"""
+Cache LRU + TTL dùng chung (thread-safe) và tầng cache trên đĩa (JSON).
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Union
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU trong RAM, mỗi entry hết hạn sau `ttl` giây (ttl <= 0 → không hết hạn)."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl > 0 else 0.0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Xoá mọi key thoả predicate, trả về số entry đã xoá."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class DiskCache:
+    """
+    Tầng cache trên đĩa: mỗi key là 1 file JSON trong `root/<namespace>/`.
+    Đổi namespace (vd: version model) → purge() để xoá các namespace cũ.
+    """
+
+    def __init__(self, root: str, ttl: float = 86400):
+        self.root = Path(root)
+        self.ttl = float(ttl)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, namespace: str, key: str) -> Path:
+        return self.root / namespace / f"{key}.json"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        path = self._path(namespace, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        expires_at = payload.get("expires_at") or 0
+        if expires_at and expires_at < time.time():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return payload.get("value")
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "expires_at": time.time() + self.ttl if self.ttl > 0 else 0,
+            "value": value,
+        }
+        # ghi file tạm rồi rename → không để lại file JSON dở dang
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def purge(self, keep_namespace: Union[str, Iterable[str]]) -> int:
+        """Xoá mọi namespace không nằm trong `keep_namespace`, trả về số namespace đã xoá."""
+        keep = {keep_namespace} if isinstance(keep_namespace, str) else set(keep_namespace)
+        removed = 0
+        if not self.root.exists():
+            return 0
+        for child in self.root.iterdir():
+            if child.is_dir() and child.name not in keep:
+                shutil.rmtree(child, ignore_errors=True)
+                removed += 1
+        return removed
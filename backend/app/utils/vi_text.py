@@ -0,0 +1,53 @@
+# app/utils/vi_text.py
+"""
+Tách từ tiếng Việt đơn giản cho tìm kiếm (không cần thư viện NLP):
+- chuẩn hoá Unicode (NFC) + lowercase, tách theo âm tiết
+- thêm dạng bỏ dấu ("~vang") để khớp cả câu hỏi gõ không dấu
+- thêm bigram âm tiết bỏ dấu ("vang_la") vì từ tiếng Việt thường gồm 2 âm tiết
+"""
+import re
+import unicodedata
+from typing import List
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# hư từ / từ hỏi phổ biến (dạng có dấu: "là" bị bỏ nhưng "lá" thì giữ)
+VI_STOPWORDS = {
+    "là", "của", "và", "có", "cho", "các", "những", "một", "này", "đó", "thì", "với",
+    "để", "khi", "được", "trong", "trên", "tôi", "bạn", "gì", "nào", "sao", "thế",
+    "như", "về", "ở", "ra", "vào", "hay", "hoặc", "nếu", "sẽ", "đã", "đang", "cần",
+    "phải", "nên", "làm", "em", "mình", "ạ", "ơi", "không", "rồi", "thể", "bị",
+    # từ khuôn câu hỏi về bệnh (có trong hầu hết tài liệu, không phân biệt được bệnh)
+    "cách", "chữa", "trị", "xử", "lý", "dấu", "hiệu", "triệu", "chứng", "biểu", "hiện",
+    "nguyên", "nhân",
+}
+
+
+def fold_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Vàng lá" → "vang la" (đ → d)."""
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+# câu gõ không dấu: bỏ hư từ theo dạng bỏ dấu, trừ "la" (có thể là "lá")
+FOLDED_STOPWORDS = {fold_accents(w) for w in VI_STOPWORDS} - {"la"}
+
+
+def syllables(text: str) -> List[str]:
+    return _WORD_RE.findall(unicodedata.normalize("NFC", (text or "").lower()))
+
+
+def tokenize(text: str) -> List[str]:
+    """Âm tiết có dấu (trừ hư từ) + dạng bỏ dấu + bigram bỏ dấu của các âm tiết còn lại."""
+    kept: List[str] = []
+    tokens: List[str] = []
+    for s in syllables(text):
+        f = fold_accents(s)
+        if s in VI_STOPWORDS or (s == f and f in FOLDED_STOPWORDS):
+            continue
+        if s != f:
+            tokens.append(s)  # âm tiết không dấu: dạng "~" là đủ
+        tokens.append("~" + f)
+        kept.append(f)
+    tokens.extend(f"{a}_{b}" for a, b in zip(kept, kept[1:]))
+    return tokens
@@ -0,0 +1,127 @@
+# app/worker.py
+"""
+Worker xử lý job trong hàng đợi bền vững (job_queue_service), chạy tách khỏi API
+và scale ngang bằng cách chạy thêm process:
+
+    python -m app.worker --queues scan,enrich,export --concurrency 4
+
+- Nhận tối đa `concurrency` job cùng lúc, gia hạn lease định kỳ khi job chạy lâu
+- SIGTERM / SIGINT: ngừng nhận job mới, chờ job đang chạy xong rồi thoát
+  (job bị kill giữa chừng sẽ được worker khác nhận lại khi lease hết hạn)
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from app.core.config import settings
+from app.services import job_handlers  # noqa: F401  (đăng ký handler)
+from app.services.job_queue_service import HANDLERS, ClaimedJob, PermanentJobError, job_queue
+
+logger = logging.getLogger("app.worker")
+
+
+class Worker:
+    def __init__(self, queues: List[str], concurrency: int):
+        self.queues = queues
+        self.concurrency = max(1, concurrency)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+        self._inflight: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self, *_args) -> None:
+        if not self._stop.is_set():
+            logger.info("[Worker] Nhận tín hiệu dừng, chờ job đang chạy xong...")
+        self._stop.set()
+
+    def _execute(self, job: ClaimedJob) -> None:
+        started = time.perf_counter()
+        handler = HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise PermanentJobError(f"Không có handler cho job kind '{job.kind}'")
+            result = handler(job.payload)
+            job_queue.complete(job, self.worker_id, result)
+            logger.info(f"[Worker] ✓ Job {job.job_id} ({job.kind}) xong sau {time.perf_counter() - started:.1f}s")
+        except PermanentJobError as e:
+            job_queue.fail(job, self.worker_id, str(e), permanent=True)
+            logger.error(f"[Worker] ✗ Job {job.job_id} ({job.kind}) lỗi vĩnh viễn → dead: {e}")
+        except Exception as e:
+            state = job_queue.fail(job, self.worker_id, f"{type(e).__name__}: {e}")
+            logger.warning(
+                f"[Worker] ✗ Job {job.job_id} ({job.kind}) lần {job.attempts}/{job.max_attempts} lỗi → {state}: {e}"
+            )
+        finally:
+            with self._lock:
+                self._inflight.pop(job.job_id, None)
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(1.0, settings.JOB_LEASE_S / 3)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                ids = list(self._inflight)
+            if not ids:
+                if self._stop.is_set():
+                    break
+                continue
+            try:
+                job_queue.heartbeat(self.worker_id, ids)
+            except Exception as e:
+                logger.warning(f"[Worker] Gia hạn lease lỗi: {e}")
+
+    def run(self) -> None:
+        logger.info(f"[Worker] {self.worker_id} nhận queue {self.queues}, concurrency={self.concurrency}")
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+        last_purge = 0.0
+
+        while not self._stop.is_set():
+            with self._lock:
+                free = self.concurrency - len(self._inflight)
+            jobs: List[ClaimedJob] = []
+            if free > 0:
+                try:
+                    jobs = job_queue.claim(self.worker_id, self.queues, limit=free)
+                except Exception as e:
+                    logger.error(f"[Worker] Lỗi khi nhận job: {e}")
+
+            for job in jobs:
+                with self._lock:
+                    self._inflight[job.job_id] = self._pool.submit(self._execute, job)
+
+            if time.time() - last_purge > 3600:
+                last_purge = time.time()
+                try:
+                    job_queue.purge_finished()
+                except Exception as e:
+                    logger.warning(f"[Worker] Dọn job cũ lỗi: {e}")
+
+            if not jobs:
+                self._stop.wait(settings.JOB_POLL_INTERVAL_S)
+
+        self._pool.shutdown(wait=True)
+        logger.info(f"[Worker] {self.worker_id} đã dừng")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker hàng đợi job (scan / enrich / export)")
+    parser.add_argument("--queues", default="scan,enrich,export", help="danh sách queue, cách nhau dấu phẩy")
+    parser.add_argument("--concurrency", type=int, default=settings.JOB_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    worker = Worker([q.strip() for q in args.queues.split(",") if q.strip()], args.concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
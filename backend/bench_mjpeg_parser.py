@@ -0,0 +1,122 @@
+"""
+So sánh cách tách frame MJPEG cũ (quét lại cả buffer từ đầu mỗi chunk) với
+app.utils.mjpeg.MjpegDemuxer trên luồng MJPEG đã ghi lại.
+
+Ghi luồng DroidCam (nguyên multipart, không kèm HTTP header):
+    curl -s --max-time 20 http://<ip-điện-thoại>:4747/video -o droidcam_640x480.mjpeg
+
+Dùng:
+    python bench_mjpeg_parser.py droidcam_640x480.mjpeg [droidcam_1280x720.mjpeg ...] \
+        [--chunk 4096] [--repeat 3]
+
+Không truyền file → tự tạo luồng giả 640x480 và 1280x720 (200 frame) để chạy thử.
+"""
+import argparse
+import io
+import re
+import statistics
+import time
+from pathlib import Path
+
+from app.utils.mjpeg import MjpegDemuxer
+
+
+def legacy_frames(data: bytes, chunk: int):
+    """Cách cũ của _extract_frame_from_mjpeg, chạy liên tục cho mọi frame."""
+    buffer = bytearray()
+    start = -1
+    frames = 0
+    peak = 0
+    for i in range(0, len(data), chunk):
+        buffer.extend(data[i:i + chunk])
+        peak = max(peak, len(buffer))
+        while True:
+            if start == -1:
+                start = buffer.find(b"\xff\xd8")
+                if start == -1:
+                    break
+            end = buffer.find(b"\xff\xd9", start)
+            if end == -1:
+                break
+            frames += 1
+            del buffer[:end + 2]
+            start = -1
+    return frames, peak
+
+
+def demuxer_frames(data: bytes, chunk: int, boundary):
+    demuxer = MjpegDemuxer(boundary)
+    frames = 0
+    for i in range(0, len(data), chunk):
+        frames += len(demuxer.feed(data[i:i + chunk]))
+    return frames, demuxer.peak_buffer, demuxer.mode
+
+
+def detect_boundary(data: bytes):
+    """File ghi bằng curl không có Content-Type → lấy boundary từ dòng đầu."""
+    m = re.match(rb"\s*--?-?([^\r\n]+)\r?\n", data[:256])
+    return m.group(1).decode(errors="ignore").lstrip("-") if m else None
+
+
+def synthetic_stream(width: int, height: int, count: int = 200) -> bytes:
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    out = bytearray()
+    for i in range(count):
+        buf = io.BytesIO()
+        Image.fromarray(np.roll(base, i * 3, axis=1)).save(buf, "JPEG", quality=80)
+        jpg = buf.getvalue()
+        out += b"--dcmjpeg\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpg)
+        out += jpg + b"\r\n"
+    return bytes(out)
+
+
+def bench(name: str, data: bytes, chunk: int, repeat: int):
+    boundary = detect_boundary(data)
+    rows = []
+    for label, fn in (
+        ("legacy", lambda: legacy_frames(data, chunk) + ("markers",)),
+        ("demuxer", lambda: demuxer_frames(data, chunk, boundary)),
+    ):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            frames, peak, mode = fn()
+            times.append(time.perf_counter() - t0)
+        t = statistics.median(times)
+        rows.append({
+            "capture": name,
+            "parser": label,
+            "mode": mode,
+            "frames": frames,
+            "MB/s": round(len(data) / t / 1e6, 1),
+            "us/frame": round(t / max(frames, 1) * 1e6, 1),
+            "peak_buffer_kb": round(peak / 1024, 1),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="*")
+    parser.add_argument("--chunk", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.captures:
+        inputs = [(Path(p).name, Path(p).read_bytes()) for p in args.captures]
+    else:
+        print("Không có file ghi sẵn → dùng luồng giả")
+        inputs = [(f"synthetic_{w}x{h}", synthetic_stream(w, h)) for w, h in ((640, 480), (1280, 720))]
+
+    for name, data in inputs:
+        print(f"{name}: {len(data) / 1e6:.1f} MB, chunk={args.chunk}")
+        for row in bench(name, data, args.chunk, args.repeat):
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+So sánh biến thể quantize (int8) với bản FP32: latency, RAM, mAP50.
+
+Dùng:
+    python bench_quantized_model.py v1.0 [--variant int8] [--baseline onnx|""] \
+        [--eval-dir dataset/train] [--max-images 300] [--write-metadata]
+
+Tập đánh giá là các crop export_dataset_service ghi theo folder class
+(DATASET_ROOT/<split>/<class>/): mỗi crop là 1 ảnh có 1 box ground truth
+phủ toàn ảnh với class theo tên folder. Mỗi model được đo trong 1 process
+riêng để số RAM không lẫn nhau.
+
+--write-metadata: ghi kết quả vào metadata.json["variants"][variant]["metrics"];
+service chỉ load biến thể khi map50_drop <= MODEL_MAX_ACCURACY_DROP.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.inference_service import (
+    EXPORTS_ROOT,
+    VN_LABELS,
+    read_model_metadata,
+    weights_file,
+)
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def write_metadata(model_dir: Path, metadata: dict) -> None:
+    path = model_dir / "metadata.json"
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _norm(name: str) -> str:
+    return name.strip().replace(" ", "_").lower()
+
+
+def folder_class_map(folders, names: dict) -> dict:
+    """Folder crop (tên bệnh tiếng Việt đã sanitize) → class_id của model."""
+    mapping = {}
+    for folder in folders:
+        f = _norm(folder)
+        for cid, key in names.items():
+            candidates = {_norm(key), _norm(VN_LABELS.get(key, key))}
+            if any(c == f or c.startswith(f) for c in candidates):
+                mapping[folder] = cid
+                break
+    return mapping
+
+
+def eval_files(eval_dir: Path, max_images: int) -> list:
+    files = []
+    for class_dir in sorted(p for p in eval_dir.iterdir() if p.is_dir()):
+        files += [(p, class_dir.name) for p in sorted(class_dir.rglob("*")) if p.suffix.lower() in IMAGE_EXTS]
+    return files[:max_images] if max_images else files
+
+
+def _measure(model_path: str, paths: list, repeat: int, enforce_gate: bool, queue) -> None:
+    """Chạy trong process con: load model, đo RAM + latency, trả predictions."""
+    import psutil
+
+    from app.services.inference_service import create_detector, warm_up
+
+    proc = psutil.Process()
+    rss0 = proc.memory_info().rss
+    det = create_detector(model_path, enforce_gate=enforce_gate)
+    warm_up(det)
+    rss_loaded = proc.memory_info().rss
+
+    latencies, preds = [], []
+    for path in paths:
+        raw = Path(path).read_bytes()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = det.predict_bytes(raw, conf=0.001, iou=0.6)  # conf thấp như khi tính mAP
+            latencies.append((time.perf_counter() - t0) * 1000)
+        preds.append(result["detections"])
+
+    queue.put({
+        "names": dict(det.names),
+        "latencies": latencies,
+        "preds": preds,
+        "memory_mb": round((rss_loaded - rss0) / 2**20, 1),
+        "peak_rss_mb": round(proc.memory_info().rss / 2**20, 1),
+    })
+
+
+def measure(model_path: str, paths: list, repeat: int, enforce_gate: bool = True) -> dict:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(model_path, [str(p) for p in paths], repeat, enforce_gate, queue))
+    proc.start()
+    out = queue.get()
+    proc.join()
+    return out
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def map50(preds: list, gts: list) -> float:
+    """
+    mAP@0.5 (all-point interpolation) theo từng class rồi lấy trung bình.
+    preds[i]: detections của ảnh i; gts[i]: list (class_id, box).
+    """
+    classes = sorted({c for g in gts for c, _ in g})
+    aps = []
+    for cls in classes:
+        n_gt = sum(1 for g in gts for c, _ in g if c == cls)
+        scored = [
+            (d["confidence"], i, d["bbox"])
+            for i, dets in enumerate(preds)
+            for d in dets
+            if d["class_id"] == cls
+        ]
+        scored.sort(key=lambda x: -x[0])
+
+        used = set()
+        tp = []
+        for _, i, box in scored:
+            best_j, best_iou = None, 0.5
+            for j, (c, gbox) in enumerate(gts[i]):
+                if c != cls or (i, j) in used:
+                    continue
+                v = iou(box, gbox)
+                if v >= best_iou:
+                    best_j, best_iou = j, v
+            if best_j is not None:
+                used.add((i, best_j))
+            tp.append(best_j is not None)
+
+        # precision/recall tích luỹ → AP = diện tích dưới đường PR (precision đã làm đơn điệu)
+        recalls, precisions, hits = [0.0], [1.0], 0
+        for k, hit in enumerate(tp, start=1):
+            hits += hit
+            recalls.append(hits / n_gt)
+            precisions.append(hits / k)
+        for k in range(len(precisions) - 2, -1, -1):
+            precisions[k] = max(precisions[k], precisions[k + 1])
+        aps.append(sum((recalls[k] - recalls[k - 1]) * precisions[k] for k in range(1, len(recalls))))
+
+    return sum(aps) / len(aps) if aps else 0.0
+
+
+def summarize(name: str, out: dict, gts: list) -> dict:
+    lat = sorted(out["latencies"])
+    return {
+        "model": name,
+        "latency_p50_ms": round(statistics.median(lat), 2),
+        "latency_p95_ms": round(lat[int(0.95 * (len(lat) - 1))], 2),
+        "memory_mb": out["memory_mb"],
+        "peak_rss_mb": out["peak_rss_mb"],
+        "map50": round(map50(out["preds"], gts), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("version")
+    parser.add_argument("--variant", default="int8")
+    parser.add_argument("--baseline", default="onnx", help='biến thể FP32 làm mốc ("" = weights gốc)')
+    parser.add_argument("--eval-dir", default=str(Path(settings.DATASET_ROOT) / "train"))
+    parser.add_argument("--max-images", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--write-metadata", action="store_true")
+    args = parser.parse_args()
+
+    model_dir = Path(EXPORTS_ROOT) / args.version
+    metadata = read_model_metadata(str(model_dir))
+    variants = metadata.get("variants") or {}
+    if args.variant not in variants:
+        raise SystemExit(f"{args.version} chưa có biến thể '{args.variant}', chạy quantize_model.py trước")
+
+    baseline_path = model_dir / weights_file(metadata, args.baseline or None)
+    variant_path = model_dir / variants[args.variant]["weights"]
+
+    files = eval_files(Path(args.eval_dir), args.max_images)
+    if not files:
+        raise SystemExit(f"Không có ảnh trong {args.eval_dir}")
+    print(f"Đánh giá trên {len(files)} crop từ {args.eval_dir}")
+
+    # chạy baseline trước để lấy names (map folder → class_id)
+    base_out = measure(str(baseline_path), [p for p, _ in files], args.repeat)
+    names = {int(k): v for k, v in base_out["names"].items()}
+    mapping = folder_class_map({folder for _, folder in files}, names)
+    keep = [i for i, (_, folder) in enumerate(files) if folder in mapping]
+    if not keep:
+        raise SystemExit("Không map được folder crop nào sang class của model")
+
+    def gt_for(i):
+        from PIL import Image
+
+        path, folder = files[i]
+        w, h = Image.open(path).size
+        return [(mapping[folder], [0.0, 0.0, float(w), float(h)])]
+
+    gts = [gt_for(i) for i in keep]
+    base_out["preds"] = [base_out["preds"][i] for i in keep]
+
+    # biến thể chưa có metrics thì service từ chối load → bỏ gate khi đo
+    variant_entry = variants[args.variant]
+    var_out = measure(str(variant_path), [p for p, _ in files], args.repeat, enforce_gate=False)
+    var_out["preds"] = [var_out["preds"][i] for i in keep]
+
+    base = summarize(baseline_path.name, base_out, gts)
+    var = summarize(variant_path.name, var_out, gts)
+    print(base)
+    print(var)
+
+    drop = round(base["map50"] - var["map50"], 4)
+    speedup = round(base["latency_p50_ms"] / var["latency_p50_ms"], 2) if var["latency_p50_ms"] else None
+    print(f"mAP50 drop: {drop} (ngưỡng {settings.MODEL_MAX_ACCURACY_DROP}) | speedup p50: {speedup}x")
+
+    if args.write_metadata:
+        variant_entry["metrics"] = {
+            "map50": var["map50"],
+            "baseline": base["model"],
+            "baseline_map50": base["map50"],
+            "map50_drop": drop,
+            "latency_p50_ms": var["latency_p50_ms"],
+            "baseline_latency_p50_ms": base["latency_p50_ms"],
+            "memory_mb": var["memory_mb"],
+            "baseline_memory_mb": base["memory_mb"],
+            "eval_images": len(keep),
+            "eval_dir": args.eval_dir,
+            "evaluated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        write_metadata(model_dir, metadata)
+        print(f"Đã ghi metrics vào {model_dir / 'metadata.json'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Đo số stream HLS mỗi core: encode lại (libx264) so với remux (-c:v copy) trên cùng nguồn RTSP.
+
+Dựng RTSP server local (vd mediamtx) và đẩy 1 video H.264 lặp vô hạn:
+    ./mediamtx &
+    ffmpeg -re -stream_loop -1 -i sample_1080p_h264.mp4 -c copy -f rtsp rtsp://127.0.0.1:8554/cam
+
+Dùng:
+    python bench_stream_passthrough.py rtsp://127.0.0.1:8554/cam [--streams 4] [--seconds 30]
+
+Mỗi chế độ chạy --streams tiến trình ffmpeg cùng lúc với đúng lệnh của
+stream_service.build_hls_cmd (gồm cả output latest.jpg), đo CPU time của tiến trình con.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from app.services.stream_probe import VideoPlan, plan_video, probe_video
+from app.services.stream_service import build_hls_cmd
+
+
+def children_cpu_s() -> float:
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+def run_mode(url: str, plan: VideoPlan, streams: int, seconds: float):
+    cmd = build_hls_cmd(url, plan)
+    with tempfile.TemporaryDirectory() as root:
+        cpu0 = children_cpu_s()
+        t0 = time.monotonic()
+        procs = []
+        for i in range(streams):
+            out_dir = Path(root) / str(i)
+            out_dir.mkdir()
+            procs.append(subprocess.Popen(
+                cmd, cwd=out_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+        time.sleep(seconds)
+        alive = sum(1 for p in procs if p.poll() is None)
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+        wall = time.monotonic() - t0
+        cpu = children_cpu_s() - cpu0
+        segments = sum(len(list((Path(root) / str(i)).glob("*.ts"))) for i in range(streams))
+
+    cores = cpu / wall
+    return {
+        "mode": plan.mode,
+        "streams": streams,
+        "alive_at_end": alive,
+        "segments": segments,
+        "cpu_cores_used": round(cores, 2),
+        "cpu_per_stream": round(cores / streams, 3),
+        "streams_per_core": round(streams / cores, 1) if cores > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", help="rtsp://... nguồn H.264")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"Nguồn: {probe_video(args.url)} | {os.cpu_count()} core")
+    auto = plan_video(args.url)
+    print(f"stream_probe chọn: {auto.mode} ({auto.reason})")
+
+    for plan in (VideoPlan("transcode", "forced"), VideoPlan("copy", "forced")):
+        print(run_mode(args.url, plan, args.streams, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
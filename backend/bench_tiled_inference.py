@@ -0,0 +1,127 @@
+"""
+So sánh chế độ 1 lượt (imgsz=640) và chế độ cắt tile trên cùng 1 bộ ảnh.
+
+Dùng:
+    python bench_tiled_inference.py ../ml/exports/v1.0/best.pt dataset/val/images \
+        [--labels dataset/val/labels] [--repeat 3]
+
+--labels: thư mục nhãn YOLO (.txt cùng tên ảnh: class cx cy w h, chuẩn hoá 0..1)
+→ tính thêm precision / recall (IoU >= 0.5) và recall riêng cho box nhỏ.
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.inference_service import create_detector
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+SMALL_BOX_RATIO = 0.05  # box có cạnh dài < 5% cạnh dài ảnh được tính là "nhỏ"
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def read_labels(path: Path, w: int, h: int):
+    if not path.exists():
+        return []
+    boxes = []
+    for line in path.read_text().splitlines():
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        cls, cx, cy, bw, bh = int(parts[0]), *map(float, parts[1:5])
+        boxes.append((cls, [(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h]))
+    return boxes
+
+
+def match(preds, gts):
+    """Greedy match theo confidence, trả về (tp, số gt nhỏ được match)."""
+    used = set()
+    tp, small_tp = 0, 0
+    for det in sorted(preds, key=lambda d: -d["confidence"]):
+        best, best_iou = None, 0.5
+        for j, (cls, box) in enumerate(gts):
+            if j in used or cls != det["class_id"]:
+                continue
+            v = iou(det["bbox"], box)
+            if v >= best_iou:
+                best, best_iou = j, v
+        if best is not None:
+            used.add(best)
+            tp += 1
+            if is_small(gts[best][1], det["image_width"], det["image_height"]):
+                small_tp += 1
+    return tp, small_tp
+
+
+def is_small(box, w, h):
+    return max(box[2] - box[0], box[3] - box[1]) < SMALL_BOX_RATIO * max(w, h)
+
+
+def run_mode(det, files, labels_dir, tiled: bool, repeat: int):
+    settings.INFERENCE_TILING_ENABLED = tiled
+    latencies = []
+    n_pred = tp = small_tp = n_gt = n_small = 0
+
+    for path in files:
+        raw = path.read_bytes()
+        for r in range(repeat):
+            t0 = time.perf_counter()
+            result = det.predict_bytes(raw)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        dets = result["detections"]
+        n_pred += len(dets)
+        if labels_dir is not None:
+            w, h = det.source_size(det.load_image(raw))
+            gts = read_labels(labels_dir / f"{path.stem}.txt", w, h)
+            n_gt += len(gts)
+            n_small += sum(1 for _, box in gts if is_small(box, w, h))
+            t, s = match(dets, gts)
+            tp += t
+            small_tp += s
+
+    lat = sorted(latencies)
+    row = {
+        "mode": "tiled" if tiled else "single",
+        "p50_ms": round(statistics.median(lat), 1),
+        "p95_ms": round(lat[int(0.95 * (len(lat) - 1))], 1),
+        "detections": n_pred,
+    }
+    if labels_dir is not None:
+        row["precision"] = round(tp / n_pred, 3) if n_pred else 0.0
+        row["recall"] = round(tp / n_gt, 3) if n_gt else 0.0
+        row["recall_small"] = round(small_tp / n_small, 3) if n_small else None
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("images")
+    parser.add_argument("--labels", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    files = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    labels_dir = Path(args.labels) if args.labels else None
+    det = create_detector(args.model)
+    print(f"Backend: {det.backend} | {len(files)} ảnh | tile={settings.INFERENCE_TILE_SIZE} "
+          f"overlap={settings.INFERENCE_TILE_OVERLAP} min_side={settings.INFERENCE_TILE_MIN_SIDE}")
+
+    # warm-up để lượt đo đầu không tính thời gian khởi tạo graph
+    det.predict_bytes(files[0].read_bytes())
+
+    for tiled in (False, True):
+        print(run_mode(det, files, labels_dir, tiled, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Tạo biến thể INT8 của model trong ml/exports/<version> cho node chỉ có CPU.
+
+Dùng:
+    python quantize_model.py v1.0 [--mode static|dynamic] [--calib-dir dataset/train] [--max-images 200]
+
+- static (mặc định): calibrate activation bằng ảnh crop mà export_dataset_service
+  ghi ở DATASET_ROOT/<split>/<class>/, quantize theo định dạng QDQ.
+- dynamic: chỉ quantize weights, không cần ảnh calibration.
+
+Cần bản FP32 .onnx cạnh weights (best.onnx); nếu chỉ có best.pt thì export qua
+ultralytics. Kết quả: best.int8.onnx + metadata.json["variants"]["int8"].
+Biến thể chỉ được service load sau khi bench_quantized_model.py --write-metadata
+ghi map50_drop và mức giảm nằm trong MODEL_MAX_ACCURACY_DROP.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import onnx
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from PIL import Image
+
+from app.core.config import settings
+from app.services.inference_service import EXPORTS_ROOT, read_model_metadata
+from app.utils.box_ops import letterbox
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def write_metadata(model_dir: Path, metadata: dict) -> None:
+    path = model_dir / "metadata.json"
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def fp32_onnx_path(model_dir: Path, metadata: dict, imgsz: int) -> Path:
+    """best.onnx cạnh weights; chưa có thì export từ best.pt (cần ultralytics)."""
+    weights = metadata.get("weights") or "best.pt"
+    if weights.endswith(".onnx"):
+        return model_dir / weights
+
+    onnx_path = model_dir / (Path(weights).stem + ".onnx")
+    if not onnx_path.exists():
+        from ultralytics import YOLO
+
+        print(f"Export {weights} → {onnx_path.name}")
+        exported = YOLO(str(model_dir / weights)).export(format="onnx", imgsz=imgsz, dynamic=True)
+        Path(exported).replace(onnx_path)
+
+    # bản FP32 chạy bằng ONNX Runtime cũng là 1 biến thể (baseline khi benchmark)
+    metadata.setdefault("variants", {})["onnx"] = {"weights": onnx_path.name, "backend": "onnx"}
+    return onnx_path
+
+
+def calibration_files(calib_dir: Path, max_images: int, seed: int = 0) -> list:
+    """Lấy đều ảnh từ mỗi folder class (round-robin) để calibration không lệch về class nhiều ảnh."""
+    rng = random.Random(seed)
+    per_class = []
+    for class_dir in sorted(p for p in calib_dir.iterdir() if p.is_dir()):
+        files = [p for p in class_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTS]
+        rng.shuffle(files)
+        if files:
+            per_class.append(files)
+
+    picked = []
+    while per_class and len(picked) < max_images:
+        for files in list(per_class):
+            if not files:
+                per_class.remove(files)
+                continue
+            picked.append(files.pop())
+            if len(picked) >= max_images:
+                break
+    return picked
+
+
+class CropCalibrationReader(CalibrationDataReader):
+    """Đưa từng crop (letterbox giống lúc serve) vào quantizer."""
+
+    def __init__(self, files: list, input_name: str, imgsz: int):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._files = iter(files)
+
+    def get_next(self):
+        for path in self._files:
+            try:
+                img = Image.open(path).convert("RGB")
+            except OSError:
+                continue
+            tensor, _, _ = letterbox(img, self.imgsz)
+            return {self.input_name: tensor[None]}
+        return None
+
+
+def detect_head_nodes(model: onnx.ModelProto) -> list:
+    """
+    Node của khối cuối (Detect head + DFL của YOLOv8, tên dạng /model.22/...).
+    Giữ FP32 cho khối này: toạ độ box rất nhạy với sai số quantize.
+    """
+    pattern = re.compile(r"^/model\.(\d+)/")
+    indices = [int(m.group(1)) for n in model.graph.node if (m := pattern.match(n.name))]
+    if not indices:
+        return []
+    last = f"/model.{max(indices)}/"
+    return [n.name for n in model.graph.node if n.name.startswith(last)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("version")
+    parser.add_argument("--mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--calib-dir", default=str(Path(settings.DATASET_ROOT) / "train"))
+    parser.add_argument("--max-images", type=int, default=200)
+    parser.add_argument("--quantize-head", action="store_true", help="quantize cả Detect head (nhanh hơn, kém chính xác hơn)")
+    parser.add_argument("--output", default="best.int8.onnx")
+    args = parser.parse_args()
+
+    model_dir = Path(EXPORTS_ROOT) / args.version
+    metadata = read_model_metadata(str(model_dir))
+    if not metadata:
+        raise SystemExit(f"Không có {model_dir}/metadata.json")
+
+    imgsz = (metadata.get("input_size") or [640])[0]
+    source = fp32_onnx_path(model_dir, metadata, imgsz)
+    output = model_dir / args.output
+    model = onnx.load(str(source))
+    exclude = [] if args.quantize_head else detect_head_nodes(model)
+
+    quant_info = {"mode": args.mode, "excluded_nodes": len(exclude)}
+    if args.mode == "dynamic":
+        quantize_dynamic(
+            str(source),
+            str(output),
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=exclude,
+        )
+    else:
+        files = calibration_files(Path(args.calib_dir), args.max_images)
+        if not files:
+            raise SystemExit(f"Không có ảnh calibration trong {args.calib_dir}")
+        print(f"Calibration: {len(files)} ảnh từ {args.calib_dir}")
+
+        # quant_pre_process: suy luận shape + gộp node giúp quantizer chọn đúng chỗ đặt QDQ
+        with tempfile.TemporaryDirectory() as tmp:
+            prepped = Path(tmp) / "prepped.onnx"
+            try:
+                from onnxruntime.quantization.shape_inference import quant_pre_process
+
+                quant_pre_process(str(source), str(prepped))
+            except Exception as e:
+                print(f"Bỏ qua quant_pre_process: {e}")
+                prepped = source
+
+            quantize_static(
+                str(prepped),
+                str(output),
+                CropCalibrationReader(files, model.graph.input[0].name, imgsz),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=CalibrationMethod.MinMax,
+                nodes_to_exclude=exclude,
+            )
+        quant_info["calibration_images"] = len(files)
+        quant_info["calibration_dir"] = args.calib_dir
+
+    size_mb = lambda p: round(os.path.getsize(p) / 2**20, 2)  # noqa: E731
+    metadata.setdefault("variants", {})["int8"] = {
+        "weights": output.name,
+        "backend": "onnx",
+        "source": source.name,
+        "quantization": quant_info,
+        "size_mb": size_mb(output),
+        "source_size_mb": size_mb(source),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        # metrics (map50_drop...) do bench_quantized_model.py ghi; chưa có → service không load
+        "metrics": None,
+    }
+    write_metadata(model_dir, metadata)
+    print(f"Đã tạo {output} ({size_mb(output)} MB, FP32 {size_mb(source)} MB)")
+    print(f"Tiếp theo: python bench_quantized_model.py {args.version} --write-metadata")
+
+
+if __name__ == "__main__":
+    main()
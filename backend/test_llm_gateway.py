@@ -0,0 +1,73 @@
+"""
+Kiểm tra circuit breaker của llm_gateway không bị kẹt half_open khi request thử
+không lấy được token rate limit (hết deadline / caller huỷ khi đang chờ token).
+
+Dùng (không gọi mạng):
+    LLM_BACKEND=fake python test_llm_gateway.py
+"""
+import asyncio
+import time
+
+from app.services.llm_gateway import FakeLLMBackend, LLMGateway, LLMUnavailableError, TokenBucket
+
+
+def make_half_open_gateway() -> LLMGateway:
+    gw = LLMGateway(FakeLLMBackend())
+    gw._ensure_loop()
+    # breaker đang mở và đã hết reset_s → request kế tiếp là request thử
+    gw.breaker.state = "open"
+    gw.breaker.opened_at = time.monotonic() - gw.breaker.reset_s - 1
+    # bucket rỗng, 5 token/giây → phải chờ ~0.2s mới có token
+    bucket = TokenBucket(rate=5, burst=1)
+    bucket._tokens = 0.0
+    gw._bucket = bucket
+    return gw
+
+
+def check_rate_limited_probe_recovers():
+    gw = make_half_open_gateway()
+    try:
+        gw.generate("x", timeout=0.05)
+        raise AssertionError("phải bị rate limit")
+    except LLMUnavailableError as e:
+        assert "giới hạn" in str(e), e
+    assert gw.breaker.state == "half_open"
+    assert not gw.breaker._probe_in_flight, "lượt thử half_open không được nhả"
+
+    time.sleep(0.3)
+    assert gw.generate("x", timeout=2)
+    assert gw.breaker.state == "closed"
+    print("rate_limited probe: OK", gw.stats()["breaker"])
+
+
+def check_cancelled_probe_recovers():
+    gw = make_half_open_gateway()
+    gw._bucket.rate = 1.0   # chờ ~1s cho token → kịp huỷ giữa chừng
+
+    async def consume():
+        async for _ in gw.astream("x", timeout=5):
+            pass
+
+    async def disconnect():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)
+        task.cancel()   # client SSE ngắt kết nối khi request thử đang chờ token
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.1)
+
+    asyncio.run(disconnect())
+    assert gw.breaker.state == "half_open"
+    assert not gw.breaker._probe_in_flight, "lượt thử half_open không được nhả"
+
+    time.sleep(1.0)
+    assert gw.generate("x", timeout=2)
+    assert gw.breaker.state == "closed"
+    print("cancelled probe: OK", gw.stats()["breaker"])
+
+
+if __name__ == "__main__":
+    check_rate_limited_probe_recovers()
+    check_cancelled_probe_recovers()
@@ -0,0 +1,17 @@
+import sys
+import json
+
+from app.services.inference_service import create_detector
+
+# Dùng: python test_onnx.py ../ml/exports/v1.0/best.onnx media/detections/.../anh.jpg
+model_path = sys.argv[1]
+image_path = sys.argv[2]
+
+det = create_detector(model_path)
+print("Backend:", det.backend)
+print("Names:", det.names)
+
+with open(image_path, "rb") as f:
+    result = det.predict_bytes(f.read())
+
+print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,7 @@
+-- 002: tóm tắt cuốn chiếu cho session chatbot (chat_context_service)
+-- Chạy 1 lần trên DB đã tạo bằng 001_schema.sql (MySQL).
+
+ALTER TABLE chatbot
+  ADD COLUMN summary                TEXT NULL,
+  ADD COLUMN summary_upto_detail_id BIGINT UNSIGNED NULL,
+  ADD COLUMN summary_updated_at     TIMESTAMP NULL;
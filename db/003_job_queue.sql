@@ -0,0 +1,26 @@
+-- 003: hàng đợi job bền vững (job_queue_service, worker: python -m app.worker)
+-- Chạy 1 lần trên DB đã tạo bằng 001_schema.sql.
+-- Chạy local không cần bảng này trong DB chính: đặt JOB_QUEUE_DATABASE_URL=sqlite:///./jobs.db (tự tạo bảng).
+
+CREATE TABLE jobs (
+  job_id           BIGINT UNSIGNED PRIMARY KEY AUTO_INCREMENT,
+  queue            VARCHAR(50)  NOT NULL,
+  kind             VARCHAR(100) NOT NULL,
+  payload          JSON NULL,
+  idempotency_key  VARCHAR(255) NULL,
+  status           VARCHAR(20)  NOT NULL DEFAULT 'queued',
+  priority         INT NOT NULL DEFAULT 0,
+  attempts         INT NOT NULL DEFAULT 0,
+  max_attempts     INT NOT NULL DEFAULT 5,
+  run_after        DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  lease_owner      VARCHAR(255) NULL,
+  lease_expires_at DATETIME NULL,
+  last_error       TEXT NULL,
+  result           JSON NULL,
+  created_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  started_at       DATETIME NULL,
+  finished_at      DATETIME NULL,
+  UNIQUE KEY uq_jobs_idempotency (idempotency_key),
+  KEY idx_jobs_claim (queue, status, run_after),
+  KEY idx_jobs_finished (status, finished_at)
+) ENGINE=InnoDB;